@@ -1,26 +1,36 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 import logging
-from database import Database
-from google_sheets import GoogleSheetsManager
+from database import get_database
+from async_database import get_async_database
+from google_sheets import get_sheets_manager
+from inventory import INVENTORY_BACKEND, get_available_email_count, get_inventory_backend, get_inventory_preview, get_prefetch_buffer
+from sheets_journal import get_sheets_journal
+from inventory_import import IMPORT_MAX_FILE_BYTES, SUPPORTED_EXTENSIONS, InventoryImporter, add_new_emails, parse_import_line
+from email_index import get_email_index
 from keyboards import *
 from config import *
 from settings_manager import settings_manager
 import math
 import datetime
+import asyncio
+import os
+import tempfile
+
+# Chu kỳ cập nhật tin nhắn tiến độ khi nhập kho từ file (giây)
+IMPORT_PROGRESS_INTERVAL = 2
 
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Hiển thị thống kê hệ thống"""
     query = update.callback_query
     await query.answer()
     
-    db = Database(DATABASE_FILE)
-    stats = db.get_stats()
+    db = get_async_database(DATABASE_FILE)
+    stats = await db.get_stats()
     
     # Lấy số lượng email trong kho
     try:
-        sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-        email_count = sheets.get_email_count()
+        email_count = await asyncio.to_thread(get_available_email_count)
     except:
         email_count = "N/A"
     
@@ -48,9 +58,8 @@ async def admin_view_emails(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     try:
-        sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-        email_count = sheets.get_email_count()
-        emails_preview = sheets.get_all_emails_preview(10)
+        email_count = await asyncio.to_thread(get_available_email_count)
+        emails_preview = await asyncio.to_thread(get_inventory_preview, 10)
         
         text = f"📧 **KHO EMAIL**\n\n"
         text += f"📊 Tổng số email: **{email_count}**\n\n"
@@ -58,6 +67,10 @@ async def admin_view_emails(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if emails_preview:
             text += "📋 **10 email đầu tiên:**\n"
             for i, (email, password) in enumerate(emails_preview, 1):
+                if not email or not password:
+                    # Dòng thiếu email/password ở đầu kho (sẽ bị bỏ qua khi bán)
+                    text += f"`{i}.` (dòng lỗi)\n"
+                    continue
                 text += f"`{i}.` {email[:20]}{'...' if len(email) > 20 else ''}:{password[:10]}{'...' if len(password) > 10 else ''}\n"
         else:
             text += "❌ Kho email trống!"
@@ -83,7 +96,8 @@ email3@gmail.com:password3
 
 📝 **Lưu ý:**
 • Mỗi dòng một email:password
-• Tối đa 100 email/lần
+• Tối đa 100 email/lần khi gửi tin nhắn
+• Số lượng lớn: gửi file .txt hoặc .csv (email,password)
 • Dùng /cancel để hủy
 
 Vui lòng gửi danh sách email:"""
@@ -110,33 +124,24 @@ async def process_admin_add_emails(update: Update, context: ContextTypes.DEFAULT
         return
     
     # Thông báo bắt đầu xử lý
-    processing_msg = await update.message.reply_text(f"⏳ Đang thêm {len(emails)} email vào kho...\n💡 Vui lòng chờ để tránh rate limit!")
+    processing_msg = await update.message.reply_text(f"⏳ Đang thêm {len(emails)} email vào kho...")
     
     try:
-        sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-        
-        # Kiểm tra rate limit trước khi thêm
-        operations_needed = (len(emails) + 2) // 3  # Số batch cần thiết
-        if not sheets.is_rate_limit_safe(operations_needed):
-            await processing_msg.edit_text(
-                f"⚠️ **Rate limit warning!**\n\n"
-                f"Cần {operations_needed} operations để thêm {len(emails)} email.\n"
-                f"Hiện tại đã sử dụng nhiều quota, vui lòng chờ 1-2 phút rồi thử lại.\n\n"
-                f"💡 Hoặc giảm số lượng email xuống ≤9 email để thêm ngay.",
-                reply_markup=get_admin_emails_keyboard(),
-                parse_mode='Markdown'
-            )
-            return
-        
-        # Sử dụng batch processing để tránh rate limit
-        added_count = sheets.add_emails_batch(emails, batch_size=3)  # Giảm batch size xuống 3
+        # Bỏ email đã từng nhập hoặc đã bán, phần còn lại thêm vào kho đang cấu hình
+        rows = [row for row in map(parse_import_line, emails) if row]
+        added_count = await asyncio.to_thread(add_new_emails, get_inventory_backend(), rows)
+        duplicate_count = len(rows) - added_count
         
         if added_count > 0:
             success_text = f"✅ **Đã thêm thành công {added_count}/{len(emails)} email vào kho!**"
-            if added_count < len(emails):
-                success_text += f"\n⚠️ {len(emails) - added_count} email bị lỗi do rate limit, vui lòng thử lại sau."
+            if INVENTORY_BACKEND == "sheets":
+                success_text += "\n⏳ Email sẽ được đẩy lên Google Sheets trong nền."
         else:
-            success_text = "❌ Không thể thêm email. Có thể do rate limit hoặc lỗi kết nối!"
+            success_text = "❌ Không có email mới nào được thêm."
+        if duplicate_count:
+            success_text += f"\n🔁 Bỏ qua {duplicate_count} email đã có trong kho hoặc đã bán."
+        if len(emails) > len(rows):
+            success_text += f"\n⚠️ Bỏ qua {len(emails) - len(rows)} dòng sai định dạng."
             
         # Cập nhật message
         await processing_msg.edit_text(success_text, reply_markup=get_admin_emails_keyboard(), parse_mode='Markdown')
@@ -175,7 +180,7 @@ async def admin_deposits(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     pending_deposits = db.get_pending_deposits()
     
     if not pending_deposits:
@@ -214,16 +219,12 @@ async def approve_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     transaction_id = int(query.data.split('_')[2])
     
-    db = Database(DATABASE_FILE)
-    success = db.approve_deposit(transaction_id)
+    db = get_async_database(DATABASE_FILE)
+    success = await db.approve_deposit(transaction_id)
     
     if success:
         # Lấy thông tin giao dịch để thông báo user
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, amount FROM transactions WHERE id = ?', (transaction_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = await db.get_transaction(transaction_id)
         
         if result:
             user_id, amount = result
@@ -251,14 +252,10 @@ async def reject_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     transaction_id = int(query.data.split('_')[2])
     
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     
     # Lấy thông tin giao dịch trước khi từ chối
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, amount FROM transactions WHERE id = ?', (transaction_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = db.get_transaction(transaction_id)
     
     db.reject_deposit(transaction_id)
     
@@ -284,29 +281,37 @@ async def admin_list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    # Lấy trang hiện tại
-    if query.data == 'admin_list_users':
-        page = 1
-    elif query.data.startswith('admin_list_users_'):
+    # Lấy vị trí trang từ callback: admin_list_users_{p|n}_{trang}_{cursor}
+    page = 1
+    after_cursor = None
+    before_cursor = None
+    if query.data.startswith('admin_list_users_'):
         try:
-            page = int(query.data.split('_')[-1])
+            _, direction, page_text, cursor = query.data.rsplit('_', 3)
+            page = int(page_text)
+            if direction == 'n':
+                after_cursor = cursor
+            elif direction == 'p':
+                before_cursor = cursor
         except ValueError:
             page = 1
-    else:
-        page = 1
-    
-    db = Database(DATABASE_FILE)
-    all_users = db.get_all_users()
     
     users_per_page = 10
-    total_pages = math.ceil(len(all_users) / users_per_page)
-    start_idx = (page - 1) * users_per_page
-    end_idx = start_idx + users_per_page
-    current_users = all_users[start_idx:end_idx]
+    db = get_async_database(DATABASE_FILE)
+    try:
+        result = await db.list_users_page(after_cursor, users_per_page, before_cursor=before_cursor)
+    except ValueError:
+        # Cursor hỏng: quay về trang đầu
+        page = 1
+        result = await db.list_users_page(None, users_per_page)
+    
+    if result['prev_cursor'] is None:
+        page = 1
+    total_pages = max(1, math.ceil(await db.count_users() / users_per_page))
     
     text = f"👥 **DANH SÁCH USER** (Trang {page}/{total_pages})\n\n"
     
-    for user in current_users:
+    for user in result['users']:
         user_id, username, first_name, balance, created_at, is_banned = user
         user_name = username or first_name or f"User {user_id}"
         status = "🚫" if is_banned else "✅"
@@ -314,7 +319,8 @@ async def admin_list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text += f"{status} **{user_name}** (`{user_id}`)\n"
         text += f"💰 {balance:,} VND | 📅 {created_at[:10]}\n\n"
     
-    keyboard = get_pagination_keyboard(page, total_pages, "admin_list_users")
+    keyboard = get_pagination_keyboard(page, total_pages, "admin_list_users",
+                                       prev_cursor=result['prev_cursor'], next_cursor=result['next_cursor'])
     await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
 
 async def admin_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -370,8 +376,7 @@ async def admin_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Lấy thông tin cài đặt hiện tại
     try:
-        sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-        email_count = sheets.get_email_count()
+        email_count = await asyncio.to_thread(get_available_email_count)
         sheets_status = "✅ Kết nối"
     except:
         email_count = "N/A"
@@ -622,7 +627,7 @@ async def admin_edit_price_action(update: Update, context: ContextTypes.DEFAULT_
     
     transaction_id = int(query.data.split('_')[2])
     
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     deposit = db.get_deposit(transaction_id)
     
     if not deposit:
@@ -695,7 +700,7 @@ async def admin_edit_bank_name_action(update: Update, context: ContextTypes.DEFA
     
     transaction_id = int(query.data.split('_')[2])
     
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     deposit = db.get_deposit(transaction_id)
     
     if not deposit:
@@ -727,7 +732,7 @@ async def admin_edit_account_number_action(update: Update, context: ContextTypes
     
     transaction_id = int(query.data.split('_')[2])
     
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     deposit = db.get_deposit(transaction_id)
     
     if not deposit:
@@ -759,7 +764,7 @@ async def admin_edit_account_name_action(update: Update, context: ContextTypes.D
     
     transaction_id = int(query.data.split('_')[2])
     
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     deposit = db.get_deposit(transaction_id)
     
     if not deposit:
@@ -987,7 +992,7 @@ async def process_user_id_input(update: Update, context: ContextTypes.DEFAULT_TY
         context.user_data.pop('waiting_for_user_id', None)
         
         # Kiểm tra user có tồn tại không
-        db = Database(DATABASE_FILE)
+        db = get_database(DATABASE_FILE)
         user_info = db.get_user_info(target_user_id)
         
         if user_info:
@@ -1028,7 +1033,7 @@ Nhập số tiền:"""
 
 async def handle_ban_unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE, target_user_id: int):
     """Xử lý ban/unban user"""
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     
     # Kiểm tra user có tồn tại không
     user_info = db.get_user_info(target_user_id)
@@ -1094,7 +1099,7 @@ async def process_balance_amount_input(update: Update, context: ContextTypes.DEF
         return
     
     # Cộng tiền cho user
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     db.update_balance(target_user_id, amount)
     
     # Thêm giao dịch vào lịch sử
@@ -1144,8 +1149,9 @@ async def admin_view_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    db = Database(DATABASE_FILE)
-    orders = db.get_all_orders()
+    db = get_async_database(DATABASE_FILE)
+    result = await db.list_orders_with_discounts(limit=20)
+    orders = result['orders']
     
     if not orders:
         text = """📦 **QUẢN LÝ ĐƠN HÀNG**
@@ -1158,8 +1164,8 @@ async def admin_view_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 """
         
-        for i, order in enumerate(orders[:20], 1):  # Hiển thị 20 đơn gần nhất
-            order_id, user_id, username, first_name, email_quantity, total_amount, status, created_at = order
+        for i, order in enumerate(orders, 1):  # 20 đơn gần nhất
+            order_id, user_id, username, first_name, email_quantity, total_amount, status, created_at, claimed_amount, eligible_amount = order
             
             # Tên hiển thị user
             if username:
@@ -1169,20 +1175,11 @@ async def admin_view_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 user_display = f"ID:{user_id}"
             
-            # Kiểm tra đã nhận discount chưa
-            conn = db.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT discount_amount FROM discounts WHERE order_id = ?', (order_id,))
-            discount_record = cursor.fetchone()
-            conn.close()
-            
             discount_status = ""
-            if discount_record:
-                discount_status = f" (Đã claim: {discount_record[0]:,}đ)"
-            else:
-                discount_amount = db.get_discount_amount(email_quantity)
-                if discount_amount > 0:
-                    discount_status = f" (Có thể claim: {discount_amount:,}đ)"
+            if claimed_amount is not None:
+                discount_status = f" (Đã claim: {claimed_amount:,}đ)"
+            elif eligible_amount > 0:
+                discount_status = f" (Có thể claim: {eligible_amount:,}đ)"
             
             text += f"""**{i}. Order ID:** {order_id}
 👤 User: {user_display} (ID: {user_id})
@@ -1408,19 +1405,72 @@ async def process_remove_discount_quantity_input(update: Update, context: Contex
     # Xóa trạng thái chờ input
     context.user_data.pop('waiting_for_remove_discount_quantity', None)
 
+async def process_admin_import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Nhập kho hàng loạt từ file .txt/.csv, báo tiến độ trong lúc xử lý"""
+    context.user_data['waiting_for_emails'] = False
+    document = update.message.document
+    
+    file_name = (document.file_name or '').lower()
+    if not file_name.endswith(SUPPORTED_EXTENSIONS):
+        await update.message.reply_text("❌ Chỉ hỗ trợ file .txt hoặc .csv!")
+        return
+    
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_BYTES:
+        await update.message.reply_text(f"❌ File quá lớn! Tối đa {IMPORT_MAX_FILE_BYTES // (1024 * 1024)} MB/file.")
+        return
+    
+    progress_msg = await update.message.reply_text(f"⏳ Đang tải file {document.file_name}...")
+    
+    suffix = os.path.splitext(file_name)[1]
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        
+        importer = InventoryImporter(get_inventory_backend(), await asyncio.to_thread(get_email_index))
+        task = asyncio.ensure_future(asyncio.to_thread(importer.import_file, path))
+        last_text = None
+        while not task.done():
+            await asyncio.wait({task}, timeout=IMPORT_PROGRESS_INTERVAL)
+            progress = importer.get_progress()
+            text = (f"⏳ Đang nhập kho... đã xử lý {progress['processed']:,} dòng\n"
+                    f"✅ Hợp lệ: {progress['accepted']:,} | ❌ Lỗi: {progress['rejected']:,} | "
+                    f"🔁 Trùng: {progress['duplicates']:,}")
+            if not task.done() and text != last_text:
+                await progress_msg.edit_text(text)
+                last_text = text
+        
+        report = task.result()
+        text = f"""✅ **NHẬP KHO HOÀN TẤT**
+
+📄 **File:** {document.file_name}
+📊 **Đã xử lý:** {report['processed']:,} dòng
+✅ **Hợp lệ:** {report['accepted']:,} email
+❌ **Sai định dạng:** {report['rejected']:,} dòng
+🔁 **Trùng lặp:** {report['duplicates']:,} dòng
+📦 **Số lần ghi vào kho:** {report['chunks']:,}"""
+        await progress_msg.edit_text(text, reply_markup=get_admin_emails_keyboard(), parse_mode='Markdown')
+        
+    except Exception as e:
+        logging.error(f"Lỗi nhập kho từ file {document.file_name}: {e}")
+        await progress_msg.edit_text(f"❌ Lỗi nhập kho từ file: {str(e)}", reply_markup=get_admin_emails_keyboard())
+    finally:
+        os.remove(path)
+
 async def admin_sheets_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Xem trạng thái Google Sheets"""
     query = update.callback_query
     await query.answer()
     
     try:
-        sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-        status = sheets.get_sheet_status()
+        sheets = get_sheets_manager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
+        status = await asyncio.to_thread(sheets.get_sheet_status)
         
         if status["status"] == "connected":
             # Tính toán rate limit status
             rate_limit_info = ""
-            if "write_count_in_window" in status:
+            if "remaining_quota" in status:
                 remaining = status.get("remaining_quota", 0)
                 reset_time = status.get("window_reset_in", 0)
                 
@@ -1431,23 +1481,52 @@ async def admin_sheets_status(update: Update, context: ContextTypes.DEFAULT_TYPE
                 else:
                     rate_limit_info = f"\n✅ **Rate Limit:** {remaining} requests khả dụng"
             
+            journal = await asyncio.to_thread(get_sheets_journal().get_stats)
+            journal_info = f"\n📝 **Nhật ký chờ ghi:** {journal['depth']:,} thao tác"
+            if journal['depth']:
+                journal_info += f" (trễ {journal['lag_seconds']:.0f}s)"
+            if journal['head_attempts']:
+                journal_info += f"\n⚠️ **Lỗi ghi gần nhất:** {journal['last_error']} (đã thử {journal['head_attempts']} lần)"
+            if journal['dead_letters']:
+                journal_info += f"\n🚫 **Thao tác bị bỏ:** {journal['dead_letters']:,} (bảng sheets_journal_dead)"
+            waits = ", ".join(f"{name} {stats['avg_wait']:.1f}s" for name, stats in status['scheduler'].items() if stats['requests'])
+            if waits:
+                journal_info += f"\n⏳ **Chờ quota trung bình:** {waits}"
+            credentials = status['credentials']
+            if len(credentials) > 1:
+                healthy = sum(1 for credential in credentials if credential['healthy'])
+                journal_info += f"\n🔑 **Credential:** {healthy}/{len(credentials)} đang phục vụ"
+                for credential in credentials:
+                    if not credential['healthy']:
+                        reason = f"tạm ngưng {credential['drained_for']:.0f}s" if credential['connected'] else "mất kết nối"
+                        journal_info += f"\n  • {credential['name']}: {reason}"
+            batch = status['batch']
+            if batch['batches']:
+                journal_info += (f"\n🧺 **Gộp ghi:** {batch['requests']:,} thao tác trong {batch['batches']:,} batchUpdate "
+                                 f"(trung bình {batch['avg_requests_per_batch']:.1f})")
+            
+            if INVENTORY_BACKEND != "sqlite":
+                buffer = await asyncio.to_thread(get_prefetch_buffer().get_stats)
+                journal_info += (f"\n📦 **Bộ đệm email:** {buffer['depth']:,} "
+                                 f"(nạp khi < {buffer['low_watermark']}, tối đa {buffer['high_watermark']})"
+                                 f"\n⚡ **Tốc độ nạp:** {buffer['refill_rate_per_minute']:,} email/phút")
+            
             text = f"""📊 **TRẠNG THÁI GOOGLE SHEETS**
 
 ✅ **Kết nối:** Thành công
 📧 **Số lượng email:** {status['email_count']:,}
 📄 **Sheet:** {status['sheet_title']}
-🕒 **Cập nhật lần cuối:** {status['last_update']}{rate_limit_info}
+🕒 **Cập nhật lần cuối:** {status['last_update']}{rate_limit_info}{journal_info}
 
 💡 **Lưu ý về Rate Limit:**
-• Google Sheets giới hạn 60 write requests/phút
-• Hệ thống tự động delay 2 giây giữa các thao tác
-• Nếu vượt quá, hệ thống sẽ retry sau 45-225 giây
-• Batch size tự động giảm xuống 3 email/lần
+• Google Sheets giới hạn {status['requests_per_minute']} requests/phút
+• Hệ thống tự xếp hàng request theo quota, không làm treo bot
+• Nếu vượt quá, hệ thống sẽ retry với thời gian chờ tăng dần (tối đa ~1 phút)
+• Đã gửi {status['request_count']:,} requests, bị giới hạn {status['rate_limited_count']:,} lần
 
 ⚠️ **Khuyến nghị:**
-• Thêm email theo batch nhỏ (≤15 email/lần)
-• Tránh thêm email liên tục trong thời gian ngắn
-• Kiên nhẫn chờ khi có thông báo rate limit"""
+• Email thêm vào được ghi nhật ký trước rồi đẩy lên sheet trong nền
+• Nhật ký trễ lâu thường do rate limit hoặc lỗi quyền truy cập sheet"""
             
         elif status["status"] == "error":
             text = f"""❌ **LỖI GOOGLE SHEETS**
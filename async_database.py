@@ -0,0 +1,95 @@
+"""
+AsyncDatabase - Facade bất đồng bộ cho Database
+
+Các method giữ nguyên tên và tham số như Database nhưng trả về awaitable:
+ghi chạy trên một thread writer riêng, đọc chạy trên một pool thread nhỏ,
+nên truy vấn SQLite không còn chặn event loop của bot.
+
+Khi Database bật group commit, lệnh ghi được đưa thẳng vào hàng đợi của
+GroupCommitWriter (không chiếm thread nào trong lúc chờ) để các handler
+chạy đồng thời được commit chung một transaction.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Database, get_database, POOL_SIZE
+
+# Các method chỉ đọc - chạy song song trên pool reader
+READ_METHODS = {
+    'get_user',
+    'get_balance',
+    'get_transaction',
+    'get_pending_deposits',
+    'get_user_transactions',
+    'get_user_purchases',
+    'get_stats',
+    'list_users_page',
+    'count_users',
+    'is_user_banned',
+    'get_user_info',
+    'get_order_info',
+    'get_user_orders',
+    'get_order_discount',
+    'check_discount_eligibility',
+    'get_all_orders',
+    'count_inventory',
+    'get_inventory_preview',
+    'get_inventory_stats',
+    'list_orders_with_discounts',
+    'get_sheet_journal_stats',
+    'count_indexed_emails',
+    'get_setting',
+    'get_schema_version',
+    'explain_query_plan',
+}
+
+class AsyncDatabase:
+    """Bọc Database: mọi method trả về coroutine thay vì chặn event loop"""
+
+    def __init__(self, db: Database, reader_threads: int = POOL_SIZE - 1):
+        self.db = db
+        # Một writer duy nhất: các lệnh ghi được tuần tự hóa, không tranh khóa ghi của SQLite
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix='db-reader')
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        transaction_body = getattr(attr, 'transaction_body', None)
+        if transaction_body is not None and self.db.writer is not None:
+            @functools.wraps(attr)
+            async def submit(*args, **kwargs):
+                return await asyncio.wrap_future(self.db.submit_write(transaction_body, *args, **kwargs))
+
+            return submit
+
+        # Method không rõ loại mặc định chạy trên writer cho an toàn
+        executor = self._readers if name in READ_METHODS else self._writer
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(attr, *args, **kwargs))
+
+        return call
+
+    def shutdown(self, wait: bool = True):
+        """Dừng các thread writer/reader"""
+        self._writer.shutdown(wait=wait)
+        self._readers.shutdown(wait=wait)
+
+_async_databases = {}
+_async_databases_lock = threading.Lock()
+
+def get_async_database(db_file: str) -> AsyncDatabase:
+    """Lấy AsyncDatabase dùng chung, bọc instance Database dùng chung của file"""
+    with _async_databases_lock:
+        adb = _async_databases.get(db_file)
+        if adb is None:
+            adb = AsyncDatabase(get_database(db_file))
+            _async_databases[db_file] = adb
+        return adb
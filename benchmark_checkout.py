@@ -0,0 +1,110 @@
+"""
+Benchmark checkout - đo đường mua hàng với từng inventory backend, chạy offline
+
+Mỗi backend dùng database tạm và kho được nạp sẵn; nhiều thread mua song song
+giống confirm_purchase: nạp bộ đệm khi thiếu, giữ chỗ theo lease rồi thanh toán.
+Backend "sheets" cần Google thật nên không có trong benchmark.
+
+Chạy:
+    python benchmark_checkout.py
+    python benchmark_checkout.py --orders 2000 --quantity 3 --threads 8 --backends memory sqlite
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from database import Database
+from inventory import PrefetchBuffer
+from inventory_backends import FileBackend, MemoryBackend, SQLiteBackend
+
+BACKENDS = ("memory", "file", "sqlite")
+
+def create_backend(name: str, db: Database, tmp_dir: str):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "file":
+        return FileBackend(os.path.join(tmp_dir, "inventory.txt"))
+    return SQLiteBackend(db)
+
+def benchmark_backend(name: str, orders: int, quantity: int, threads: int) -> dict:
+    """Chạy orders đơn hàng quantity email trên backend name, trả về throughput và độ trễ"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = Database(os.path.join(tmp_dir, "benchmark.db"))
+        backend = create_backend(name, db, tmp_dir)
+        backend.append_many([(f"user{i}@example.com", f"pass{i}") for i in range(orders * quantity)])
+        for user_id in range(threads):
+            db.add_user(user_id, f"user{user_id}", f"User {user_id}")
+            db.update_balance(user_id, orders * quantity * 1000)
+
+        buffer = None if name == "sqlite" else PrefetchBuffer(db, backend, low_watermark=quantity * threads * 2,
+                                                               high_watermark=quantity * threads * 8)
+        stop = threading.Event()
+
+        def refill_loop():
+            while not stop.is_set():
+                buffer.refill()
+                time.sleep(0.01)
+
+        latencies = []
+        latencies_lock = threading.Lock()
+        per_thread = orders // threads
+
+        def buyer(user_id):
+            for i in range(per_thread):
+                started = time.perf_counter()
+                if buffer and db.count_inventory() < quantity:
+                    buffer.refill(quantity)
+                order_key = f"{user_id}:{i}"
+                if db.reserve_inventory(quantity, order_key, 60):
+                    db.commit_reservation(order_key, user_id, 1000)
+                with latencies_lock:
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+        refiller = threading.Thread(target=refill_loop, daemon=True) if buffer else None
+        if refiller:
+            refiller.start()
+        workers = [threading.Thread(target=buyer, args=(t,)) for t in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        if refiller:
+            refiller.join()
+
+        stats = db.get_inventory_stats()
+        db.pool.close_all()
+
+    latencies.sort()
+    return {
+        'backend': name,
+        'orders_per_sec': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies),
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1],
+        'sold': stats['sold']
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark đường mua hàng với các inventory backend")
+    parser.add_argument("--orders", type=int, default=1000, help="Tổng số đơn hàng")
+    parser.add_argument("--quantity", type=int, default=2, help="Số email mỗi đơn")
+    parser.add_argument("--threads", type=int, default=4, help="Số người mua song song")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS, help="Các backend cần so sánh")
+    args = parser.parse_args()
+
+    print(f"{'Backend':<10}{'Đơn/giây':>12}{'p50':>12}{'p95':>12}{'Đã bán':>10}")
+    for name in args.backends:
+        result = benchmark_backend(name, args.orders, args.quantity, args.threads)
+        print(f"{name:<10}"
+              f"{result['orders_per_sec']:>12,.0f}"
+              f"{result['p50_ms']:>10.3f}ms"
+              f"{result['p95_ms']:>10.3f}ms"
+              f"{result['sold']:>10,}")
+
+if __name__ == '__main__':
+    main()
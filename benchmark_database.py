@@ -0,0 +1,163 @@
+"""
+Benchmark SQLite - so sánh các profile hiệu năng của Database
+
+Chạy:
+    python benchmark_database.py
+    python benchmark_database.py --writes 5000 --threads 8 --profiles default performance
+    python benchmark_database.py --explain
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from database import Database, SQLITE_PROFILES
+
+def run_writes(db: Database, total_writes: int, threads: int) -> float:
+    """Ghi giao dịch song song từ nhiều thread, trả về số lần ghi/giây"""
+    per_thread = total_writes // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            user_id = offset * per_thread + i % 100
+            db.add_transaction(user_id, "deposit", 50000, "benchmark", "pending")
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    started = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - started
+
+    return (per_thread * threads) / elapsed
+
+def run_reads(db: Database, reads: int, concurrent_writes: bool) -> dict:
+    """Đo độ trễ đọc lịch sử giao dịch, có thể kèm một writer chạy song song"""
+    stop = threading.Event()
+    busy_errors = 0
+
+    def background_writer():
+        while not stop.is_set():
+            db.add_transaction(0, "purchase", -50000, "benchmark", "approved")
+            # Nhịp ghi ~1000 lần/giây, tránh writer chiếm khóa liên tục
+            time.sleep(0.001)
+
+    writer = threading.Thread(target=background_writer)
+    if concurrent_writes:
+        writer.start()
+
+    latencies = []
+    try:
+        for i in range(reads):
+            started = time.perf_counter()
+            try:
+                db.get_user_transactions(i % 100)
+            except sqlite3.OperationalError:
+                # "database is locked": reader bị writer chặn quá busy timeout
+                busy_errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        stop.set()
+        if concurrent_writes:
+            writer.join()
+
+    latencies.sort()
+    return {
+        'p50_ms': statistics.median(latencies),
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1],
+        'max_ms': latencies[-1],
+        'busy_errors': busy_errors
+    }
+
+# Các truy vấn nóng và index chúng phải dùng: (tên, SQL, tham số, index mong đợi)
+QUERY_PLAN_CHECKS = [
+    ("get_user_transactions",
+     "SELECT type, amount, description, status, created_at FROM transactions "
+     "WHERE user_id = ? ORDER BY created_at DESC LIMIT 20",
+     (1,), "idx_transactions_user_created"),
+    ("get_pending_deposits",
+     "SELECT t.id, t.user_id, u.username, u.first_name, t.amount, t.created_at FROM transactions t "
+     "JOIN users u ON t.user_id = u.user_id WHERE t.type = 'deposit' AND t.status = 'pending' "
+     "ORDER BY t.created_at ASC",
+     (), "idx_transactions_pending_deposits"),
+    ("get_user_purchases",
+     "SELECT email, password, price, created_at FROM purchases WHERE user_id = ? ORDER BY created_at DESC LIMIT 10",
+     (1,), "idx_purchases_user_created"),
+    ("get_user_orders",
+     "SELECT order_id, email_quantity, total_amount, status, created_at FROM orders "
+     "WHERE user_id = ? ORDER BY created_at DESC",
+     (1,), "idx_orders_user_created"),
+    ("list_users_page",
+     "SELECT user_id, username, first_name, balance, created_at, is_banned FROM users "
+     "WHERE (created_at, user_id) < (?, ?) ORDER BY created_at DESC, user_id DESC LIMIT 11",
+     ("2024-01-01 00:00:00", 1), "idx_users_created"),
+    ("list_orders_with_discounts",
+     "SELECT o.id, o.order_id, o.user_id, u.username, u.first_name, o.email_quantity, o.total_amount, "
+     "o.status, o.created_at, d.discount_amount FROM orders o "
+     "LEFT JOIN users u ON o.user_id = u.user_id LEFT JOIN discounts d ON d.order_id = o.order_id "
+     "ORDER BY o.created_at DESC, o.id DESC LIMIT 21",
+     (), "idx_orders_created"),
+    ("get_order_discount",
+     "SELECT discount_amount FROM discounts WHERE order_id = ?",
+     ("ORD00000000",), "idx_discounts_order_id"),
+]
+
+def check_query_plans(db: Database) -> bool:
+    """Kiểm tra EXPLAIN QUERY PLAN của các truy vấn nóng có dùng đúng index không"""
+    all_ok = True
+    for name, sql, params, index_name in QUERY_PLAN_CHECKS:
+        plan = db.explain_query_plan(sql, params)
+        # Phải dùng đúng index và không cần sort tạm (TEMP B-TREE) cho ORDER BY
+        ok = any(index_name in step for step in plan) and not any("TEMP B-TREE" in step for step in plan)
+        all_ok = all_ok and ok
+        print(f"{'✅' if ok else '❌'} {name:<28} {' | '.join(plan)}")
+    return all_ok
+
+def benchmark_profile(profile: str, writes: int, reads: int, threads: int) -> dict:
+    """Chạy benchmark trên một database tạm với profile cho trước"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = Database(os.path.join(tmp_dir, "benchmark.db"), profile=profile)
+        for user_id in range(100):
+            db.add_user(user_id, f"user{user_id}", f"User {user_id}")
+
+        result = {
+            'profile': profile,
+            'writes_per_sec': run_writes(db, writes, threads),
+            'read_idle': run_reads(db, reads, concurrent_writes=False),
+            'read_under_write': run_reads(db, reads, concurrent_writes=True)
+        }
+        db.pool.close_all()
+        return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các SQLite profile của Database")
+    parser.add_argument("--writes", type=int, default=2000, help="Tổng số lần ghi")
+    parser.add_argument("--reads", type=int, default=2000, help="Số lần đọc cho mỗi kịch bản")
+    parser.add_argument("--threads", type=int, default=4, help="Số thread ghi song song")
+    parser.add_argument("--profiles", nargs="+", default=list(SQLITE_PROFILES), help="Các profile cần so sánh")
+    parser.add_argument("--explain", action="store_true", help="Chỉ kiểm tra query plan của các truy vấn nóng")
+    args = parser.parse_args()
+
+    if args.explain:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db = Database(os.path.join(tmp_dir, "explain.db"))
+            ok = check_query_plans(db)
+            db.pool.close_all()
+        raise SystemExit(0 if ok else 1)
+
+    print(f"{'Profile':<14}{'Ghi/giây':>12}{'Đọc p50':>12}{'Đọc p95':>12}{'p95 khi ghi':>14}{'Lỗi khóa':>10}")
+    for profile in args.profiles:
+        result = benchmark_profile(profile, args.writes, args.reads, args.threads)
+        print(f"{profile:<14}"
+              f"{result['writes_per_sec']:>12,.0f}"
+              f"{result['read_idle']['p50_ms']:>10.3f}ms"
+              f"{result['read_idle']['p95_ms']:>10.3f}ms"
+              f"{result['read_under_write']['p95_ms']:>12.3f}ms"
+              f"{result['read_under_write']['busy_errors']:>10}")
+
+if __name__ == '__main__':
+    main()
@@ -8,10 +8,40 @@ ADMIN_ID = 123456789  # Telegram ID của admin
 
 # Database
 DATABASE_URL = "gmail_bot.db"  # SQLite database file
+SQLITE_PROFILE = "performance"  # "performance" (WAL, synchronous=NORMAL, mmap) hoặc "default"
+GROUP_COMMIT_ENABLED = True  # Gom các lệnh ghi đồng thời vào một transaction
+GROUP_COMMIT_WINDOW_MS = 5  # Thời gian chờ gom lệnh ghi (ms)
+GROUP_COMMIT_MAX_BATCH = 200  # Số lệnh ghi tối đa mỗi lần commit
 
 # Google Sheets Configuration
 GOOGLE_SHEETS_ID = "your_google_sheets_id_here"
-GOOGLE_CREDENTIALS_FILE = "credentials.json"
+GOOGLE_CREDENTIALS_FILE = "credentials.json"  # Hoặc danh sách file service account (mỗi file có quota riêng), ví dụ ["sa1.json", "sa2.json"]
+SHEETS_REQUESTS_PER_MINUTE = 60  # Quota Google Sheets API mỗi phút của mỗi credential (token bucket)
+SHEETS_CHECKOUT_RESERVE = 2  # Số token của bucket chỉ dành cho mua hàng (đếm kho, nhập kho, xem trước phải chừa lại)
+SHEETS_CONSUME_MODE = "delete"  # "delete": xóa dòng khi lấy; "mark": ghi "consumed" vào cột C:D rồi nén mỗi ngày
+SHEETS_COMPACT_HOUR = 4  # Giờ chạy nén sheet (xóa đoạn đầu đã đánh dấu) ở chế độ "mark"
+SHEETS_BATCH_WINDOW_MS = 200  # Thời gian gom các thao tác ghi thành một batchUpdate (ms)
+SHEETS_BATCH_MAX_REQUESTS = 100  # Số thao tác tối đa trong một batchUpdate
+SHEETS_BATCH_MAX_BYTES = 8 * 1024 * 1024  # Kích thước JSON tối đa của một batchUpdate (Google giới hạn 10 MB)
+SHEETS_JOURNAL_INTERVAL = 5  # Chu kỳ gửi nhật ký ghi lên Google Sheets (giây)
+SHEETS_JOURNAL_BATCH_ROWS = 500  # Số dòng tối đa mỗi lệnh append_rows khi gửi nhật ký
+SHEETS_JOURNAL_MAX_ATTEMPTS = 10  # Số lần gửi lỗi trước khi chuyển thao tác sang sheets_journal_dead
+
+# Inventory (kho email)
+INVENTORY_BACKEND = "sheets"  # "sheets" (kho trên sheet), "sqlite" (kho cục bộ, sheet đồng bộ nền), "file" hoặc "memory" (offline)
+INVENTORY_FILE = "inventory.txt"  # File kho cho INVENTORY_BACKEND = "file" (mỗi dòng email:password)
+INVENTORY_SYNC_INTERVAL = 30  # Chu kỳ đồng bộ kho cục bộ với sheet (giây)
+INVENTORY_SYNC_BATCH = 500  # Số dòng đọc/xóa trên sheet mỗi request
+INVENTORY_LEASE_SECONDS = 120  # Thời gian giữ chỗ email cho một đơn đang thanh toán (giây)
+INVENTORY_PREFETCH_LOW = 20  # Backend "sheets": nạp thêm bộ đệm khi còn ít hơn số email này
+INVENTORY_PREFETCH_HIGH = 100  # Backend "sheets": số email tối đa lấy sẵn từ sheet vào bộ đệm
+INVENTORY_PREFETCH_INTERVAL = 5  # Chu kỳ kiểm tra bộ đệm (giây)
+INVENTORY_COUNT_TTL = 60  # Thời gian dùng lại số lượng email đã đếm trước khi làm mới nền (giây)
+IMPORT_MAX_PAYLOAD_BYTES = 2097152  # Kích thước JSON tối đa mỗi request appendCells khi nhập kho từ file (2 MB)
+IMPORT_MAX_FILE_BYTES = 20971520  # Kích thước file nhập kho tối đa (giới hạn tải file của Bot API, 20 MB)
+EMAIL_INDEX_FILE = "email_index.bloom"  # File lưu bộ lọc Bloom chống nhập trùng email
+EMAIL_INDEX_CAPACITY = 5000000  # Số email dự kiến trong chỉ mục chống trùng
+EMAIL_INDEX_ERROR_RATE = 0.001  # Tỉ lệ bộ lọc báo nhầm (chỉ làm chậm, không làm sai kết quả)
 
 # Business Settings
 DEFAULT_GMAIL_PRICE = 50000  # Giá mặc định (VND)
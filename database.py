@@ -1,285 +1,904 @@
 import sqlite3
 import datetime
 import uuid
+import threading
+import queue
+import time
+import logging
+import functools
+import json
+from concurrent.futures import Future, InvalidStateError
+from contextlib import contextmanager
 from typing import List, Tuple, Optional
 
+# Số connection tối đa giữ trong pool cho mỗi file database
+POOL_SIZE = 5
+# Thời gian tối đa chờ lấy connection từ pool (giây)
+POOL_TIMEOUT = 30.0
+# Số câu lệnh SQL được cache (đã compile) trên mỗi connection
+STATEMENT_CACHE_SIZE = 256
+
+# Các profile PRAGMA áp dụng cho mỗi connection trong pool
+SQLITE_PROFILES = {
+    # Giữ nguyên mặc định của SQLite (rollback journal, fsync mỗi commit)
+    "default": {},
+    # WAL: reader không chặn writer, synchronous=NORMAL chỉ fsync khi checkpoint
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 268435456,  # 256 MB
+        "cache_size": -65536,  # 64 MB (số âm = KiB)
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000  # ms
+    }
+}
+
+try:
+    from config import SQLITE_PROFILE
+except ImportError:
+    SQLITE_PROFILE = "performance"
+
+# Group commit: gom các lệnh ghi đồng thời trong một cửa sổ ngắn vào một transaction
+try:
+    from config import GROUP_COMMIT_ENABLED
+except ImportError:
+    GROUP_COMMIT_ENABLED = True
+try:
+    from config import GROUP_COMMIT_WINDOW_MS
+except ImportError:
+    GROUP_COMMIT_WINDOW_MS = 5
+try:
+    from config import GROUP_COMMIT_MAX_BATCH
+except ImportError:
+    GROUP_COMMIT_MAX_BATCH = 200
+
+class PoolTimeoutError(Exception):
+    """Không lấy được connection từ pool trong thời gian cho phép"""
+
+class ConnectionPool:
+    """Pool các connection SQLite sống lâu, dùng chung trong process"""
+    
+    def __init__(self, db_file: str, max_size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT,
+                 cached_statements: int = STATEMENT_CACHE_SIZE, pragmas: Optional[dict] = None):
+        self.db_file = db_file
+        self.max_size = max_size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.pragmas = pragmas or {}
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._in_use = 0
+        self._acquire_count = 0
+        self._wait_count = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+    
+    def _create_connection(self) -> sqlite3.Connection:
+        """Tạo connection mới (autocommit, transaction được mở thủ công bằng BEGIN)"""
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.timeout,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=self.cached_statements
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+    
+    def acquire(self) -> sqlite3.Connection:
+        """Lấy một connection từ pool, tạo mới nếu pool chưa đầy"""
+        started = time.monotonic()
+        conn = None
+        
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._size < self.max_size
+                if can_create:
+                    self._size += 1
+            
+            if can_create:
+                try:
+                    conn = self._create_connection()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeoutError(
+                        f"Hết connection trong pool {self.db_file} sau {self.timeout:.1f}s"
+                    )
+        
+        waited = time.monotonic() - started
+        with self._lock:
+            self._in_use += 1
+            self._acquire_count += 1
+            if waited > 0.001:
+                self._wait_count += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        
+        return conn
+    
+    def release(self, conn: sqlite3.Connection):
+        """Trả connection về pool"""
+        if conn.in_transaction:
+            # Không để transaction dở dang lọt sang người dùng tiếp theo
+            conn.rollback()
+        
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+    
+    def close_all(self):
+        """Đóng toàn bộ connection đang rảnh"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._size -= 1
+    
+    def get_stats(self) -> dict:
+        """Thống kê kích thước pool và thời gian chờ connection"""
+        with self._lock:
+            return {
+                'size': self._size,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': self._size - self._in_use,
+                'acquire_count': self._acquire_count,
+                'wait_count': self._wait_count,
+                'avg_wait_ms': (self._total_wait / self._acquire_count * 1000) if self._acquire_count else 0.0,
+                'max_wait_ms': self._max_wait * 1000
+            }
+
+class GroupCommitWriter:
+    """Thread ghi duy nhất: gom các lệnh ghi đồng thời và commit chúng trong một transaction
+    
+    Mỗi lệnh ghi là một hàm nhận cursor; lệnh được bọc trong SAVEPOINT riêng nên lỗi
+    của một lệnh không làm hỏng các lệnh khác trong cùng batch. Người gọi nhận
+    Future chứa kết quả của chính lệnh mình (ví dụ lastrowid).
+    """
+    
+    def __init__(self, pool: ConnectionPool, flush_window: float = GROUP_COMMIT_WINDOW_MS / 1000,
+                 max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.pool = pool
+        self.flush_window = flush_window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._writes = 0
+        self._failed_writes = 0
+        self._max_batch_seen = 0
+        self._last_batch_size = 0
+        self._total_commit_time = 0.0
+        self._thread = threading.Thread(target=self._run, name='db-group-commit', daemon=True)
+        self._thread.start()
+    
+    def submit(self, func, *args, **kwargs) -> Future:
+        """Đưa một lệnh ghi vào hàng đợi, trả về Future chứa kết quả của func(cursor, ...)"""
+        future = Future()
+        self._queue.put((func, args, kwargs, future))
+        return future
+    
+    def stop(self):
+        """Dừng thread ghi sau khi xử lý hết các lệnh đang chờ"""
+        self._queue.put(None)
+        self._thread.join()
+    
+    def _collect_batch(self, first) -> list:
+        """Gom thêm lệnh ghi trong cửa sổ flush_window kể từ lệnh đầu tiên
+        
+        Hàng đợi trống thì commit ngay: người ghi đơn lẻ (handler chạy đồng bộ)
+        không phải chờ cửa sổ; chỉ khi đang có ghi đồng thời mới chờ gom thêm.
+        """
+        batch = [first]
+        if self._queue.empty():
+            return batch
+        deadline = time.monotonic() + self.flush_window
+        
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            if item is None:
+                # Tín hiệu dừng: xử lý batch hiện tại rồi mới dừng
+                self._queue.put(None)
+                break
+            batch.append(item)
+        
+        return batch
+    
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            
+            # Thread ghi chết thì mọi lệnh ghi sau đó treo mãi: không để lỗi nào thoát khỏi vòng lặp
+            try:
+                batch = self._collect_batch(first)
+                self._commit_batch(batch)
+            except Exception as e:
+                logging.error(f"Lỗi thread group commit: {e}")
+    
+    @staticmethod
+    def _settle(future: Future, result=None, error: Exception = None):
+        """Trả kết quả cho người gọi; bỏ qua Future đã bị hủy hoặc đã có kết quả"""
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+    
+    def _commit_batch(self, batch: list):
+        """Chạy cả batch trong một transaction, mỗi lệnh một SAVEPOINT"""
+        # Người gọi đã hủy (task asyncio bị cancel) thì bỏ lệnh ghi của họ, chưa chạy gì
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        
+        started = time.monotonic()
+        results = []
+        failed = 0
+        
+        try:
+            conn = self.pool.acquire()
+        except Exception as e:
+            for _, _, _, future in batch:
+                self._settle(future, error=e)
+            return
+        
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.cursor()
+            
+            for func, args, kwargs, future in batch:
+                conn.execute('SAVEPOINT group_write')
+                try:
+                    results.append((future, func(cursor, *args, **kwargs), None))
+                    conn.execute('RELEASE group_write')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO group_write')
+                    conn.execute('RELEASE group_write')
+                    results.append((future, None, e))
+                    failed += 1
+            
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logging.error(f"Lỗi commit batch {len(batch)} lệnh ghi: {e}")
+            for _, _, _, future in batch:
+                self._settle(future, error=e)
+            return
+        finally:
+            self.pool.release(conn)
+        
+        elapsed = time.monotonic() - started
+        with self._stats_lock:
+            self._batches += 1
+            self._writes += len(batch)
+            self._failed_writes += failed
+            self._last_batch_size = len(batch)
+            self._max_batch_seen = max(self._max_batch_seen, len(batch))
+            self._total_commit_time += elapsed
+        
+        for future, result, error in results:
+            self._settle(future, result, error)
+    
+    def get_stats(self) -> dict:
+        """Độ sâu hàng đợi và kích thước batch để tinh chỉnh cửa sổ flush"""
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'flush_window_ms': self.flush_window * 1000,
+                'max_batch': self.max_batch,
+                'batches': self._batches,
+                'writes': self._writes,
+                'failed_writes': self._failed_writes,
+                'avg_batch_size': (self._writes / self._batches) if self._batches else 0.0,
+                'max_batch_size': self._max_batch_seen,
+                'last_batch_size': self._last_batch_size,
+                'avg_commit_ms': (self._total_commit_time / self._batches * 1000) if self._batches else 0.0
+            }
+
+class UserRegistry:
+    """Bộ nhớ đệm trong process: user_id -> (username, first_name, is_banned)
+    
+    Nạp toàn bộ một lần khi khởi động để kiểm tra ban và đăng ký user không cần
+    chạm database; Database cập nhật registry sau mỗi lần ghi user thành công.
+    """
+    
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+    
+    def load(self, rows):
+        """Nạp lại toàn bộ registry từ các dòng (user_id, username, first_name, is_banned)"""
+        with self._lock:
+            self._users = {user_id: (username, first_name, bool(is_banned))
+                           for user_id, username, first_name, is_banned in rows}
+            self.loaded = True
+    
+    def get(self, user_id: int) -> Optional[Tuple]:
+        """Lấy (username, first_name, is_banned) của user, None nếu chưa biết"""
+        return self._users.get(user_id)
+    
+    def set(self, user_id: int, username: str, first_name: str, is_banned: bool):
+        with self._lock:
+            self._users[user_id] = (username, first_name, is_banned)
+    
+    def set_banned(self, user_id: int, is_banned: bool):
+        """Cập nhật cờ ban, giữ nguyên tên đã biết"""
+        with self._lock:
+            username, first_name, _ = self._users.get(user_id, (None, None, False))
+            self._users[user_id] = (username, first_name, is_banned)
+
+def write_transaction(func):
+    """Đánh dấu method ghi của Database: thân hàm nhận cursor và chạy trong transaction
+    
+    Khi bật group commit, lệnh ghi đi qua GroupCommitWriter; nếu không thì chạy
+    trong transaction riêng như trước.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return self.submit_write(func, *args, **kwargs).result()
+    
+    wrapper.transaction_body = func
+    return wrapper
+
+# Các file database đã chạy init_database trong process này
+_initialized_files = set()
+_init_lock = threading.Lock()
+
+# Instance Database dùng chung theo file
+_databases = {}
+_databases_lock = threading.Lock()
+
+def get_database(db_file: str) -> 'Database':
+    """Lấy instance Database dùng chung trong process (kèm connection pool)"""
+    with _databases_lock:
+        db = _databases.get(db_file)
+        if db is None:
+            db = Database(db_file)
+            _databases[db_file] = db
+        return db
+
+def _migration_001_indexes(cursor):
+    """Thêm index cho các truy vấn lọc theo user, nạp tiền chờ duyệt và chiết khấu"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_created ON transactions (user_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_user_created ON purchases (user_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_pending_deposits ON transactions (created_at)
+        WHERE type = 'deposit' AND status = 'pending'
+    ''')
+    
+    # Mỗi đơn hàng chỉ được chiết khấu một lần - bỏ các bản ghi trùng (giữ lần claim đầu tiên) trước khi tạo UNIQUE
+    cursor.execute('''
+        DELETE FROM discounts
+        WHERE order_id IS NOT NULL
+          AND id NOT IN (SELECT MIN(id) FROM discounts WHERE order_id IS NOT NULL GROUP BY order_id)
+    ''')
+    if cursor.rowcount > 0:
+        logging.warning(f"Migration 1: đã xóa {cursor.rowcount} bản ghi chiết khấu trùng order_id")
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_discounts_order_id ON discounts (order_id)')
+
+def _bump_daily_stats(cursor, new_users: int = 0, revenue: int = 0, purchases: int = 0, deposits: int = 0):
+    """Cộng dồn thống kê của hôm nay (UTC) và dòng tổng 'total' trong cùng transaction ghi"""
+    today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+    cursor.executemany('''
+        INSERT INTO daily_stats (day, new_users, revenue, purchases, deposits)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (day) DO UPDATE SET
+            new_users = new_users + excluded.new_users,
+            revenue = revenue + excluded.revenue,
+            purchases = purchases + excluded.purchases,
+            deposits = deposits + excluded.deposits
+    ''', [(day, new_users, revenue, purchases, deposits) for day in (today, 'total')])
+
+def _rebuild_daily_stats(cursor):
+    """Tính lại toàn bộ daily_stats từ lịch sử users, purchases và transactions"""
+    cursor.execute('DELETE FROM daily_stats')
+    # Lịch sử không lưu ngày duyệt nên tiền nạp được tính theo ngày tạo giao dịch
+    cursor.execute('''
+        INSERT INTO daily_stats (day, new_users, revenue, purchases, deposits)
+        SELECT day, SUM(new_users), SUM(revenue), SUM(purchases), SUM(deposits)
+        FROM (
+            SELECT DATE(created_at) AS day, 1 AS new_users, 0 AS revenue, 0 AS purchases, 0 AS deposits FROM users
+            UNION ALL
+            SELECT DATE(created_at), 0, price, 1, 0 FROM purchases
+            UNION ALL
+            SELECT DATE(created_at), 0, 0, 0, amount FROM transactions WHERE type = 'deposit' AND status = 'approved'
+        )
+        WHERE day IS NOT NULL
+        GROUP BY day
+    ''')
+    cursor.execute('''
+        INSERT INTO daily_stats (day, new_users, revenue, purchases, deposits)
+        SELECT 'total', COALESCE(SUM(new_users), 0), COALESCE(SUM(revenue), 0),
+               COALESCE(SUM(purchases), 0), COALESCE(SUM(deposits), 0)
+        FROM daily_stats
+    ''')
+
+def _migration_002_daily_stats(cursor):
+    """Tạo bảng thống kê theo ngày và backfill từ lịch sử"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,  -- 'YYYY-MM-DD' (UTC) hoặc 'total'
+            new_users INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            purchases INTEGER NOT NULL DEFAULT 0,
+            deposits INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    _rebuild_daily_stats(cursor)
+
+def _migration_003_users_created_index(cursor):
+    """Index cho phân trang danh sách user theo (created_at, user_id)"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, user_id)')
+
+def _migration_004_orders_created_index(cursor):
+    """Index cho danh sách đơn hàng toàn hệ thống theo created_at"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)')
+
+def _migration_005_inventory(cursor):
+    """Bảng kho email cục bộ - nguồn chính khi bán, Google Sheets chỉ là bản đồng bộ"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT,
+            password TEXT,
+            status TEXT NOT NULL DEFAULT 'available',  -- 'available', 'reserved', 'sold', 'invalid', 'removed'
+            order_id TEXT,
+            in_sheet INTEGER NOT NULL DEFAULT 1,  -- 1: còn trên sheet, 2: đang xóa khỏi sheet, 0: đã xóa
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sold_at TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_available ON inventory (id) WHERE status = 'available'")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_inventory_in_sheet ON inventory (id) WHERE in_sheet > 0')
+
+def _migration_006_sheets_journal(cursor):
+    """Nhật ký ghi Google Sheets: thao tác được ghi vào đây trước, flusher nền gửi lên sheet sau"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sheets_journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,  -- 'append', 'delete', 'header'
+            payload TEXT NOT NULL DEFAULT '{}',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at REAL NOT NULL
+        )
+    ''')
+
+def _migration_007_inventory_leases(cursor):
+    """Giữ chỗ email trong kho theo lease: status 'reserved' kèm order_key và hạn lease"""
+    cursor.execute('ALTER TABLE inventory ADD COLUMN order_key TEXT')
+    cursor.execute('ALTER TABLE inventory ADD COLUMN lease_expires REAL')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_reserved ON inventory (order_key) WHERE status = 'reserved'")
+
+def normalize_email(email: str) -> str:
+    """Dạng chuẩn của email dùng để phát hiện trùng lặp"""
+    return email.strip().lower()
+
+def _migration_008_email_index(cursor):
+    """Chỉ mục email đã từng nhập kho hoặc đã bán, dùng để chặn nhập trùng"""
+    cursor.execute('CREATE TABLE IF NOT EXISTS email_index (email TEXT PRIMARY KEY) WITHOUT ROWID')
+    cursor.execute('''
+        INSERT OR IGNORE INTO email_index (email)
+        SELECT lower(trim(email)) FROM inventory WHERE email IS NOT NULL
+        UNION
+        SELECT lower(trim(email)) FROM purchases WHERE email IS NOT NULL
+    ''')
+
+def _migration_009_sheets_journal_dead(cursor):
+    """Thao tác nhật ký Google Sheets bị bỏ sau nhiều lần gửi lỗi, giữ lại để admin xử lý tay"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sheets_journal_dead (
+            id INTEGER PRIMARY KEY,
+            op TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            failed_at REAL NOT NULL
+        )
+    ''')
+
+# Danh sách migration theo thứ tự: (version, mô tả, hàm nhận cursor)
+MIGRATIONS = [
+    (1, "Index cho transactions, purchases, orders và discounts", _migration_001_indexes),
+    (2, "Bảng thống kê theo ngày daily_stats", _migration_002_daily_stats),
+    (3, "Index phân trang users theo created_at", _migration_003_users_created_index),
+    (4, "Index danh sách đơn hàng theo created_at", _migration_004_orders_created_index),
+    (5, "Bảng kho email cục bộ inventory", _migration_005_inventory),
+    (6, "Nhật ký ghi Google Sheets sheets_journal", _migration_006_sheets_journal),
+    (7, "Giữ chỗ email trong kho theo lease", _migration_007_inventory_leases),
+    (8, "Chỉ mục chống trùng email_index", _migration_008_email_index),
+    (9, "Bảng thao tác nhật ký Google Sheets bị bỏ sheets_journal_dead", _migration_009_sheets_journal_dead),
+]
+
+def encode_cursor(created_at: str, row_id: int) -> str:
+    """Mã hóa vị trí keyset (created_at, id) thành chuỗi ngắn để đặt vào callback_data"""
+    timestamp = datetime.datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+    return f"{int(timestamp.timestamp())}.{row_id}"
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Giải mã cursor phân trang, ValueError nếu cursor không hợp lệ"""
+    timestamp, row_id = cursor.split('.')
+    created_at = datetime.datetime.fromtimestamp(int(timestamp), datetime.timezone.utc)
+    return created_at.strftime('%Y-%m-%d %H:%M:%S'), int(row_id)
+
+def get_sqlite_pragmas(profile: str) -> dict:
+    """Lấy danh sách PRAGMA của một profile hiệu năng"""
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"SQLite profile không tồn tại: {profile} (có: {', '.join(SQLITE_PROFILES)})")
+    return SQLITE_PROFILES[profile]
+
 class Database:
-    def __init__(self, db_file: str):
+    def __init__(self, db_file: str, pool_size: int = POOL_SIZE, profile: str = None,
+                 group_commit: bool = GROUP_COMMIT_ENABLED):
         self.db_file = db_file
+        self.profile = profile or SQLITE_PROFILE
+        self.pool = ConnectionPool(db_file, max_size=pool_size, pragmas=get_sqlite_pragmas(self.profile))
         self.init_database()
+        self.writer = GroupCommitWriter(self.pool) if group_commit else None
+        self.users = UserRegistry()
     
     def get_connection(self):
+        """Mở connection riêng (không qua pool) - chỉ dùng cho script bảo trì"""
         return sqlite3.connect(self.db_file)
     
-    def init_database(self):
-        """Khởi tạo các bảng database"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Bảng users
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                balance INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_banned INTEGER DEFAULT 0
-            )
-        ''')
-        
-        # Bảng transactions (giao dịch)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                type TEXT,  -- 'deposit', 'purchase', 'admin_add'
-                amount INTEGER,
-                description TEXT,
-                status TEXT DEFAULT 'pending',  -- 'pending', 'approved', 'rejected'
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Bảng purchases (lịch sử mua email)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS purchases (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                email TEXT,
-                password TEXT,
-                price INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+    @contextmanager
+    def connection(self):
+        """Mượn một connection từ pool để đọc dữ liệu"""
+        conn = self.pool.acquire()
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+    
+    @contextmanager
+    def transaction(self, immediate: bool = False):
+        """Mở transaction trên connection của pool, commit khi thành công và rollback khi lỗi"""
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            try:
+                yield conn.cursor()
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+    
+    def submit_write(self, func, *args, **kwargs) -> Future:
+        """Chạy func(self, cursor, ...) trong transaction ghi, trả về Future chứa kết quả"""
+        if self.writer:
+            return self.writer.submit(functools.partial(func, self), *args, **kwargs)
         
-        # Bảng orders (đơn hàng với ID duy nhất)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id TEXT UNIQUE NOT NULL,
-                user_id INTEGER,
-                email_quantity INTEGER,
-                total_amount INTEGER,
-                status TEXT DEFAULT 'completed',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+        future = Future()
+        try:
+            # BEGIN IMMEDIATE: các lệnh ghi (checkout, giữ chỗ kho...) đọc trước rồi mới ghi,
+            # khóa ghi phải lấy ngay từ đầu để không bị "database is locked" khi nâng khóa
+            with self.transaction(immediate=True) as cursor:
+                future.set_result(func(self, cursor, *args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    def get_writer_stats(self) -> dict:
+        """Thống kê hàng đợi group commit (None nếu đang tắt)"""
+        return self.writer.get_stats() if self.writer else None
+    
+    def get_pool_stats(self) -> dict:
+        """Thống kê connection pool"""
+        stats = self.pool.get_stats()
+        stats['profile'] = self.profile
+        return stats
+    
+    def init_database(self):
+        """Khởi tạo các bảng database (chỉ chạy một lần cho mỗi file trong process)"""
+        with _init_lock:
+            if self.db_file in _initialized_files:
+                return
+            self._create_tables()
+            self.run_migrations()
+            _initialized_files.add(self.db_file)
+    
+    def _create_tables(self):
+        """Tạo các bảng nếu chưa có"""
+        with self.transaction() as cursor:
+            # Bảng users
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    balance INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    is_banned INTEGER DEFAULT 0
+                )
+            ''')
+            
+            # Bảng transactions (giao dịch)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS transactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    type TEXT,  -- 'deposit', 'purchase', 'admin_add'
+                    amount INTEGER,
+                    description TEXT,
+                    status TEXT DEFAULT 'pending',  -- 'pending', 'approved', 'rejected'
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
+            
+            # Bảng purchases (lịch sử mua email)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS purchases (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    email TEXT,
+                    password TEXT,
+                    price INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
+            
+            # Bảng orders (đơn hàng với ID duy nhất)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS orders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id TEXT UNIQUE NOT NULL,
+                    user_id INTEGER,
+                    email_quantity INTEGER,
+                    total_amount INTEGER,
+                    status TEXT DEFAULT 'completed',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
+            
+            # Bảng discounts (lịch sử chiết khấu)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS discounts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id TEXT,
+                    user_id INTEGER,
+                    discount_amount INTEGER,
+                    claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id),
+                    FOREIGN KEY (order_id) REFERENCES orders (order_id)
+                )
+            ''')
+            
+            # Bảng settings (cài đặt hệ thống)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+    
+    def get_schema_version(self) -> int:
+        """Lấy version schema hiện tại (0 nếu chưa chạy migration nào)"""
+        with self.connection() as conn:
+            result = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
         
-        # Bảng discounts (lịch sử chiết khấu)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS discounts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id TEXT,
-                user_id INTEGER,
-                discount_amount INTEGER,
-                claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (order_id) REFERENCES orders (order_id)
-            )
-        ''')
+        return result[0] or 0
+    
+    def run_migrations(self) -> int:
+        """Chạy các migration chưa áp dụng theo thứ tự, trả về version sau khi chạy"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        
+        for version, description, migrate in MIGRATIONS:
+            # Mỗi migration một transaction riêng; BEGIN IMMEDIATE để hai process không chạy trùng
+            with self.transaction(immediate=True) as cursor:
+                cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+                if cursor.fetchone():
+                    continue
+                
+                migrate(cursor)
+                cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (version, description))
+                logging.info(f"Đã áp dụng migration {version}: {description}")
+        
+        return self.get_schema_version()
+    
+    def explain_query_plan(self, sql: str, params: tuple = ()) -> List[str]:
+        """Lấy EXPLAIN QUERY PLAN của một câu truy vấn (dùng để kiểm tra index)"""
+        with self.connection() as conn:
+            rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
         
-        # Bảng settings (cài đặt hệ thống)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        ''')
+        return [row[-1] for row in rows]
+    
+    def load_user_registry(self) -> int:
+        """Nạp danh sách user và cờ ban vào registry trong bộ nhớ, trả về số user"""
+        with self.connection() as conn:
+            rows = conn.execute('SELECT user_id, username, first_name, is_banned FROM users').fetchall()
         
-        conn.commit()
-        conn.close()
+        self.users.load(rows)
+        return len(rows)
+    
+    def _lookup_user(self, user_id: int) -> Optional[Tuple]:
+        """Lấy (username, first_name, is_banned) từ registry, nạp registry nếu chưa nạp"""
+        if not self.users.loaded:
+            self.load_user_registry()
+        return self.users.get(user_id)
     
     def add_user(self, user_id: int, username: str = None, first_name: str = None):
-        """Thêm user mới"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Thêm user mới hoặc cập nhật tên; user đã biết và không đổi tên thì không ghi database"""
+        known = self._lookup_user(user_id)
+        if known and known[0] == username and known[1] == first_name:
+            return
+        
+        is_banned = self._save_user(user_id, username, first_name)
+        self.users.set(user_id, username, first_name, is_banned)
+    
+    @write_transaction
+    def _save_user(self, cursor, user_id: int, username: str = None, first_name: str = None) -> bool:
+        """Ghi user (thêm mới hoặc đổi tên), trả về cờ ban hiện tại"""
+        cursor.execute('SELECT is_banned FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        
+        if result:
+            cursor.execute('UPDATE users SET username = ?, first_name = ? WHERE user_id = ?',
+                           (username, first_name, user_id))
+            return result[0] == 1
         
         cursor.execute('''
-            INSERT OR IGNORE INTO users (user_id, username, first_name)
+            INSERT INTO users (user_id, username, first_name)
             VALUES (?, ?, ?)
         ''', (user_id, username, first_name))
-        
-        conn.commit()
-        conn.close()
+        _bump_daily_stats(cursor, new_users=1)
+        return False
     
     def get_user(self, user_id: int) -> Optional[Tuple]:
         """Lấy thông tin user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
-        
-        conn.close()
-        return user
+        with self.connection() as conn:
+            return conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
     
-    def update_balance(self, user_id: int, amount: int):
+    @write_transaction
+    def update_balance(self, cursor, user_id: int, amount: int):
         """Cập nhật số dư user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         cursor.execute('''
             UPDATE users SET balance = balance + ? WHERE user_id = ?
         ''', (amount, user_id))
-        
-        conn.commit()
-        conn.close()
     
     def get_balance(self, user_id: int) -> int:
         """Lấy số dư user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
+        with self.connection() as conn:
+            result = conn.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,)).fetchone()
         
-        conn.close()
         return result[0] if result else 0
     
-    def add_transaction(self, user_id: int, trans_type: str, amount: int, description: str = "", status: str = "pending"):
+    @write_transaction
+    def add_transaction(self, cursor, user_id: int, trans_type: str, amount: int, description: str = "", status: str = "pending"):
         """Thêm giao dịch"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         cursor.execute('''
             INSERT INTO transactions (user_id, type, amount, description, status)
             VALUES (?, ?, ?, ?, ?)
         ''', (user_id, trans_type, amount, description, status))
-        
         transaction_id = cursor.lastrowid
-        
-        conn.commit()
-        conn.close()
-        
+
+        if trans_type == 'deposit' and status == 'approved':
+            _bump_daily_stats(cursor, deposits=amount)
+
         return transaction_id
     
+    def get_transaction(self, transaction_id: int) -> Optional[Tuple]:
+        """Lấy (user_id, amount) của một giao dịch"""
+        with self.connection() as conn:
+            return conn.execute('SELECT user_id, amount FROM transactions WHERE id = ?', (transaction_id,)).fetchone()
+    
     def get_pending_deposits(self) -> List[Tuple]:
         """Lấy danh sách nạp tiền chờ duyệt"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT t.id, t.user_id, u.username, u.first_name, t.amount, t.created_at
-            FROM transactions t
-            JOIN users u ON t.user_id = u.user_id
-            WHERE t.type = 'deposit' AND t.status = 'pending'
-            ORDER BY t.created_at ASC
-        ''')
-        
-        deposits = cursor.fetchall()
-        conn.close()
-        return deposits
-    
-    def approve_deposit(self, transaction_id: int):
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT t.id, t.user_id, u.username, u.first_name, t.amount, t.created_at
+                FROM transactions t
+                JOIN users u ON t.user_id = u.user_id
+                WHERE t.type = 'deposit' AND t.status = 'pending'
+                ORDER BY t.created_at ASC
+            ''').fetchall()
+    
+    @write_transaction
+    def approve_deposit(self, cursor, transaction_id: int):
         """Duyệt nạp tiền"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         # Lấy thông tin giao dịch
-        cursor.execute('SELECT user_id, amount FROM transactions WHERE id = ?', (transaction_id,))
+        cursor.execute('SELECT user_id, amount, type, status FROM transactions WHERE id = ?', (transaction_id,))
         result = cursor.fetchone()
-        
+
         if result:
-            user_id, amount = result
-            
+            user_id, amount, trans_type, status = result
+
             # Cập nhật trạng thái giao dịch
             cursor.execute('UPDATE transactions SET status = ? WHERE id = ?', ('approved', transaction_id))
-            
+
             # Cộng tiền vào tài khoản
             cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?', (amount, user_id))
-            
-            conn.commit()
-        
-        conn.close()
+
+            if trans_type == 'deposit' and status != 'approved':
+                _bump_daily_stats(cursor, deposits=amount)
+
         return result is not None
     
-    def reject_deposit(self, transaction_id: int):
+    @write_transaction
+    def reject_deposit(self, cursor, transaction_id: int):
         """Từ chối nạp tiền"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         cursor.execute('UPDATE transactions SET status = ? WHERE id = ?', ('rejected', transaction_id))
-        
-        conn.commit()
-        conn.close()
     
-    def add_purchase(self, user_id: int, email: str, password: str, price: int):
+    @write_transaction
+    def add_purchase(self, cursor, user_id: int, email: str, password: str, price: int):
         """Thêm lịch sử mua email"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         cursor.execute('''
             INSERT INTO purchases (user_id, email, password, price)
             VALUES (?, ?, ?, ?)
         ''', (user_id, email, password, price))
-        
-        conn.commit()
-        conn.close()
-    
+        _bump_daily_stats(cursor, revenue=price, purchases=1)
+
     def get_user_transactions(self, user_id: int) -> List[Tuple]:
         """Lấy lịch sử giao dịch của user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT type, amount, description, status, created_at
-            FROM transactions
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT 20
-        ''', (user_id,))
-        
-        transactions = cursor.fetchall()
-        conn.close()
-        return transactions
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT type, amount, description, status, created_at
+                FROM transactions
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+                LIMIT 20
+            ''', (user_id,)).fetchall()
     
     def get_user_purchases(self, user_id: int) -> List[Tuple]:
         """Lấy lịch sử mua email của user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT email, password, price, created_at
-            FROM purchases
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT 10
-        ''', (user_id,))
-        
-        purchases = cursor.fetchall()
-        conn.close()
-        return purchases
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT email, password, price, created_at
+                FROM purchases
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+                LIMIT 10
+            ''', (user_id,)).fetchall()
     
     def get_stats(self) -> dict:
-        """Lấy thống kê hệ thống"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Tổng số user
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        # Tổng doanh thu (từ purchases)
-        cursor.execute('SELECT SUM(price) FROM purchases')
-        total_revenue = cursor.fetchone()[0] or 0
-        
-        # Tổng tiền nạp đã duyệt
-        cursor.execute('SELECT SUM(amount) FROM transactions WHERE type = "deposit" AND status = "approved"')
-        total_deposits = cursor.fetchone()[0] or 0
-        
-        # Thống kê hôm nay
-        today = datetime.date.today().strftime('%Y-%m-%d')
-        cursor.execute('SELECT COUNT(*) FROM users WHERE DATE(created_at) = ?', (today,))
-        new_users_today = cursor.fetchone()[0]
+        """Lấy thống kê hệ thống từ bảng daily_stats (dòng 'total' và dòng hôm nay)"""
+        today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+        with self.connection() as conn:
+            rows = conn.execute(
+                'SELECT day, new_users, revenue, deposits FROM daily_stats WHERE day IN (?, ?)', ('total', today)
+            ).fetchall()
         
-        cursor.execute('SELECT SUM(price) FROM purchases WHERE DATE(created_at) = ?', (today,))
-        revenue_today = cursor.fetchone()[0] or 0
-        
-        conn.close()
+        stats = {day: (new_users, revenue, deposits) for day, new_users, revenue, deposits in rows}
+        total_users, total_revenue, total_deposits = stats.get('total', (0, 0, 0))
+        new_users_today, revenue_today, _ = stats.get(today, (0, 0, 0))
         
         return {
             'total_users': total_users,
@@ -289,107 +908,501 @@ class Database:
             'revenue_today': revenue_today
         }
     
-    def get_all_users(self) -> List[Tuple]:
-        """Lấy danh sách tất cả user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    @write_transaction
+    def rebuild_daily_stats(self, cursor):
+        """Tính lại bảng daily_stats từ lịch sử (backfill)"""
+        _rebuild_daily_stats(cursor)
+    
+    def list_users_page(self, after_cursor: str = None, limit: int = 10, before_cursor: str = None) -> dict:
+        """Lấy một trang user (mới nhất trước) bằng keyset pagination trên (created_at, user_id)
+        
+        after_cursor lấy trang kế tiếp, before_cursor lấy trang liền trước; trả về
+        danh sách user cùng cursor của trang trước/sau (None nếu không còn).
+        """
+        columns = 'user_id, username, first_name, balance, created_at, is_banned'
+        with self.connection() as conn:
+            if before_cursor:
+                # Đi ngược: lấy theo thứ tự tăng dần rồi đảo lại
+                rows = conn.execute(f'''
+                    SELECT {columns} FROM users
+                    WHERE (created_at, user_id) > (?, ?)
+                    ORDER BY created_at ASC, user_id ASC
+                    LIMIT ?
+                ''', (*decode_cursor(before_cursor), limit + 1)).fetchall()
+                has_prev = len(rows) > limit
+                users = rows[:limit][::-1]
+                has_next = True
+            else:
+                if after_cursor:
+                    rows = conn.execute(f'''
+                        SELECT {columns} FROM users
+                        WHERE (created_at, user_id) < (?, ?)
+                        ORDER BY created_at DESC, user_id DESC
+                        LIMIT ?
+                    ''', (*decode_cursor(after_cursor), limit + 1)).fetchall()
+                else:
+                    rows = conn.execute(f'''
+                        SELECT {columns} FROM users
+                        ORDER BY created_at DESC, user_id DESC
+                        LIMIT ?
+                    ''', (limit + 1,)).fetchall()
+                has_next = len(rows) > limit
+                users = rows[:limit]
+                has_prev = after_cursor is not None
         
-        cursor.execute('SELECT user_id, username, first_name, balance, created_at, is_banned FROM users ORDER BY created_at DESC')
-        users = cursor.fetchall()
+        return {
+            'users': users,
+            'prev_cursor': encode_cursor(users[0][4], users[0][0]) if users and has_prev else None,
+            'next_cursor': encode_cursor(users[-1][4], users[-1][0]) if users and has_next else None
+        }
+    
+    def count_users(self) -> int:
+        """Tổng số user, đọc từ dòng 'total' của daily_stats thay vì COUNT(*)"""
+        with self.connection() as conn:
+            result = conn.execute("SELECT new_users FROM daily_stats WHERE day = 'total'").fetchone()
         
-        conn.close()
-        return users
+        return result[0] if result else 0
     
     def ban_user(self, user_id: int):
         """Ban user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('UPDATE users SET is_banned = 1 WHERE user_id = ?', (user_id,))
-        
-        conn.commit()
-        conn.close()
+        self._set_banned(user_id, 1)
+        self.users.set_banned(user_id, True)
     
     def unban_user(self, user_id: int):
         """Unban user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('UPDATE users SET is_banned = 0 WHERE user_id = ?', (user_id,))
-        
-        conn.commit()
-        conn.close()
+        self._set_banned(user_id, 0)
+        self.users.set_banned(user_id, False)
+    
+    @write_transaction
+    def _set_banned(self, cursor, user_id: int, is_banned: int):
+        cursor.execute('UPDATE users SET is_banned = ? WHERE user_id = ?', (is_banned, user_id))
     
     def is_user_banned(self, user_id: int) -> bool:
-        """Kiểm tra user có bị ban không"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT is_banned FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        
-        conn.close()
-        return result and result[0] == 1
+        """Kiểm tra user có bị ban không (đọc từ registry trong bộ nhớ)"""
+        known = self._lookup_user(user_id)
+        return bool(known and known[2])
     
     def get_user_info(self, user_id: int) -> tuple:
         """Lấy thông tin user (user_id, username, first_name, balance, is_banned)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT user_id, username, first_name, balance, is_banned FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        
-        conn.close()
-        return result
+        with self.connection() as conn:
+            return conn.execute(
+                'SELECT user_id, username, first_name, balance, is_banned FROM users WHERE user_id = ?', (user_id,)
+            ).fetchone()
     
     def generate_order_id(self) -> str:
         """Tạo Order ID duy nhất"""
         return f"ORD{uuid.uuid4().hex[:8].upper()}"
     
-    def create_order(self, user_id: int, email_quantity: int, total_amount: int) -> str:
+    @write_transaction
+    def create_order(self, cursor, user_id: int, email_quantity: int, total_amount: int) -> str:
         """Tạo đơn hàng mới và trả về Order ID"""
         order_id = self.generate_order_id()
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         cursor.execute('''
             INSERT INTO orders (order_id, user_id, email_quantity, total_amount)
             VALUES (?, ?, ?, ?)
         ''', (order_id, user_id, email_quantity, total_amount))
         
-        conn.commit()
-        conn.close()
-        
         return order_id
-    
-    def get_order_info(self, order_id: str) -> tuple:
-        """Lấy thông tin đơn hàng"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT order_id, user_id, email_quantity, total_amount, status, created_at
-            FROM orders WHERE order_id = ?
-        ''', (order_id,))
+
+    @write_transaction
+    def checkout(self, cursor, user_id: int, emails: List[Tuple[str, str]], unit_price: int) -> dict:
+        """Thanh toán đơn hàng trong một transaction: lưu email đã mua, trừ tiền, tạo đơn và ghi giao dịch"""
+        return self._checkout(cursor, user_id, emails, unit_price)
+
+    def _checkout(self, cursor, user_id: int, emails: List[Tuple[str, str]], unit_price: int) -> dict:
+        """Thân của checkout, chạy trên cursor của transaction ghi đang mở"""
+        quantity = len(emails)
+        total_amount = quantity * unit_price
+
+        # Kiểm tra lại số dư bên trong transaction ghi
+        cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
         result = cursor.fetchone()
+        balance = result[0] if result else 0
+
+        if quantity == 0:
+            return {'success': False, 'error': 'Không có email nào để thanh toán'}
+
+        if balance < total_amount:
+            return {'success': False, 'error': 'Số dư không đủ', 'balance': balance}
+
+        cursor.executemany('''
+            INSERT INTO purchases (user_id, email, password, price)
+            VALUES (?, ?, ?, ?)
+        ''', [(user_id, email, password, unit_price) for email, password in emails])
+        cursor.executemany(
+            'INSERT OR IGNORE INTO email_index (email) VALUES (?)', [(normalize_email(email),) for email, _ in emails]
+        )
+
+        cursor.execute('UPDATE users SET balance = balance - ? WHERE user_id = ?', (total_amount, user_id))
+
+        order_id = self.generate_order_id()
+        cursor.execute('''
+            INSERT INTO orders (order_id, user_id, email_quantity, total_amount)
+            VALUES (?, ?, ?, ?)
+        ''', (order_id, user_id, quantity, total_amount))
+
+        cursor.execute('''
+            INSERT INTO transactions (user_id, type, amount, description, status)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, 'purchase', -total_amount, f"Mua {quantity} email Gmail - Order: {order_id}", 'approved'))
+
+        _bump_daily_stats(cursor, revenue=total_amount, purchases=quantity)
+
+        return {
+            'success': True,
+            'order_id': order_id,
+            'quantity': quantity,
+            'total_amount': total_amount,
+            'new_balance': balance - total_amount
+        }
+
+    @write_transaction
+    def reserve_inventory(self, cursor, quantity: int, order_key: str, lease_seconds: float) -> List[Tuple[str, str]]:
+        """Giữ chỗ tối đa quantity email cho order_key trong lease_seconds giây
         
-        conn.close()
+        Gọi lại với cùng order_key trả về các email đã giữ chỗ trước đó.
+        """
+        return self._reserve(cursor, quantity, order_key, lease_seconds)
+    
+    def _reserve(self, cursor, quantity: int, order_key: str, lease_seconds: float) -> List[Tuple[str, str]]:
+        cursor.execute(
+            "SELECT email, password FROM inventory WHERE status = 'reserved' AND order_key = ? ORDER BY id",
+            (order_key,)
+        )
+        reserved = cursor.fetchall()
+        if reserved:
+            return reserved
+        
+        now = time.time()
+        self._release_expired(cursor, now)
+        cursor.execute('''
+            SELECT id, email, password FROM inventory
+            WHERE status = 'available'
+            ORDER BY id
+            LIMIT ?
+        ''', (quantity,))
+        rows = cursor.fetchall()
+        
+        cursor.executemany(
+            "UPDATE inventory SET status = 'reserved', order_key = ?, lease_expires = ? WHERE id = ?",
+            [(order_key, now + lease_seconds, row_id) for row_id, _, _ in rows]
+        )
+        return [(email, password) for _, email, password in rows]
+    
+    @write_transaction
+    def commit_reservation(self, cursor, order_key: str, user_id: int, unit_price: int) -> dict:
+        """Thanh toán các email đang giữ chỗ cho order_key; thanh toán thất bại thì trả email về kho"""
+        return self._commit_reservation(cursor, order_key, user_id, unit_price)
+    
+    def _commit_reservation(self, cursor, order_key: str, user_id: int, unit_price: int) -> dict:
+        cursor.execute(
+            "SELECT id, email, password FROM inventory WHERE status = 'reserved' AND order_key = ? ORDER BY id",
+            (order_key,)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return {'success': False, 'error': 'Phiên giữ email đã hết hạn, vui lòng mua lại'}
+        
+        emails = [(email, password) for _, email, password in rows]
+        result = self._checkout(cursor, user_id, emails, unit_price)
+        if not result['success']:
+            self._release(cursor, order_key)
+            return result
+        
+        cursor.executemany(
+            """UPDATE inventory SET status = 'sold', order_id = ?, order_key = NULL, lease_expires = NULL,
+                   sold_at = CURRENT_TIMESTAMP
+               WHERE id = ?""",
+            [(result['order_id'], row_id) for row_id, _, _ in rows]
+        )
+        result['emails'] = emails
         return result
     
-    def get_user_orders(self, user_id: int) -> list:
-        """Lấy danh sách đơn hàng của user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
+    @write_transaction
+    def release_reservation(self, cursor, order_key: str) -> int:
+        """Trả các email đang giữ chỗ cho order_key về kho"""
+        return self._release(cursor, order_key)
+    
+    def _release(self, cursor, order_key: str) -> int:
+        cursor.execute(
+            """UPDATE inventory SET status = 'available', order_key = NULL, lease_expires = NULL
+               WHERE status = 'reserved' AND order_key = ?""",
+            (order_key,)
+        )
+        return cursor.rowcount
+    
+    @write_transaction
+    def release_expired_reservations(self, cursor) -> int:
+        """Trả về kho các email có lease đã hết hạn"""
+        return self._release_expired(cursor, time.time())
+    
+    def _release_expired(self, cursor, now: float) -> int:
+        cursor.execute(
+            """UPDATE inventory SET status = 'available', order_key = NULL, lease_expires = NULL
+               WHERE status = 'reserved' AND lease_expires < ?""",
+            (now,)
+        )
+        return cursor.rowcount
+    
+    @write_transaction
+    def add_inventory_rows(self, cursor, rows: List[Tuple[Optional[str], Optional[str]]], in_sheet: int = 1) -> int:
+        """Thêm các dòng vào kho theo đúng thứ tự; dòng thiếu email/password được lưu là 'invalid'
+        
+        Email hợp lệ được ghi luôn vào email_index trong cùng giao dịch để lần nhập sau nhận ra trùng.
+        """
+        cursor.executemany(
+            'INSERT INTO inventory (email, password, status, in_sheet) VALUES (?, ?, ?, ?)',
+            [(email, password, 'available' if email and password else 'invalid', in_sheet) for email, password in rows]
+        )
+        cursor.executemany(
+            'INSERT OR IGNORE INTO email_index (email) VALUES (?)',
+            [(normalize_email(email),) for email, password in rows if email and password]
+        )
+        return len(rows)
+    
+    @write_transaction
+    def pop_inventory(self, cursor, quantity: int) -> List[Tuple[str, str]]:
+        """Lấy tối đa quantity email đầu kho ra khỏi kho (không qua đơn hàng), đánh dấu 'removed'"""
+        cursor.execute(
+            "SELECT id, email, password FROM inventory WHERE status = 'available' ORDER BY id LIMIT ?", (quantity,)
+        )
+        rows = cursor.fetchall()
+        cursor.executemany("UPDATE inventory SET status = 'removed' WHERE id = ?", [(row_id,) for row_id, _, _ in rows])
+        return [(email, password) for _, email, password in rows]
+    
+    def count_inventory(self) -> int:
+        """Số email còn bán được trong kho cục bộ"""
+        with self.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM inventory WHERE status = 'available'").fetchone()[0]
+    
+    def get_inventory_preview(self, limit: int = 10) -> List[Tuple[str, str]]:
+        """Lấy các email sắp được bán tiếp theo (không lấy ra khỏi kho)"""
+        with self.connection() as conn:
+            return conn.execute(
+                "SELECT email, password FROM inventory WHERE status = 'available' ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+    
+    def get_sheet_mirror_head(self, limit: int) -> List[Tuple]:
+        """Các dòng kho còn nằm trên sheet, theo thứ tự dòng trên sheet: (id, email, password, status, in_sheet)"""
+        with self.connection() as conn:
+            return conn.execute(
+                'SELECT id, email, password, status, in_sheet FROM inventory WHERE in_sheet > 0 ORDER BY id LIMIT ?',
+                (limit,)
+            ).fetchall()
+    
+    def count_sheet_mirror_rows(self) -> int:
+        """Số dòng dữ liệu trên sheet mà kho cục bộ đã ghi nhận"""
+        with self.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM inventory WHERE in_sheet > 0').fetchone()[0]
+    
+    @write_transaction
+    def set_sheet_state(self, cursor, row_ids: List[int], in_sheet: int):
+        """Đánh dấu trạng thái trên sheet của các dòng kho"""
+        cursor.executemany('UPDATE inventory SET in_sheet = ? WHERE id = ?', [(in_sheet, row_id) for row_id in row_ids])
+    
+    def get_inventory_stats(self) -> dict:
+        """Thống kê kho cục bộ theo trạng thái"""
+        with self.connection() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) FROM inventory GROUP BY status').fetchall()
+            pending_removal = conn.execute(
+                "SELECT COUNT(*) FROM inventory WHERE in_sheet > 0 AND status IN ('sold', 'invalid', 'removed')"
+            ).fetchone()[0]
+        
+        stats = {'available': 0, 'reserved': 0, 'sold': 0, 'invalid': 0}
+        stats.update(dict(rows))
+        stats['pending_sheet_removal'] = pending_removal
+        return stats
+    
+    @write_transaction
+    def enqueue_sheet_ops(self, cursor, ops: List[Tuple[str, dict]]) -> int:
+        """Ghi các thao tác Google Sheets (op, payload) vào nhật ký, theo đúng thứ tự"""
+        now = time.time()
+        cursor.executemany(
+            'INSERT INTO sheets_journal (op, payload, created_at) VALUES (?, ?, ?)',
+            [(op, json.dumps(payload), now) for op, payload in ops]
+        )
+        return len(ops)
+    
+    def get_sheet_journal_head(self, limit: int) -> List[Tuple]:
+        """Các thao tác chờ gửi lên sheet theo thứ tự: (id, op, payload, attempts, next_attempt_at)"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                'SELECT id, op, payload, attempts, next_attempt_at FROM sheets_journal ORDER BY id LIMIT ?', (limit,)
+            ).fetchall()
+        return [(op_id, op, json.loads(payload), attempts, next_attempt_at)
+                for op_id, op, payload, attempts, next_attempt_at in rows]
+    
+    @write_transaction
+    def complete_sheet_ops(self, cursor, op_ids: List[int], remaining: Tuple[int, dict] = None):
+        """Xóa khỏi nhật ký các thao tác đã gửi lên sheet thành công
+        
+        remaining = (id, payload) là thao tác mới gửi được một phần: payload được
+        thay bằng phần còn lại, giữ nguyên vị trí trong nhật ký.
+        """
+        cursor.executemany('DELETE FROM sheets_journal WHERE id = ?', [(op_id,) for op_id in op_ids])
+        if remaining:
+            op_id, payload = remaining
+            cursor.execute(
+                'UPDATE sheets_journal SET payload = ?, attempts = 0, last_error = NULL WHERE id = ?',
+                (json.dumps(payload), op_id)
+            )
+    
+    @write_transaction
+    def defer_sheet_op(self, cursor, op_id: int, error: str, next_attempt_at: float):
+        """Ghi nhận lần gửi thất bại và thời điểm được thử lại"""
+        cursor.execute(
+            'UPDATE sheets_journal SET attempts = attempts + 1, last_error = ?, next_attempt_at = ? WHERE id = ?',
+            (error, next_attempt_at, op_id)
+        )
+    
+    @write_transaction
+    def dead_letter_sheet_op(self, cursor, op_id: int, error: str):
+        """Chuyển một thao tác khỏi nhật ký sang sheets_journal_dead để các thao tác sau được gửi tiếp"""
         cursor.execute('''
-            SELECT order_id, email_quantity, total_amount, status, created_at
-            FROM orders WHERE user_id = ? ORDER BY created_at DESC
-        ''', (user_id,))
-        results = cursor.fetchall()
+            INSERT INTO sheets_journal_dead (id, op, payload, attempts, last_error, created_at, failed_at)
+            SELECT id, op, payload, attempts + 1, ?, created_at, ? FROM sheets_journal WHERE id = ?
+        ''', (error, time.time(), op_id))
+        cursor.execute('DELETE FROM sheets_journal WHERE id = ?', (op_id,))
+    
+    def get_sheet_journal_stats(self) -> dict:
+        """Độ sâu nhật ký, độ trễ của thao tác cũ nhất và lỗi gần nhất"""
+        with self.connection() as conn:
+            depth, oldest = conn.execute('SELECT COUNT(*), MIN(created_at) FROM sheets_journal').fetchone()
+            dead = conn.execute('SELECT COUNT(*) FROM sheets_journal_dead').fetchone()[0]
+            head = conn.execute(
+                'SELECT attempts, next_attempt_at, last_error FROM sheets_journal ORDER BY id LIMIT 1'
+            ).fetchone()
+        
+        attempts, next_attempt_at, last_error = head or (0, 0, None)
+        return {
+            'depth': depth,
+            'lag_seconds': time.time() - oldest if oldest else 0.0,
+            'head_attempts': attempts,
+            'next_attempt_at': next_attempt_at,
+            'last_error': last_error,
+            'dead_letters': dead
+        }
+    
+    @write_transaction
+    def claim_emails(self, cursor, emails: List[str], maybe_present: set) -> List[str]:
+        """Ghi các email (đã chuẩn hóa) vào email_index, trả về các email chưa từng có
+        
+        maybe_present là các email bộ lọc Bloom báo có thể đã tồn tại: chỉ chúng
+        phải tra từng dòng. Phần còn lại được ghi một lượt; nếu lượt đó phát hiện
+        email đã có (bộ lọc chưa biết) thì quay lại tra từng dòng cho cả danh sách.
+        """
+        fresh = [email for email in emails if email not in maybe_present]
+        new_emails = []
+        
+        cursor.execute('SAVEPOINT claim_fresh')
+        cursor.executemany('INSERT OR IGNORE INTO email_index (email) VALUES (?)', [(email,) for email in fresh])
+        if cursor.rowcount == len(fresh):
+            cursor.execute('RELEASE claim_fresh')
+            new_emails.extend(fresh)
+            check = [email for email in emails if email in maybe_present]
+        else:
+            cursor.execute('ROLLBACK TO claim_fresh')
+            cursor.execute('RELEASE claim_fresh')
+            check = emails
+        
+        for email in check:
+            cursor.execute('INSERT OR IGNORE INTO email_index (email) VALUES (?)', (email,))
+            if cursor.rowcount == 1:
+                new_emails.append(email)
+        return new_emails
+    
+    @write_transaction
+    def unclaim_emails(self, cursor, emails: List[str]) -> int:
+        """Xóa các email (đã chuẩn hóa) khỏi email_index, dùng khi lần ghi vào kho sau claim_emails thất bại"""
+        cursor.executemany('DELETE FROM email_index WHERE email = ?', [(email,) for email in emails])
+        return len(emails)
+    
+    def get_indexed_emails_page(self, after: str = '', limit: int = 10000) -> List[str]:
+        """Đọc email_index theo thứ tự email, từng trang (dùng khi dựng lại bộ lọc Bloom)"""
+        with self.connection() as conn:
+            rows = conn.execute('SELECT email FROM email_index WHERE email > ? ORDER BY email LIMIT ?', (after, limit)).fetchall()
+        return [email for email, in rows]
+    
+    def count_indexed_emails(self) -> int:
+        """Số email trong email_index"""
+        with self.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM email_index').fetchone()[0]
+    
+    def get_setting(self, key: str, default: str = None) -> Optional[str]:
+        """Đọc một giá trị trong bảng settings"""
+        with self.connection() as conn:
+            row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+    
+    @write_transaction
+    def set_setting(self, cursor, key: str, value: str):
+        """Ghi một giá trị vào bảng settings"""
+        cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+    
+    def get_order_info(self, order_id: str) -> tuple:
+        """Lấy thông tin đơn hàng"""
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT order_id, user_id, email_quantity, total_amount, status, created_at
+                FROM orders WHERE order_id = ?
+            ''', (order_id,)).fetchone()
+    
+    def get_user_orders(self, user_id: int, limit: int = 10) -> list:
+        """Lấy các đơn hàng gần nhất của user"""
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT order_id, email_quantity, total_amount, status, created_at
+                FROM orders WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
+            ''', (user_id, limit)).fetchall()
+    
+    def list_orders_with_discounts(self, user_id: int = None, limit: int = 20, cursor: str = None) -> dict:
+        """Lấy một trang đơn hàng (mới nhất trước) kèm chiết khấu đã nhận và mức có thể nhận
+        
+        Mỗi dòng: (order_id, user_id, username, first_name, email_quantity, total_amount,
+        status, created_at, claimed_amount, eligible_amount); claimed_amount là None nếu
+        chưa nhận. Lọc theo user_id nếu có; cursor lấy từ next_cursor của trang trước.
+        """
+        conditions = []
+        params = []
+        if user_id is not None:
+            conditions.append('o.user_id = ?')
+            params.append(user_id)
+        if cursor:
+            conditions.append('(o.created_at, o.id) < (?, ?)')
+            params.extend(decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        with self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT o.id, o.order_id, o.user_id, u.username, u.first_name,
+                       o.email_quantity, o.total_amount, o.status, o.created_at, d.discount_amount
+                FROM orders o
+                LEFT JOIN users u ON o.user_id = u.user_id
+                LEFT JOIN discounts d ON d.order_id = o.order_id
+                {where}
+                ORDER BY o.created_at DESC, o.id DESC
+                LIMIT ?
+            ''', (*params, limit + 1)).fetchall()
+        
+        orders = []
+        for row in rows[:limit]:
+            email_quantity, claimed_amount = row[5], row[9]
+            eligible_amount = 0 if claimed_amount is not None else self.get_discount_amount(email_quantity)
+            orders.append(row[1:] + (eligible_amount,))
+        
+        last = rows[limit - 1] if len(rows) > limit else None
+        return {
+            'orders': orders,
+            'next_cursor': encode_cursor(last[8], last[0]) if last else None
+        }
+    
+    def get_order_discount(self, order_id: str) -> Optional[int]:
+        """Lấy số tiền chiết khấu đã nhận của đơn hàng (None nếu chưa nhận)"""
+        with self.connection() as conn:
+            result = conn.execute('SELECT discount_amount FROM discounts WHERE order_id = ?', (order_id,)).fetchone()
         
-        conn.close()
-        return results
+        return result[0] if result else None
     
     def get_discount_amount(self, email_quantity: int) -> int:
         """Tính số tiền chiết khấu theo số lượng email - sử dụng settings_manager"""
@@ -411,13 +1424,8 @@ class Database:
             return {"eligible": False, "error": "Bạn không phải chủ đơn hàng này"}
         
         # Kiểm tra đã claim chiết khấu chưa
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM discounts WHERE order_id = ?', (order_id,))
-        if cursor.fetchone():
-            conn.close()
+        if self.get_order_discount(order_id) is not None:
             return {"eligible": False, "error": "Đơn hàng này đã được sử dụng chiết khấu"}
-        conn.close()
         
         # Tính số tiền chiết khấu
         discount_amount = self.get_discount_amount(email_quantity)
@@ -440,28 +1448,23 @@ class Database:
         
         discount_amount = eligibility["discount_amount"]
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # Thêm record chiết khấu
-            cursor.execute('''
-                INSERT INTO discounts (order_id, user_id, discount_amount)
-                VALUES (?, ?, ?)
-            ''', (order_id, user_id, discount_amount))
-            
-            # Cộng tiền vào tài khoản
-            cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?', 
-                         (discount_amount, user_id))
-            
-            # Thêm transaction history
-            cursor.execute('''
-                INSERT INTO transactions (user_id, type, amount, description, status)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, "discount", discount_amount, f"Chiết khấu đơn hàng {order_id}", "approved"))
-            
-            conn.commit()
-            conn.close()
+            with self.transaction(immediate=True) as cursor:
+                # Thêm record chiết khấu
+                cursor.execute('''
+                    INSERT INTO discounts (order_id, user_id, discount_amount)
+                    VALUES (?, ?, ?)
+                ''', (order_id, user_id, discount_amount))
+                
+                # Cộng tiền vào tài khoản
+                cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?', 
+                             (discount_amount, user_id))
+                
+                # Thêm transaction history
+                cursor.execute('''
+                    INSERT INTO transactions (user_id, type, amount, description, status)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, "discount", discount_amount, f"Chiết khấu đơn hàng {order_id}", "approved"))
             
             return {
                 "success": True,
@@ -470,23 +1473,16 @@ class Database:
             }
             
         except Exception as e:
-            conn.rollback()
-            conn.close()
             return {"success": False, "error": f"Lỗi xử lý: {str(e)}"}
     
-    def get_all_orders(self) -> list:
-        """Lấy tất cả đơn hàng (cho admin)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT o.order_id, o.user_id, u.username, u.first_name, 
-                   o.email_quantity, o.total_amount, o.status, o.created_at
-            FROM orders o
-            LEFT JOIN users u ON o.user_id = u.user_id
-            ORDER BY o.created_at DESC
-        ''', )
-        results = cursor.fetchall()
-        
-        conn.close()
-        return results
+    def get_all_orders(self, limit: int = 20) -> list:
+        """Lấy các đơn hàng gần nhất (cho admin)"""
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT o.order_id, o.user_id, u.username, u.first_name, 
+                       o.email_quantity, o.total_amount, o.status, o.created_at
+                FROM orders o
+                LEFT JOIN users u ON o.user_id = u.user_id
+                ORDER BY o.created_at DESC
+                LIMIT ?
+            ''', (limit,)).fetchall()
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""
+Công cụ bảo trì database
+
+Chạy:
+    python db_tools.py rebuild-stats
+    python db_tools.py rebuild-stats --db gmail_bot.db
+"""
+import argparse
+
+from database import Database
+
+try:
+    from config import DATABASE_FILE
+except ImportError:
+    DATABASE_FILE = "gmail_bot.db"
+
+def rebuild_stats(db: Database):
+    """Tính lại bảng daily_stats từ lịch sử và in thống kê sau khi tính"""
+    db.rebuild_daily_stats()
+    stats = db.get_stats()
+    print("✅ Đã tính lại daily_stats")
+    print(f"   • Tổng số user: {stats['total_users']:,}")
+    print(f"   • Tổng doanh thu: {stats['total_revenue']:,} VND")
+    print(f"   • Tổng tiền nạp: {stats['total_deposits']:,} VND")
+
+def main():
+    parser = argparse.ArgumentParser(description="Công cụ bảo trì database của bot")
+    parser.add_argument("--db", default=DATABASE_FILE, help="File SQLite cần thao tác")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild-stats", help="Tính lại bảng thống kê daily_stats từ lịch sử")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    if args.command == "rebuild-stats":
+        rebuild_stats(db)
+
+if __name__ == '__main__':
+    main()
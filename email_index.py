@@ -0,0 +1,178 @@
+"""
+Email index - Chống nhập trùng email đã có trong kho hoặc đã bán
+
+Bảng email_index trong SQLite là nguồn chính xác; bộ lọc Bloom trong bộ nhớ
+(vài MB cho hàng triệu email, lưu ra file) cho biết chắc chắn email nào chưa
+từng có, nên chỉ các email bộ lọc báo "có thể đã có" mới phải tra SQLite.
+"""
+import hashlib
+import logging
+import math
+import os
+import struct
+import threading
+from typing import List
+
+from database import Database, get_database, normalize_email
+
+try:
+    from config import EMAIL_INDEX_FILE
+except ImportError:
+    EMAIL_INDEX_FILE = "email_index.bloom"
+try:
+    from config import EMAIL_INDEX_CAPACITY
+except ImportError:
+    EMAIL_INDEX_CAPACITY = 5000000  # số email dự kiến, vượt quá thì dựng lại bộ lọc lớn hơn
+try:
+    from config import EMAIL_INDEX_ERROR_RATE
+except ImportError:
+    EMAIL_INDEX_ERROR_RATE = 0.001  # tỉ lệ báo nhầm "có thể đã có"
+
+# Header file bộ lọc: magic, số bit, số hàm băm, sức chứa
+_HEADER = struct.Struct('<4sQIQ')
+_MAGIC = b'EBF1'
+
+class BloomFilter:
+    """Bộ lọc Bloom dùng double hashing trên blake2b"""
+
+    def __init__(self, capacity: int, error_rate: float, num_bits: int = None, num_hashes: int = None):
+        self.capacity = capacity
+        self.num_bits = num_bits or max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = num_hashes or max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def save(self, path: str):
+        """Ghi ra file (ghi file tạm rồi đổi tên để không bao giờ để lại file hỏng)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, self.num_bits, self.num_hashes, self.capacity))
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BloomFilter':
+        with open(path, 'rb') as f:
+            magic, num_bits, num_hashes, capacity = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"File bộ lọc không hợp lệ: {path}")
+            bloom = cls(capacity, EMAIL_INDEX_ERROR_RATE, num_bits, num_hashes)
+            bits = f.read()
+        if len(bits) != len(bloom.bits):
+            raise ValueError(f"File bộ lọc bị cắt cụt: {path}")
+        bloom.bits = bytearray(bits)
+        return bloom
+
+class EmailIndex:
+    """Chỉ mục email dùng chung: Bloom trong bộ nhớ + bảng email_index để xác nhận"""
+
+    def __init__(self, db: Database, path: str = EMAIL_INDEX_FILE, capacity: int = EMAIL_INDEX_CAPACITY,
+                 error_rate: float = EMAIL_INDEX_ERROR_RATE):
+        self.db = db
+        self.path = path
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._count = db.count_indexed_emails()
+        self.bloom = self._load(capacity)
+
+    def _load(self, capacity: int) -> BloomFilter:
+        if os.path.exists(self.path):
+            try:
+                bloom = BloomFilter.load(self.path)
+                if self._count <= bloom.capacity:
+                    return bloom
+            except (OSError, ValueError, struct.error) as e:
+                logging.warning(f"Không đọc được bộ lọc email, dựng lại từ database: {e}")
+
+        # Chưa có file, file hỏng hoặc đã vượt sức chứa
+        return self._rebuild(max(capacity, self._count * 2))
+
+    def _rebuild(self, capacity: int) -> BloomFilter:
+        """Dựng lại bộ lọc từ bảng email_index và lưu ra file"""
+        bloom = BloomFilter(capacity, self.error_rate)
+        after = ''
+        while True:
+            emails = self.db.get_indexed_emails_page(after)
+            if not emails:
+                break
+            for email in emails:
+                bloom.add(email)
+            after = emails[-1]
+
+        bloom.save(self.path)
+        logging.info(f"Đã dựng bộ lọc email từ {self._count} email ({len(bloom.bits) // 1024} KB)")
+        return bloom
+
+    def claim(self, emails: List[str]) -> List[str]:
+        """Ghi nhận các email vào chỉ mục, trả về các email chưa từng có (đã chuẩn hóa, theo thứ tự)"""
+        normalized = [normalize_email(email) for email in emails]
+        with self._lock:
+            maybe_present = {email for email in normalized if email in self.bloom}
+
+        new_emails = self.db.claim_emails(normalized, maybe_present)
+
+        with self._lock:
+            self._count += len(new_emails)
+            if self._count > self.bloom.capacity:
+                # Vượt sức chứa thì tỉ lệ báo nhầm tăng nhanh: dựng lại bộ lọc gấp đôi
+                self.bloom = self._rebuild(self._count * 2)
+            else:
+                for email in normalized:
+                    self.bloom.add(email)
+                self._dirty = True
+        return new_emails
+
+    def release(self, emails: List[str]):
+        """Bỏ các email vừa claim khỏi chỉ mục (ghi vào kho thất bại) để lần nhập sau không coi là trùng
+
+        Bộ lọc Bloom không xóa được phần tử: các email này chỉ bị tra SQLite ở lần sau.
+        """
+        normalized = [normalize_email(email) for email in emails]
+        self.db.unclaim_emails(normalized)
+        with self._lock:
+            self._count = max(0, self._count - len(normalized))
+
+    def remember(self, emails: List[str]):
+        """Thêm vào bộ lọc các email đã được ghi vào email_index ở nơi khác (ví dụ add_inventory_rows)"""
+        with self._lock:
+            for email in emails:
+                email = normalize_email(email)
+                if email not in self.bloom:
+                    self.bloom.add(email)
+                    self._count += 1
+                    self._dirty = True
+            if self._count > self.bloom.capacity:
+                self.bloom = self._rebuild(self._count * 2)
+
+    def save(self):
+        """Lưu bộ lọc ra file nếu có thay đổi"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self.bloom.save(self.path)
+            self._dirty = False
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_email_index() -> EmailIndex:
+    """Chỉ mục email dùng chung trong process cho database trong config"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            from config import DATABASE_FILE
+            _index = EmailIndex(get_database(DATABASE_FILE))
+        return _index
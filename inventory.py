@@ -0,0 +1,482 @@
+"""
+Inventory - Kho email cục bộ và đồng bộ với Google Sheets
+
+Khi INVENTORY_BACKEND = "sqlite", bảng inventory trong database là nguồn chính
+khi bán: mua hàng chỉ là một lần lấy theo index trong SQLite. Google Sheets vẫn
+là nơi admin nhập email; SheetsReconciler chạy nền để:
+- nạp các dòng mới trên sheet vào kho cục bộ (theo đúng thứ tự dòng)
+- xóa khỏi sheet các dòng đầu đã bán bằng một lệnh delete_rows
+
+Kho cục bộ ghi nhận vị trí từng dòng trên sheet (in_sheet > 0), nên chỉ được
+thêm email vào cuối sheet và không sửa/xóa tay các dòng đang có.
+
+Khi INVENTORY_BACKEND = "sheets", sheet vẫn là kho chính nhưng PrefetchBuffer
+chạy nền lấy trước một ít email vào bảng inventory, nên mua hàng cũng chỉ chạm
+SQLite.
+
+Mua hàng giữ chỗ email theo lease (reserve_inventory) rồi mới thanh toán
+(commit_reservation), nên nhiều người mua cùng lúc không lấy trùng email và
+không phải xếp hàng sau một lock chung; lease hết hạn thì email về lại kho.
+"""
+import asyncio
+import collections
+import datetime
+import itertools
+import logging
+import threading
+import time
+
+from database import Database, get_database
+from email_index import EmailIndex, get_email_index
+from google_sheets import GoogleSheetsManager, get_sheets_manager, parse_sheet_row
+from rate_limiter import PRIORITY_CHECKOUT, PRIORITY_COUNT, PRIORITY_STATUS, quota_priority
+from inventory_backends import FileBackend, InventoryBackend, MemoryBackend, SheetsBackend, SQLiteBackend
+from sheets_journal import get_sheets_journal
+
+try:
+    from config import INVENTORY_BACKEND
+except ImportError:
+    INVENTORY_BACKEND = "sheets"
+try:
+    from config import INVENTORY_FILE
+except ImportError:
+    INVENTORY_FILE = "inventory.txt"  # file kho cho INVENTORY_BACKEND = "file"
+try:
+    from config import SHEETS_CONSUME_MODE
+except ImportError:
+    SHEETS_CONSUME_MODE = "delete"  # "delete": xóa dòng khi lấy, "mark": đánh dấu rồi nén theo lịch
+try:
+    from config import SHEETS_COMPACT_HOUR
+except ImportError:
+    SHEETS_COMPACT_HOUR = 4  # giờ (theo giờ máy chủ) chạy nén sheet ở chế độ "mark"
+try:
+    from config import INVENTORY_SYNC_INTERVAL
+except ImportError:
+    INVENTORY_SYNC_INTERVAL = 30  # giây
+try:
+    from config import INVENTORY_SYNC_BATCH
+except ImportError:
+    INVENTORY_SYNC_BATCH = 500  # số dòng đọc/xóa mỗi lần gọi API
+try:
+    from config import INVENTORY_LEASE_SECONDS
+except ImportError:
+    INVENTORY_LEASE_SECONDS = 120  # thời gian giữ chỗ email cho một đơn đang thanh toán
+try:
+    from config import INVENTORY_PREFETCH_LOW
+except ImportError:
+    INVENTORY_PREFETCH_LOW = 20  # nạp thêm khi bộ đệm còn ít hơn số email này
+try:
+    from config import INVENTORY_PREFETCH_HIGH
+except ImportError:
+    INVENTORY_PREFETCH_HIGH = 100  # số email tối đa giữ sẵn trong bộ đệm
+try:
+    from config import INVENTORY_PREFETCH_INTERVAL
+except ImportError:
+    INVENTORY_PREFETCH_INTERVAL = 5  # giây
+try:
+    from config import INVENTORY_COUNT_TTL
+except ImportError:
+    INVENTORY_COUNT_TTL = 60  # giây trước khi làm mới số lượng email từ sheet
+
+# Key trong bảng settings: tên backend đã được ghi vào email_index
+EMAIL_INDEX_BACKFILL_KEY = "email_index_backfill"
+# Số email ghi vào email_index mỗi lần khi backfill
+EMAIL_INDEX_BACKFILL_CHUNK = 10000
+
+class SheetsReconciler:
+    """Đồng bộ hai chiều giữa bảng inventory và Google Sheets, chạy nền"""
+
+    def __init__(self, db: Database, sheets_factory, interval: float = INVENTORY_SYNC_INTERVAL,
+                 batch_size: int = INVENTORY_SYNC_BATCH, index: EmailIndex = None):
+        self.db = db
+        self.sheets_factory = sheets_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.index = index
+        self.last_sync_time = None
+        self.total_ingested = 0
+        self.total_removed = 0
+
+    def remove_sold_rows(self) -> int:
+        """Xóa khỏi sheet các dòng đầu đã bán (hoặc không hợp lệ), trả về số dòng đã xóa"""
+        head = self.db.get_sheet_mirror_head(self.batch_size)
+
+        # Dòng in_sheet = 2 là lần xóa trước chưa xác nhận xong (ví dụ bot bị tắt giữa chừng)
+        deleting = [row for row in head if row[4] == 2]
+        if not deleting:
+            deleting = list(itertools.takewhile(lambda row: row[3] in ('sold', 'invalid', 'removed'), head))
+            if not deleting:
+                return 0
+            self.db.set_sheet_state([row[0] for row in deleting], 2)
+
+        sheets = self.sheets_factory()
+        expected = [(email, password) for _, email, password, _, _ in deleting]
+        current = [parse_sheet_row(row) for row in sheets.read_rows(2, len(deleting))]
+
+        if current == expected:
+            if not sheets.delete_first_rows(len(deleting)):
+                return 0
+        else:
+            # Đầu sheet không còn là các dòng này: lần xóa trước đã thành công hoặc sheet bị sửa tay
+            logging.warning(f"Đầu Google Sheets không khớp {len(deleting)} dòng chờ xóa, coi như đã xóa")
+
+        self.db.set_sheet_state([row[0] for row in deleting], 0)
+        self.total_removed += len(deleting)
+        return len(deleting)
+
+    def ingest_new_rows(self) -> int:
+        """Nạp các dòng mới ở cuối sheet vào kho cục bộ, trả về số dòng đã nạp"""
+        head = self.db.get_sheet_mirror_head(1)
+        if head and head[0][4] == 2:
+            # Chưa xác nhận xong lần xóa trước thì chưa biết vị trí dòng mới
+            return 0
+
+        sheets = self.sheets_factory()
+        ingested = 0
+        while True:
+            offset = self.db.count_sheet_mirror_rows()
+            rows = sheets.read_rows(2 + offset, self.batch_size)
+            if not rows:
+                break
+
+            parsed = [parse_sheet_row(row) for row in rows]
+            self.db.add_inventory_rows(parsed)
+            if self.index:
+                self.index.remember([email for email, password in parsed if email and password])
+            ingested += len(rows)
+            if len(rows) < self.batch_size:
+                break
+
+        self.total_ingested += ingested
+        return ingested
+
+    def sync_once(self) -> dict:
+        """Chạy một vòng đồng bộ: trả lại email giữ chỗ quá hạn, xóa dòng đã bán rồi nạp dòng mới"""
+        released = self.db.release_expired_reservations()
+        if released:
+            logging.info(f"Trả lại kho {released} email giữ chỗ đã hết hạn")
+        removed = self.remove_sold_rows()
+        ingested = self.ingest_new_rows()
+        self.last_sync_time = time.time()
+
+        if removed or ingested:
+            logging.info(f"Đồng bộ kho: xóa {removed} dòng đã bán, nạp {ingested} dòng mới từ Google Sheets")
+        return {'removed': removed, 'ingested': ingested}
+
+    async def run(self):
+        """Vòng lặp nền: đồng bộ mỗi interval giây, lỗi chỉ ghi log rồi thử lại ở vòng sau"""
+        while True:
+            try:
+                await asyncio.to_thread(self.sync_once)
+            except Exception as e:
+                logging.error(f"Lỗi đồng bộ kho với Google Sheets: {e}")
+            await asyncio.sleep(self.interval)
+
+    def get_stats(self) -> dict:
+        """Thống kê đồng bộ kèm trạng thái kho cục bộ"""
+        stats = self.db.get_inventory_stats()
+        stats.update({
+            'last_sync_time': self.last_sync_time,
+            'total_ingested': self.total_ingested,
+            'total_removed': self.total_removed
+        })
+        return stats
+
+class EmailCountCache:
+    """Số email trong kho dùng chung cho mọi handler
+
+    Quá TTL thì vẫn trả giá trị cũ và làm mới ở thread nền (stale-while-revalidate);
+    chỉ lần đọc đầu tiên phải chờ. Mua hàng và nhập kho điều chỉnh số đếm tại chỗ.
+    """
+
+    def __init__(self, loader, ttl: float = INVENTORY_COUNT_TTL):
+        self.loader = loader
+        self.ttl = ttl
+        self._value = None
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self._delta_during_refresh = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> int:
+        """Lấy số đếm hiện có, kích hoạt làm mới nền nếu đã quá TTL"""
+        with self._lock:
+            value = self._value
+            stale = time.monotonic() - self._loaded_at >= self.ttl
+            start_refresh = value is not None and stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+
+        if value is None:
+            return self.refresh()
+        if start_refresh:
+            threading.Thread(target=self._refresh_in_background, name='email-count-refresh', daemon=True).start()
+        return value
+
+    def refresh(self) -> int:
+        """Đọc lại số đếm từ nguồn (chặn người gọi)"""
+        with self._lock:
+            self._refreshing = True
+            self._delta_during_refresh = 0
+
+        try:
+            count = self.loader()
+        except Exception:
+            with self._lock:
+                self._refreshing = False
+            raise
+
+        with self._lock:
+            # Giữ lại các điều chỉnh xảy ra trong lúc đang đọc
+            self._value = max(0, count + self._delta_during_refresh)
+            self._loaded_at = time.monotonic()
+            self._refreshing = False
+            return self._value
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logging.error(f"Lỗi làm mới số lượng email trong kho: {e}")
+
+    def adjust(self, delta: int):
+        """Điều chỉnh số đếm sau khi bán (delta âm) hoặc nhập kho (delta dương)"""
+        with self._lock:
+            if self._value is not None:
+                self._value = max(0, self._value + delta)
+            if self._refreshing:
+                self._delta_during_refresh += delta
+
+    def invalidate(self):
+        """Đánh dấu số đếm đã cũ để lần đọc sau làm mới"""
+        with self._lock:
+            self._loaded_at = 0.0
+
+class PrefetchBuffer:
+    """Bộ đệm email lấy trước từ kho nguồn (InventoryBackend) vào bảng inventory
+
+    Khi số email sẵn sàng trong bộ đệm xuống dưới low_watermark, task nền lấy
+    các dòng đầu kho nguồn vào kho cục bộ cho đến khi bộ đệm đạt high_watermark.
+    Mua hàng chỉ giữ chỗ/thanh toán trên kho cục bộ nên không gọi ra ngoài trên
+    đường nóng. Dòng được lưu trước với in_sheet = 2 rồi mới lấy khỏi nguồn; nếu
+    bot dừng giữa hai bước, lần nạp sau so đầu kho nguồn với các dòng này để
+    hoàn tất, nên không mất hay bán trùng email.
+    """
+
+    def __init__(self, db: Database, source: InventoryBackend,
+                 low_watermark: int = INVENTORY_PREFETCH_LOW, high_watermark: int = INVENTORY_PREFETCH_HIGH,
+                 interval: float = INVENTORY_PREFETCH_INTERVAL, batch_size: int = INVENTORY_SYNC_BATCH,
+                 index: EmailIndex = None):
+        self.db = db
+        self.source = source
+        self.index = index
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.interval = interval
+        self.batch_size = batch_size
+        self.total_prefetched = 0
+        self.refill_count = 0
+        self.last_refill_time = None
+        self._recent = collections.deque()  # (thời điểm, số email) trong 60 giây gần nhất
+        self._lock = threading.Lock()
+        self._waiters_lock = threading.Lock()
+        self._checkout_waiters = 0  # số lần nạp cho đơn hàng đang chờ self._lock
+
+    def _source_call(self, min_depth, method, *args):
+        """Gọi kho nguồn; request của lần nạp nền được nâng lên mức mua hàng khi đang có đơn chờ nó"""
+        urgent = min_depth or self._checkout_waiters
+        with quota_priority(PRIORITY_CHECKOUT if urgent else PRIORITY_COUNT):
+            return method(*args)
+
+    def _finish_pending(self, min_depth: int = None) -> int:
+        """Lấy khỏi kho nguồn các dòng đã lưu vào bộ đệm nhưng chưa xác nhận lấy ra"""
+        pending = [row for row in self.db.get_sheet_mirror_head(self.batch_size) if row[4] == 2]
+        if not pending:
+            return 0
+
+        expected = [(email, password) for _, email, password, _, _ in pending]
+        if self._source_call(min_depth, self.source.peek, len(pending)) == expected:
+            self._source_call(min_depth, self.source.pop_n, len(pending))
+        else:
+            # Đầu kho nguồn không còn là các dòng này: lần lấy trước đã thành công
+            logging.warning(f"Đầu kho {self.source.name} không khớp {len(pending)} dòng chờ lấy, coi như đã lấy")
+
+        self.db.set_sheet_state([row[0] for row in pending], 0)
+        return len(pending)
+
+    def refill(self, min_depth: int = None) -> int:
+        """Nạp bộ đệm lên high_watermark nếu đang dưới ngưỡng, trả về số email đã nạp
+
+        min_depth cho phép nạp ngay khi một đơn cần nhiều hơn số đang có; lần nạp
+        đó dùng độ ưu tiên mua hàng khi xin quota Google Sheets. Đọc đầu kho, lưu
+        và lấy khỏi kho nguồn phải chạy tuần tự nên lần nạp cho đơn vẫn chờ lần
+        nạp nền đang chạy, nhưng các request còn lại của lần nạp nền đó được nâng
+        lên mức mua hàng thay vì chờ quota ở mức thấp.
+        """
+        if min_depth:
+            with self._waiters_lock:
+                self._checkout_waiters += 1
+        try:
+            with self._lock:
+                return self._refill(min_depth)
+        finally:
+            if min_depth:
+                with self._waiters_lock:
+                    self._checkout_waiters -= 1
+
+    def _refill(self, min_depth: int = None) -> int:
+        self._finish_pending(min_depth)
+
+        depth = self.db.count_inventory()
+        threshold = max(self.low_watermark, min_depth or 0)
+        if depth >= threshold:
+            return 0
+
+        if not (min_depth or self._checkout_waiters) and self.source.status().get('remaining_quota', 2) < 2:
+            # Nạp nền chỉ dùng quota còn dư, để dành cho request của người mua
+            return 0
+
+        need = min(max(self.high_watermark, threshold) - depth, self.batch_size)
+        rows = self._source_call(min_depth, self.source.peek, need)
+        if not rows:
+            return 0
+
+        self.db.add_inventory_rows(rows, in_sheet=2)
+        if self.index:
+            self.index.remember([email for email, password in rows if email and password])
+        self._finish_pending(min_depth)
+
+        now = time.time()
+        self.total_prefetched += len(rows)
+        self.refill_count += 1
+        self.last_refill_time = now
+        self._recent.append((now, len(rows)))
+        return len(rows)
+
+    async def run(self):
+        """Vòng lặp nền: kiểm tra và nạp bộ đệm mỗi interval giây"""
+        while True:
+            try:
+                await asyncio.to_thread(self.refill)
+            except Exception as e:
+                logging.error(f"Lỗi nạp bộ đệm email từ kho {self.source.name}: {e}")
+            await asyncio.sleep(self.interval)
+
+    def get_stats(self) -> dict:
+        """Độ sâu bộ đệm và tốc độ nạp (email/phút trong 60 giây gần nhất)"""
+        now = time.time()
+        with self._lock:
+            while self._recent and now - self._recent[0][0] > 60:
+                self._recent.popleft()
+            refill_rate = sum(count for _, count in self._recent)
+
+        return {
+            'depth': self.db.count_inventory(),
+            'low_watermark': self.low_watermark,
+            'high_watermark': self.high_watermark,
+            'refill_rate_per_minute': refill_rate,
+            'total_prefetched': self.total_prefetched,
+            'refill_count': self.refill_count,
+            'last_refill_time': self.last_refill_time
+        }
+
+def _sheets_manager() -> GoogleSheetsManager:
+    from config import GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID
+    return get_sheets_manager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
+
+def _database() -> Database:
+    from config import DATABASE_FILE
+    return get_database(DATABASE_FILE)
+
+def create_reconciler() -> SheetsReconciler:
+    """Tạo reconciler cho database và Google Sheets trong config"""
+    return SheetsReconciler(_database(), _sheets_manager, index=get_email_index())
+
+# Số email trên sheet, dùng chung cho mọi handler
+def _count_sheet_rows() -> int:
+    with quota_priority(PRIORITY_COUNT):
+        return _sheets_manager().count_rows()
+
+email_count_cache = EmailCountCache(_count_sheet_rows)
+
+_backend = None
+_prefetch_buffer = None
+
+def create_backend(name: str = INVENTORY_BACKEND) -> InventoryBackend:
+    """Tạo InventoryBackend theo tên trong config"""
+    if name == "sheets":
+        return SheetsBackend(_sheets_manager, get_sheets_journal, email_count_cache, _database(), SHEETS_CONSUME_MODE)
+    if name == "sqlite":
+        return SQLiteBackend(_database())
+    if name == "file":
+        return FileBackend(INVENTORY_FILE)
+    if name == "memory":
+        return MemoryBackend()
+    raise ValueError(f"INVENTORY_BACKEND không hợp lệ: {name}")
+
+def get_inventory_backend() -> InventoryBackend:
+    """Kho email dùng chung trong process theo INVENTORY_BACKEND"""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+def get_prefetch_buffer() -> PrefetchBuffer:
+    """Bộ đệm lấy trước dùng chung trong process (mọi backend trừ "sqlite")"""
+    global _prefetch_buffer
+    if _prefetch_buffer is None:
+        _prefetch_buffer = PrefetchBuffer(_database(), get_inventory_backend(), index=get_email_index())
+    return _prefetch_buffer
+
+async def run_sheet_compaction(backend: SheetsBackend, hour: int = SHEETS_COMPACT_HOUR):
+    """Mỗi ngày vào giờ vắng khách, xóa đoạn đầu sheet đã đánh dấu bằng một request"""
+    while True:
+        now = datetime.datetime.now()
+        next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += datetime.timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+
+        try:
+            await asyncio.to_thread(backend.compact)
+        except Exception as e:
+            logging.error(f"Lỗi nén Google Sheets: {e}")
+
+def backfill_email_index(backend: InventoryBackend, index: EmailIndex, db: Database,
+                         chunk_size: int = EMAIL_INDEX_BACKFILL_CHUNK) -> int:
+    """Ghi toàn bộ email đang có ở kho nguồn vào email_index, một lần cho mỗi backend
+
+    Migration 8 chỉ đưa vào chỉ mục các email có trong database; email chỉ nằm
+    trên sheet/file thì phải đọc từ kho nguồn. Trả về số email mới được ghi.
+    """
+    if db.get_setting(EMAIL_INDEX_BACKFILL_KEY) == backend.name:
+        return 0
+
+    added = scanned = 0
+    # Đọc từng trang chunk_size dòng để không giữ cả kho trong bộ nhớ; kho rỗng thì không đọc
+    if backend.count():
+        with quota_priority(PRIORITY_STATUS):
+            for rows in backend.scan(chunk_size):
+                scanned += len(rows)
+                emails = [email for email, password in rows if email and password]
+                if emails:
+                    added += len(index.claim(emails))
+    index.save()
+
+    db.set_setting(EMAIL_INDEX_BACKFILL_KEY, backend.name)
+    logging.info(f"Đã ghi {added}/{scanned} email của kho {backend.name} vào chỉ mục chống trùng")
+    return added
+
+def get_available_email_count() -> int:
+    """Số email còn bán được: bộ đệm cục bộ cộng phần còn ở kho nguồn"""
+    if INVENTORY_BACKEND == "sqlite":
+        return _database().count_inventory()
+    return _database().count_inventory() + get_inventory_backend().count()
+
+def get_inventory_preview(limit: int = 10) -> list:
+    """Các email sắp được bán tiếp theo: bộ đệm cục bộ trước, rồi đến đầu kho nguồn"""
+    emails = _database().get_inventory_preview(limit)
+    if INVENTORY_BACKEND == "sqlite" or len(emails) >= limit:
+        return emails
+    with quota_priority(PRIORITY_STATUS):
+        return emails + get_inventory_backend().peek(limit - len(emails))
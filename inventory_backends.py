@@ -0,0 +1,352 @@
+"""
+Inventory backends - Các nơi lưu kho email có chung một interface
+
+InventoryBackend gồm count, peek, pop_n, append_many, scan và status; INVENTORY_BACKEND
+trong config chọn cài đặt:
+- "sheets": Google Sheets qua gspread (ghi đi qua nhật ký write-behind)
+- "sqlite": bảng inventory trong database của bot
+- "file": file text append-only, mỗi dòng "email:password"
+- "memory": trong bộ nhớ, dùng cho benchmark/chạy thử offline
+
+Mỗi dòng là (email, password); dòng không đọc được là (None, None) để giữ đúng
+vị trí khi so sánh với đầu kho.
+"""
+import collections
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Iterator, List, Optional, Protocol, Tuple
+
+from database import Database
+from google_sheets import parse_sheet_row
+
+Row = Tuple[Optional[str], Optional[str]]
+
+# Giá trị cột C của dòng đã lấy khỏi kho ở chế độ "mark" và khóa lưu con trỏ đầu kho
+CONSUMED_MARKER = "consumed"
+SHEET_HEAD_KEY = "sheet_head"
+
+class InventoryBackend(Protocol):
+    """Kho email theo thứ tự FIFO: lấy ở đầu, thêm ở cuối"""
+
+    name: str
+
+    def count(self) -> int:
+        """Số dòng đang có trong kho"""
+
+    def peek(self, n: int) -> List[Row]:
+        """Xem n dòng đầu mà không lấy ra"""
+
+    def pop_n(self, n: int) -> List[Row]:
+        """Lấy và xóa n dòng đầu, lỗi được ném ra (không lấy dòng nào)"""
+
+    def append_many(self, rows: List[Row]) -> int:
+        """Thêm các dòng vào cuối kho, trả về số dòng đã thêm"""
+
+    def scan(self, chunk_size: int) -> Iterator[List[Row]]:
+        """Đọc lần lượt toàn bộ kho theo từng trang chunk_size dòng, không lấy ra"""
+
+    def status(self) -> dict:
+        """Trạng thái không tốn request ra ngoài (quota, kích thước...)"""
+
+class SheetsBackend:
+    """Google Sheets: đọc qua GoogleSheetsManager, ghi thêm qua SheetsJournal
+
+    consume_mode "delete" xóa các dòng đầu mỗi lần lấy. consume_mode "mark" chỉ
+    ghi trạng thái vào cột C:D của các dòng đã lấy bằng một request và tăng con
+    trỏ đầu kho (lưu trong bảng settings); compact() xóa cả đoạn đã đánh dấu
+    bằng một delete_rows, chạy vào giờ vắng khách.
+    """
+
+    name = "sheets"
+
+    def __init__(self, sheets_factory, journal_factory, count_cache, db: Database = None,
+                 consume_mode: str = "delete"):
+        self.sheets_factory = sheets_factory
+        self.journal_factory = journal_factory
+        self.count_cache = count_cache
+        self.db = db
+        self.consume_mode = consume_mode
+        self._head = int(db.get_setting(SHEET_HEAD_KEY, '0')) if consume_mode == "mark" else 0
+        self._head_checked = False
+        # Số dòng đã xóa khỏi đầu sheet trong process; _shift_version lẻ khi đang xóa
+        self._shift = 0
+        self._shift_version = 0
+
+    def _set_head(self, head: int):
+        self.db.set_setting(SHEET_HEAD_KEY, str(head))
+        self._head = head
+
+    def _validated_head(self, sheets) -> int:
+        """Con trỏ đầu kho, lần đầu trong process được đối chiếu với cột C trên sheet
+
+        Con trỏ lưu cục bộ có thể lệch nếu bot dừng giữa lúc đánh dấu/nén; khi đó
+        đếm lại đoạn đầu đã đánh dấu trên sheet.
+        """
+        if self._head_checked:
+            return self._head
+
+        head = self._head
+        cells = sheets.read_range(f"C{head + 1}:C{head + 2}" if head else "C2:C2")
+        values = [row[0] if row else '' for row in cells]
+        values += [''] * ((2 if head else 1) - len(values))
+        if (head and values[0] != CONSUMED_MARKER) or values[-1] == CONSUMED_MARKER:
+            column = [row[0] if row else '' for row in sheets.read_range("C2:C")]
+            head = sum(1 for _ in itertools.takewhile(lambda value: value == CONSUMED_MARKER, column))
+            logging.warning(f"Con trỏ đầu kho Google Sheets lệch ({self._head}), đã đếm lại: {head}")
+            self._set_head(head)
+
+        self._head_checked = True
+        return head
+
+    def count(self) -> int:
+        return max(0, self.count_cache.get() - self._head)
+
+    def peek(self, n: int) -> List[Row]:
+        sheets = self.sheets_factory()
+        if self.consume_mode == "mark":
+            with sheets.purchase_lock:
+                start_row = 2 + self._validated_head(sheets)
+        else:
+            start_row = 2
+        return [parse_sheet_row(row) for row in sheets.read_rows(start_row, n)]
+
+    def pop_n(self, n: int) -> List[Row]:
+        sheets = self.sheets_factory()
+        with sheets.purchase_lock:
+            if self.consume_mode == "mark":
+                head = self._validated_head(sheets)
+                rows = sheets.read_rows(2 + head, n)
+                if rows:
+                    # Một request ghi trạng thái cho cả đoạn, không dịch chuyển dòng nào
+                    consumed_at = time.strftime("%Y-%m-%d %H:%M:%S")
+                    sheets.update_range(f"C{2 + head}:D{1 + head + len(rows)}",
+                                        [[CONSUMED_MARKER, consumed_at]] * len(rows))
+                    self._set_head(head + len(rows))
+            else:
+                rows = sheets.read_rows(2, n)
+                if rows:
+                    self._delete_head_rows(sheets, len(rows))
+                self.count_cache.adjust(-len(rows))
+        return [parse_sheet_row(row) for row in rows]
+
+    def _delete_head_rows(self, sheets, n: int, error: str = "Không xóa được {} dòng đầu Google Sheets"):
+        """Xóa n dòng đầu sheet (gọi khi giữ purchase_lock), ghi nhận độ dịch cho scan"""
+        self._shift_version += 1
+        try:
+            if not sheets.delete_first_rows(n):
+                raise RuntimeError(error.format(n))
+            self._shift += n
+        finally:
+            self._shift_version += 1
+
+    def scan(self, chunk_size: int) -> Iterator[List[Row]]:
+        """Đọc từng trang bằng read_rows mà không giữ purchase_lock trong lúc đọc
+
+        Vị trí đọc tính theo số dòng kể cả các dòng đã bị xóa khỏi đầu sheet; trang
+        nào đọc trùng lúc đang xóa đầu sheet thì đọc lại.
+        """
+        sheets = self.sheets_factory()
+        with sheets.purchase_lock:
+            head = self._validated_head(sheets) if self.consume_mode == "mark" else 0
+            position = 2 + head + self._shift
+        while True:
+            version = self._shift_version
+            if version % 2:
+                time.sleep(0.05)
+                continue
+            start_row = max(2, position - self._shift)
+            rows = sheets.read_rows(start_row, chunk_size)
+            if self._shift_version != version:
+                continue
+            position = start_row + self._shift + len(rows)
+            if rows:
+                yield [parse_sheet_row(row) for row in rows]
+            if len(rows) < chunk_size:
+                return
+
+    def compact(self) -> int:
+        """Xóa đoạn đầu đã đánh dấu bằng một delete_rows, trả về số dòng đã xóa"""
+        if self.consume_mode != "mark":
+            return 0
+
+        sheets = self.sheets_factory()
+        with sheets.purchase_lock:
+            head = self._validated_head(sheets)
+            if not head:
+                return 0
+            self._delete_head_rows(sheets, head, "Không nén được {} dòng đã dùng trên Google Sheets")
+            self._set_head(0)
+            self.count_cache.adjust(-head)
+
+        logging.info(f"Đã nén Google Sheets: xóa {head} dòng đã dùng")
+        return head
+
+    def append_many(self, rows: List[Row]) -> int:
+        added = self.journal_factory().append_rows([[email, password] for email, password in rows])
+        self.count_cache.adjust(added)
+        return added
+
+    def status(self) -> dict:
+        sheets = self.sheets_factory()
+        return {
+            'backend': self.name,
+            'consume_mode': self.consume_mode,
+            'consumed_rows': self._head,
+            'requests_per_minute': sheets.pool.requests_per_minute(),
+            'remaining_quota': max(0, int(sheets.pool.available())),
+            'request_count': sheets.request_count
+        }
+
+class SQLiteBackend:
+    """Bảng inventory: dòng thêm trực tiếp không nằm trên sheet (in_sheet = 0)"""
+
+    name = "sqlite"
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def count(self) -> int:
+        return self.db.count_inventory()
+
+    def peek(self, n: int) -> List[Row]:
+        return self.db.get_inventory_preview(n)
+
+    def pop_n(self, n: int) -> List[Row]:
+        return self.db.pop_inventory(n)
+
+    def append_many(self, rows: List[Row]) -> int:
+        return self.db.add_inventory_rows(rows, in_sheet=0)
+
+    def scan(self, chunk_size: int) -> Iterator[List[Row]]:
+        # add_inventory_rows đã ghi email vào email_index cùng transaction
+        return iter(())
+
+    def status(self) -> dict:
+        stats = self.db.get_inventory_stats()
+        stats['backend'] = self.name
+        return stats
+
+class FileBackend:
+    """File text append-only; vị trí đầu kho (byte offset) lưu trong file "<path>.offset" """
+
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            open(path, 'a').close()
+        self._offset = self._load_offset()
+        self._count = self._count_lines()
+
+    def _load_offset(self) -> int:
+        try:
+            with open(self.offset_path) as f:
+                return json.load(f)['offset']
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _save_offset(self, offset: int):
+        tmp_path = f"{self.offset_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'offset': offset}, f)
+        os.replace(tmp_path, self.offset_path)
+        self._offset = offset
+
+    def _count_lines(self) -> int:
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            return sum(1 for line in f if line.strip())
+
+    def _read(self, n: int) -> Tuple[List[Row], int]:
+        rows = []
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            while len(rows) < n:
+                line = f.readline()
+                if not line:
+                    break
+                if line.strip():
+                    rows.append(parse_sheet_row([line.decode('utf-8', errors='replace')]))
+            return rows, f.tell()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._count
+
+    def peek(self, n: int) -> List[Row]:
+        with self._lock:
+            return self._read(n)[0]
+
+    def pop_n(self, n: int) -> List[Row]:
+        with self._lock:
+            rows, offset = self._read(n)
+            self._save_offset(offset)
+            self._count -= len(rows)
+            return rows
+
+    def append_many(self, rows: List[Row]) -> int:
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.writelines(f"{email}:{password}\n" for email, password in rows)
+            self._count += len(rows)
+            return len(rows)
+
+    def scan(self, chunk_size: int) -> Iterator[List[Row]]:
+        with self._lock:
+            offset = self._offset
+        rows = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if line.strip():
+                    rows.append(parse_sheet_row([line.decode('utf-8', errors='replace')]))
+                    if len(rows) == chunk_size:
+                        yield rows
+                        rows = []
+        if rows:
+            yield rows
+
+    def status(self) -> dict:
+        with self._lock:
+            return {'backend': self.name, 'path': self.path, 'count': self._count, 'offset': self._offset}
+
+class MemoryBackend:
+    """Kho trong bộ nhớ, mất khi khởi động lại"""
+
+    name = "memory"
+
+    def __init__(self, rows: List[Row] = None):
+        self._rows = collections.deque(rows or [])
+        self._lock = threading.Lock()
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def peek(self, n: int) -> List[Row]:
+        with self._lock:
+            return [self._rows[i] for i in range(min(n, len(self._rows)))]
+
+    def pop_n(self, n: int) -> List[Row]:
+        with self._lock:
+            return [self._rows.popleft() for _ in range(min(n, len(self._rows)))]
+
+    def append_many(self, rows: List[Row]) -> int:
+        with self._lock:
+            self._rows.extend(rows)
+            return len(rows)
+
+    def scan(self, chunk_size: int) -> Iterator[List[Row]]:
+        with self._lock:
+            rows = list(self._rows)
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
+
+    def status(self) -> dict:
+        return {'backend': self.name, 'count': self.count()}
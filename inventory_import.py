@@ -0,0 +1,143 @@
+"""
+Inventory import - Nhập kho email hàng loạt từ file .txt/.csv admin gửi lên
+
+File được đọc từng dòng (không nạp cả file vào bộ nhớ). Mỗi dòng được kiểm tra
+và chuẩn hóa thành (email, password); các dòng hợp lệ gom thành chunk theo kích
+thước JSON thật của request appendCells sẽ gửi lên, lọc bỏ email đã có trong chỉ mục
+chống trùng (email_index) rồi ghi vào kho đang cấu hình bằng một append_many
+(với Google Sheets: một mục nhật ký; flusher nền gửi nó thành các appendCells
+trong cùng một batchUpdate, tối đa SHEETS_BATCH_MAX_BYTES mỗi request).
+"""
+import csv
+import logging
+import re
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+from email_index import EmailIndex, get_email_index
+from inventory_backends import InventoryBackend
+from sheets_batch import append_row_bytes, append_rows_request, request_bytes
+
+try:
+    from config import IMPORT_MAX_PAYLOAD_BYTES
+except ImportError:
+    IMPORT_MAX_PAYLOAD_BYTES = 2 * 1024 * 1024  # Google khuyến nghị payload mỗi request ≤ 2 MB
+try:
+    from config import IMPORT_MAX_FILE_BYTES
+except ImportError:
+    IMPORT_MAX_FILE_BYTES = 20 * 1024 * 1024  # Giới hạn tải file của Bot API
+
+EMAIL_PATTERN = re.compile(r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$')
+SUPPORTED_EXTENSIONS = ('.txt', '.csv')
+MAX_SHEET_ID = 2 ** 31 - 1
+
+def normalize_row(email: str, password: str) -> Optional[Tuple[str, str]]:
+    """Chuẩn hóa (email, password): bỏ khoảng trắng/dấu nháy, email viết thường; không hợp lệ trả về None"""
+    email = email.strip().strip('"\'').lower()
+    password = password.strip().strip('"\'')
+    if not password or not EMAIL_PATTERN.match(email):
+        return None
+    return (email, password)
+
+def parse_import_line(line: str) -> Optional[Tuple[str, str]]:
+    """Tách một dòng text "email:password" (chấp nhận cả dấu | hoặc tab)"""
+    line = line.strip()
+    for separator in (':', '|', '\t'):
+        if separator in line:
+            email, password = line.split(separator, 1)
+            return normalize_row(email, password)
+    return None
+
+def iter_import_rows(path: str) -> Iterator[Optional[Tuple[str, str]]]:
+    """Đọc file từng dòng, trả về (email, password) hoặc None cho dòng không hợp lệ; bỏ dòng trống và header"""
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        if path.lower().endswith('.csv'):
+            first_line = f.readline()
+            f.seek(0)
+            delimiter = ';' if first_line.count(';') > first_line.count(',') else ','
+            for cells in csv.reader(f, delimiter=delimiter):
+                cells = [cell for cell in cells if cell.strip()]
+                if not cells or cells[0].strip().lower() == 'email':
+                    continue
+                if len(cells) >= 2:
+                    yield normalize_row(cells[0], cells[1])
+                else:
+                    yield parse_import_line(cells[0])
+        else:
+            for line in f:
+                if not line.strip() or line.strip().lower().startswith('email:password'):
+                    continue
+                yield parse_import_line(line)
+
+class InventoryImporter:
+    """Nhập một file vào kho, tiến độ đọc được từ thread khác qua get_progress()"""
+
+    def __init__(self, backend: InventoryBackend, index: EmailIndex, max_payload_bytes: int = IMPORT_MAX_PAYLOAD_BYTES):
+        self.backend = backend
+        self.index = index
+        self.max_payload_bytes = max_payload_bytes
+        self._lock = threading.Lock()
+        self._progress = {'processed': 0, 'accepted': 0, 'rejected': 0, 'duplicates': 0, 'chunks': 0}
+
+    def _update(self, **counters):
+        with self._lock:
+            for key, value in counters.items():
+                self._progress[key] += value
+
+    def get_progress(self) -> dict:
+        with self._lock:
+            return dict(self._progress)
+
+    def add_rows(self, chunk: List[Tuple[str, str]]):
+        """Lọc email trùng khỏi chunk rồi ghi phần còn lại vào kho bằng một lệnh append"""
+        new_emails = set(self.index.claim([email for email, _ in chunk]))
+        rows = []
+        for email, password in chunk:
+            if email in new_emails:
+                rows.append((email, password))
+                new_emails.discard(email)
+
+        if rows:
+            try:
+                self.backend.append_many(rows)
+            except Exception:
+                # Email chưa vào kho thì không được tính là đã có
+                self.index.release([email for email, _ in rows])
+                raise
+        self._update(accepted=len(rows), duplicates=len(chunk) - len(rows), chunks=1 if rows else 0)
+
+    def import_file(self, path: str) -> dict:
+        """Đọc, kiểm tra và ghi file vào kho; trả về báo cáo accepted/rejected/duplicates (hàm chặn thread)"""
+        # Kích thước chunk tính đúng như body appendCells (rowData/values/userEnteredValue),
+        # với sheetId dài nhất có thể
+        empty_bytes = request_bytes(append_rows_request(MAX_SHEET_ID, []))
+        chunk, chunk_bytes = [], empty_bytes
+        for row in iter_import_rows(path):
+            if row is None:
+                self._update(processed=1, rejected=1)
+                continue
+
+            email, password = row
+            row_bytes = append_row_bytes([email, password])
+            self._update(processed=1)
+            if chunk and chunk_bytes + row_bytes > self.max_payload_bytes:
+                self.add_rows(chunk)
+                chunk, chunk_bytes = [], empty_bytes
+            chunk.append((email, password))
+            chunk_bytes += row_bytes
+
+        if chunk:
+            self.add_rows(chunk)
+        self.index.save()
+
+        report = self.get_progress()
+        logging.info(f"Nhập kho từ file: {report['accepted']} hợp lệ, {report['rejected']} lỗi, "
+                     f"{report['duplicates']} trùng, {report['chunks']} chunk")
+        return report
+
+def add_new_emails(backend: InventoryBackend, rows: List[Tuple[str, str]]) -> int:
+    """Thêm một ít (email, password) đã chuẩn hóa vào kho, bỏ email trùng; trả về số email đã thêm"""
+    importer = InventoryImporter(backend, get_email_index())
+    importer.add_rows(rows)
+    importer.index.save()
+    return importer.get_progress()['accepted']
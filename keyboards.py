@@ -109,18 +109,22 @@ def get_back_keyboard(callback_data="user_back"):
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def get_pagination_keyboard(page, total_pages, prefix="page"):
-    """Keyboard phân trang"""
+def get_pagination_keyboard(page, total_pages, prefix="page", prev_cursor=None, next_cursor=None):
+    """Keyboard phân trang theo cursor
+    
+    callback_data có dạng {prefix}_p_{trang}_{cursor} (trang trước) hoặc
+    {prefix}_n_{trang}_{cursor} (trang sau); số trang chỉ dùng để hiển thị.
+    """
     keyboard = []
     
     nav_buttons = []
-    if page > 1:
-        nav_buttons.append(InlineKeyboardButton("⬅️ Trước", callback_data=f"{prefix}_{page-1}"))
+    if prev_cursor:
+        nav_buttons.append(InlineKeyboardButton("⬅️ Trước", callback_data=f"{prefix}_p_{page-1}_{prev_cursor}"))
     
     nav_buttons.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="ignore"))
     
-    if page < total_pages:
-        nav_buttons.append(InlineKeyboardButton("Sau ➡️", callback_data=f"{prefix}_{page+1}"))
+    if next_cursor:
+        nav_buttons.append(InlineKeyboardButton("Sau ➡️", callback_data=f"{prefix}_n_{page+1}_{next_cursor}"))
     
     if nav_buttons:
         keyboard.append(nav_buttons)
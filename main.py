@@ -2,8 +2,12 @@ import logging
 import asyncio
 from telegram import Update, MenuButton, MenuButtonCommands, MenuButtonWebApp, WebAppInfo
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from database import Database
-from google_sheets import GoogleSheetsManager
+from database import get_database
+from google_sheets import get_sheets_manager
+from email_index import get_email_index
+from inventory import (INVENTORY_BACKEND, SHEETS_CONSUME_MODE, backfill_email_index, create_reconciler,
+                       get_available_email_count, get_inventory_backend, get_prefetch_buffer, run_sheet_compaction)
+from sheets_journal import get_sheets_journal
 from keyboards import *
 from config import *
 from admin_handlers import *
@@ -19,16 +23,26 @@ logger = logging.getLogger(__name__)
 
 class GmailBot:
     def __init__(self):
-        self.db = Database(DATABASE_FILE)
-        
-        # Khởi tạo Google Sheets nếu có thể
-        try:
-            self.sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-            self.sheets.setup_sheet_headers()
-            logger.info("Đã kết nối Google Sheets thành công")
-        except Exception as e:
-            logger.error(f"Lỗi kết nối Google Sheets: {e}")
-            self.sheets = None
+        self.db = get_database(DATABASE_FILE)
+        # Nạp user vào bộ nhớ: kiểm tra ban/đăng ký user mỗi update không cần chạm database
+        logger.info(f"Đã nạp {self.db.load_user_registry()} user vào registry")
+        
+        # Khởi tạo Google Sheets nếu kho đang dùng đến sheet ("file"/"memory" chạy hoàn toàn offline)
+        self.sheets = None
+        if INVENTORY_BACKEND in ("sheets", "sqlite"):
+            try:
+                self.sheets = get_sheets_manager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
+                try:
+                    headers_ok = self.sheets.has_headers()
+                except Exception as e:
+                    logger.warning(f"Không kiểm tra được header Google Sheets, sẽ ghi lại qua nhật ký: {e}")
+                    headers_ok = False
+                if not headers_ok:
+                    get_sheets_journal().ensure_headers()
+                logger.info("Đã kết nối Google Sheets thành công")
+            except Exception as e:
+                logger.error(f"Lỗi kết nối Google Sheets: {e}")
+                self.sheets = None
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Command /start"""
@@ -251,6 +265,18 @@ class GmailBot:
             logger.error(f"Lỗi xử lý callback {data}: {e}")
             await query.answer("❌ Có lỗi xảy ra! Vui lòng thử lại.")
     
+    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Xử lý file gửi lên: chỉ admin đang ở bước thêm email, dùng để nhập kho hàng loạt"""
+        if update.effective_user.id not in ADMIN_IDS:
+            return
+        
+        # File gửi ngoài bước "Thêm email" không được nhập vào kho đang bán
+        if not context.user_data.get('waiting_for_emails'):
+            await update.message.reply_text("ℹ️ Muốn nhập kho từ file, hãy chọn ➕ Thêm email trước rồi gửi file.")
+            return
+        
+        await process_admin_import_document(update, context)
+    
     async def handle_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Xử lý tin nhắn text"""
         user_id = update.effective_user.id
@@ -318,6 +344,13 @@ class GmailBot:
         if update and update.effective_message:
             await update.effective_message.reply_text("❌ **Có lỗi xảy ra!**\n\nVui lòng thử lại sau hoặc liên hệ admin.", parse_mode='Markdown')
     
+    async def index_existing_stock(self):
+        """Lần đầu chạy với kho ngoài database: ghi email đang có trong kho vào chỉ mục chống trùng"""
+        try:
+            await asyncio.to_thread(backfill_email_index, get_inventory_backend(), get_email_index(), self.db)
+        except Exception as e:
+            logger.error(f"Lỗi ghi kho hiện có vào chỉ mục email: {e}")
+
     async def setup_menu_button(self):
         """Thiết lập menu button dưới thanh chat"""
         try:
@@ -424,8 +457,7 @@ class GmailBot:
         
         # Kiểm tra số lượng email trong kho
         try:
-            sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-            email_count = sheets.get_email_count()
+            email_count = await asyncio.to_thread(get_available_email_count)
         except:
             email_count = 0
         
@@ -623,8 +655,7 @@ Chọn số tiền bạn muốn nạp:
         """Mua email nhanh"""
         # Kiểm tra số lượng email trong kho
         try:
-            sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-            email_count = sheets.get_email_count()
+            email_count = await asyncio.to_thread(get_available_email_count)
         except:
             email_count = 0
         
@@ -721,6 +752,7 @@ Chọn số lượng email:"""
         application.add_handler(CommandHandler("contact", self.contact_command))
         application.add_handler(CallbackQueryHandler(self.handle_callback_query))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_message))
+        application.add_handler(MessageHandler(filters.Document.ALL, self.handle_document))
         
         # Error handler
         application.add_error_handler(self.error_handler)
@@ -729,6 +761,19 @@ Chọn số lượng email:"""
         async def post_init(app):
             await self.set_bot_commands()
             await self.setup_menu_button()
+            
+            # Nhật ký ghi Google Sheets: gửi nền các thao tác đã ghi nhận (kể cả từ lần chạy trước)
+            app.create_task(get_sheets_journal().run())
+            
+            # Kho cục bộ: đồng bộ nền với Google Sheets; kho trên sheet: giữ sẵn bộ đệm email
+            if INVENTORY_BACKEND == "sqlite":
+                self.reconciler = create_reconciler()
+                app.create_task(self.reconciler.run())
+            else:
+                app.create_task(self.index_existing_stock())
+                app.create_task(get_prefetch_buffer().run())
+            if INVENTORY_BACKEND == "sheets" and SHEETS_CONSUME_MODE == "mark":
+                app.create_task(run_sheet_compaction(get_inventory_backend()))
         
         application.post_init = post_init
         
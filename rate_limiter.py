@@ -0,0 +1,174 @@
+"""
+Rate limiter - Token bucket và hàng đợi quota theo độ ưu tiên
+
+TokenBucket đếm quota; người gọi không lấy token trực tiếp từ bucket mà qua
+QuotaScheduler.acquire, chạy trong thread (handler async gọi Google Sheets qua
+asyncio.to_thread), nên event loop không bao giờ bị chặn khi chờ quota.
+
+QuotaScheduler xếp hàng các request dùng chung một bucket theo độ ưu tiên
+(mua hàng > đếm kho > nhập kho > xem trước/trạng thái) và giữ lại một phần
+token cho mua hàng. Độ ưu tiên của thread hiện tại đặt bằng quota_priority();
+asyncio.to_thread chép context nên đặt trong handler async là đủ.
+"""
+import collections
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from config import SHEETS_CHECKOUT_RESERVE
+except ImportError:
+    SHEETS_CHECKOUT_RESERVE = 2  # số token chỉ mua hàng được dùng
+
+# Độ ưu tiên: số nhỏ được phục vụ trước
+PRIORITY_CHECKOUT = 0
+PRIORITY_COUNT = 1
+PRIORITY_IMPORT = 2
+PRIORITY_STATUS = 3
+PRIORITY_NAMES = {
+    PRIORITY_CHECKOUT: 'checkout',
+    PRIORITY_COUNT: 'count',
+    PRIORITY_IMPORT: 'import',
+    PRIORITY_STATUS: 'status'
+}
+
+# Request không khai báo độ ưu tiên được xếp như ghi nền (nhập kho, nhật ký)
+_current_priority = contextvars.ContextVar('quota_priority', default=PRIORITY_IMPORT)
+
+def current_priority() -> int:
+    """Độ ưu tiên của context hiện tại"""
+    return _current_priority.get()
+
+@contextmanager
+def quota_priority(priority: int):
+    """Các request Google Sheets trong khối with dùng độ ưu tiên priority"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+class TokenBucket:
+    """Token bucket: tối đa rate_per_minute request trong mọi cửa sổ 60 giây
+
+    Bucket chứa tối đa burst token; phần còn lại của quota được nạp đều trong
+    một phút, nên burst + lượng nạp trong 60 giây không vượt rate_per_minute.
+    """
+
+    def __init__(self, rate_per_minute: int, burst: int = 5):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = max(1, min(burst, rate_per_minute))
+        self.refill_rate = max(1, rate_per_minute - self.capacity) / 60.0  # token/giây
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_rate)
+        self._updated_at = now
+
+    def reserve(self, tokens: int = 1) -> float:
+        """Đặt trước token, trả về số giây phải chờ trước khi được gửi request"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.refill_rate
+
+    def available(self) -> float:
+        """Số token có thể dùng ngay (âm nếu đã có người đặt trước)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def time_until_available(self, tokens: int = 1) -> float:
+        """Số giây đến khi có đủ token mà không phải chờ"""
+        missing = tokens - self.available()
+        return max(0.0, missing / self.refill_rate)
+
+class QuotaScheduler:
+    """Cấp token của một TokenBucket theo độ ưu tiên
+
+    Tại mỗi thời điểm chỉ request đứng đầu hàng (ưu tiên cao nhất, đến sớm nhất)
+    được lấy token. Các lớp khác mua hàng chỉ được lấy khi bucket còn nhiều hơn
+    checkout_reserve token, nên mua hàng luôn có sẵn token dù đang nhập kho lớn.
+    """
+
+    def __init__(self, bucket: TokenBucket, checkout_reserve: int = SHEETS_CHECKOUT_RESERVE):
+        self.bucket = bucket
+        self.checkout_reserve = max(0, min(checkout_reserve, bucket.capacity - 1))
+        self._cond = threading.Condition()
+        self._waiting = []  # heap (priority, seq)
+        self._seq = itertools.count()
+        self._stats = {priority: {'requests': 0, 'total_wait': 0.0, 'max_wait': 0.0} for priority in PRIORITY_NAMES}
+
+    def _tokens_needed(self, priority: int) -> int:
+        return 1 if priority == PRIORITY_CHECKOUT else 1 + self.checkout_reserve
+
+    def can_acquire(self, tokens: int = 1, priority: int = None) -> bool:
+        """Lấy được tokens token ngay mà không chạm phần giữ cho mua hàng và không chen hàng"""
+        priority = current_priority() if priority is None else priority
+        with self._cond:
+            if self._waiting and self._waiting[0][0] <= priority:
+                return False
+            return self.bucket.available() >= tokens - 1 + self._tokens_needed(priority)
+
+    def time_until_available(self, priority: int = None) -> float:
+        """Số giây đến khi lớp priority có đủ token (không tính người đang xếp hàng)"""
+        priority = current_priority() if priority is None else priority
+        return self.bucket.time_until_available(self._tokens_needed(priority))
+
+    def acquire(self, priority: int = None) -> float:
+        """Chờ (chặn thread) đến lượt và lấy một token, trả về thời gian đã chờ"""
+        priority = current_priority() if priority is None else priority
+        started = time.monotonic()
+        entry = (priority, next(self._seq))
+
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    if self._waiting[0] == entry:
+                        delay = self.bucket.time_until_available(self._tokens_needed(priority))
+                        if delay <= 0:
+                            self.bucket.reserve()
+                            break
+                    else:
+                        delay = 1.0  # chờ người đứng trước, được đánh thức khi họ lấy xong
+                    self._cond.wait(timeout=delay)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+            waited = time.monotonic() - started
+            stats = self._stats.setdefault(priority, {'requests': 0, 'total_wait': 0.0, 'max_wait': 0.0})
+            stats['requests'] += 1
+            stats['total_wait'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+        return waited
+
+    def get_stats(self) -> dict:
+        """Số request, thời gian chờ trung bình/lớn nhất và số đang chờ của từng lớp"""
+        with self._cond:
+            waiting = collections.Counter(priority for priority, _ in self._waiting)
+            return {
+                PRIORITY_NAMES.get(priority, str(priority)): {
+                    'requests': stats['requests'],
+                    'avg_wait': (stats['total_wait'] / stats['requests']) if stats['requests'] else 0.0,
+                    'max_wait': stats['max_wait'],
+                    'waiting': waiting.get(priority, 0)
+                }
+                for priority, stats in sorted(self._stats.items())
+            }
+
+def backoff_delay(attempt: int, base: float = 4.0, cap: float = 64.0) -> float:
+    """Thời gian chờ retry theo exponential backoff có jitter: nửa cố định, nửa ngẫu nhiên"""
+    delay = min(cap, base * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,236 @@
+"""
+Sheets batch - Gom các thao tác ghi Google Sheets thành một spreadsheets.batchUpdate
+
+Mỗi lần gọi append_rows, delete_rows hay update là một HTTP request và tốn một
+lượt quota. Các hàm *_request dựng request batchUpdate tương ứng (appendCells,
+deleteDimension, updateCells); SheetsBatchBuilder gom request của nhiều người
+gọi trong một cửa sổ ngắn, gửi bằng một batchUpdate rồi trả lại phần replies
+của từng người qua Future.
+
+batchUpdate là nguyên tử: lỗi thì không request nào trong batch được áp dụng.
+Lỗi quota/mất kết nối được trả cho mọi người gọi trong batch (có thể thử lại an
+toàn); lỗi khác thì request của từng người gọi được gửi lại riêng, để request
+hỏng của một người không làm hỏng lây người khác.
+
+Request mua hàng (PRIORITY_CHECKOUT) đi một làn riêng (hàng đợi và thread gửi
+riêng), nên không bao giờ được gộp chung hay phải xếp sau một batch ghi nền
+(nhật ký, nhập kho) đang chờ quota.
+"""
+import json
+import logging
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+from rate_limiter import PRIORITY_CHECKOUT, current_priority
+from sheets_credentials import is_rate_limit_error
+
+try:
+    from config import SHEETS_BATCH_WINDOW_MS
+except ImportError:
+    SHEETS_BATCH_WINDOW_MS = 200  # thời gian chờ gom thao tác ghi (ms)
+try:
+    from config import SHEETS_BATCH_MAX_REQUESTS
+except ImportError:
+    SHEETS_BATCH_MAX_REQUESTS = 100  # số request tối đa trong một batchUpdate
+try:
+    from config import SHEETS_BATCH_MAX_BYTES
+except ImportError:
+    SHEETS_BATCH_MAX_BYTES = 8 * 1024 * 1024  # kích thước JSON tối đa của body batchUpdate (Google giới hạn 10 MB)
+
+A1_CELL_PATTERN = re.compile(r'^([A-Za-z]+)(\d+)$')
+
+def a1_to_grid(cell: str) -> tuple:
+    """Ô A1 (ví dụ "C12") thành (rowIndex, columnIndex) tính từ 0"""
+    match = A1_CELL_PATTERN.match(cell.strip())
+    if not match:
+        raise ValueError(f"Ô A1 không hợp lệ: {cell}")
+
+    column = 0
+    for letter in match.group(1).upper():
+        column = column * 26 + ord(letter) - ord('A') + 1
+    return int(match.group(2)) - 1, column - 1
+
+def _row_data(values: List[str]) -> dict:
+    return {'values': [{'userEnteredValue': {'stringValue': str(value)}} for value in values]}
+
+def append_rows_request(sheet_id: int, rows: List[List[str]]) -> dict:
+    """Thêm các dòng vào sau dòng cuối có dữ liệu"""
+    return {'appendCells': {
+        'sheetId': sheet_id,
+        'rows': [_row_data(row) for row in rows],
+        'fields': 'userEnteredValue'
+    }}
+
+def request_bytes(request: dict) -> int:
+    """Kích thước JSON của request khi gửi lên (gspread/requests dùng json.dumps mặc định)"""
+    return len(json.dumps(request))
+
+def batch_bytes(requests: List[dict]) -> int:
+    """Kích thước JSON của body batchUpdate {"requests": [...]}"""
+    return len(json.dumps({'requests': []})) + sum(request_bytes(request) + 2 for request in requests)
+
+def append_row_bytes(row: List[str]) -> int:
+    """Số byte một dòng làm tăng body appendCells, kể cả dấu phân cách ", " """
+    return len(json.dumps(_row_data(row))) + 2
+
+def delete_rows_request(sheet_id: int, start_row: int, count: int) -> dict:
+    """Xóa count dòng bắt đầu từ start_row (đánh số từ 1 như trên sheet)"""
+    return {'deleteDimension': {'range': {
+        'sheetId': sheet_id,
+        'dimension': 'ROWS',
+        'startIndex': start_row - 1,
+        'endIndex': start_row - 1 + count
+    }}}
+
+def update_range_request(sheet_id: int, start_cell: str, values: List[List[str]]) -> dict:
+    """Ghi giá trị bắt đầu từ ô start_cell (A1)"""
+    row_index, column_index = a1_to_grid(start_cell)
+    return {'updateCells': {
+        'start': {'sheetId': sheet_id, 'rowIndex': row_index, 'columnIndex': column_index},
+        'rows': [_row_data(row) for row in values],
+        'fields': 'userEnteredValue'
+    }}
+
+# Làn gửi: request mua hàng và mọi request ghi nền còn lại
+LANE_CHECKOUT = 'checkout'
+LANE_BACKGROUND = 'background'
+
+class SheetsBatchBuilder:
+    """Mỗi làn một thread gửi: gom request từ nhiều người gọi và gửi bằng một batchUpdate
+
+    send(requests, priority) gửi danh sách request và trả về danh sách replies
+    theo đúng thứ tự; batch xin quota với độ ưu tiên cao nhất trong các người
+    gọi. Người gọi nhận Future chứa replies của chính các request mình gửi.
+    Một batch không vượt max_requests request và max_bytes byte JSON (trừ khi
+    một người gọi đã gửi nhiều hơn thế). Làn mua hàng không chờ cửa sổ gom:
+    batch gồm những gì đã xếp hàng trong lúc batch trước đang gửi.
+    """
+
+    def __init__(self, send, window: float = SHEETS_BATCH_WINDOW_MS / 1000,
+                 max_requests: int = SHEETS_BATCH_MAX_REQUESTS, max_bytes: int = SHEETS_BATCH_MAX_BYTES):
+        self.send = send
+        self.window = window
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self._queues = {LANE_CHECKOUT: queue.Queue(), LANE_BACKGROUND: queue.Queue()}
+        self._windows = {LANE_CHECKOUT: 0.0, LANE_BACKGROUND: window}
+        self._carry = {LANE_CHECKOUT: None, LANE_BACKGROUND: None}
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._submissions = 0
+        self._requests = 0
+        self._failed_batches = 0
+        self._isolated_retries = 0
+        self._max_batch_seen = 0
+        self._threads = [threading.Thread(target=self._run, args=(lane,), name=f'sheets-batch-{lane}', daemon=True)
+                         for lane in self._queues]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, requests: List[dict]) -> Future:
+        """Đưa các request vào batch kế tiếp, trả về Future chứa replies của chúng"""
+        future = Future()
+        if not requests:
+            future.set_result([])
+            return future
+        priority = current_priority()
+        lane = LANE_CHECKOUT if priority == PRIORITY_CHECKOUT else LANE_BACKGROUND
+        self._queues[lane].put((list(requests), future, priority, batch_bytes(requests)))
+        return future
+
+    def _collect_batch(self, lane: str, first) -> list:
+        """Gom thêm người gọi cùng làn trong cửa sổ gom của làn kể từ người đầu tiên"""
+        batch = [first]
+        total, size = len(first[0]), first[3]
+        wrapper_bytes = batch_bytes([])  # phần {"requests": []} chỉ tính một lần cho cả batch
+        pending = self._queues[lane]
+        deadline = time.monotonic() + self._windows[lane]
+
+        while total < self.max_requests:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = pending.get(timeout=remaining)
+                else:
+                    item = pending.get_nowait()
+            except queue.Empty:
+                break
+
+            if total + len(item[0]) > self.max_requests or size + item[3] - wrapper_bytes > self.max_bytes:
+                # Để dành cho batch sau, giữ nguyên thứ tự
+                self._carry[lane] = item
+                break
+            batch.append(item)
+            total += len(item[0])
+            size += item[3] - wrapper_bytes
+
+        return batch
+
+    def _run(self, lane: str):
+        while True:
+            first, self._carry[lane] = self._carry[lane] or self._queues[lane].get(), None
+            self._send_batch(self._collect_batch(lane, first))
+
+    def _send_batch(self, batch: list):
+        """Gửi cả batch bằng một request rồi chia replies cho từng người gọi"""
+        requests = [request for submitted, _, _, _ in batch for request in submitted]
+        priority = min(priority for _, _, priority, _ in batch)
+        try:
+            replies = self.send(requests, priority) or []
+        except Exception as e:
+            with self._stats_lock:
+                self._failed_batches += 1
+            logging.error(f"Lỗi gửi batchUpdate {len(requests)} request ({len(batch)} người gọi): {e}")
+            if len(batch) > 1 and not is_rate_limit_error(e) and not isinstance(e, ConnectionError):
+                self._send_each(batch)
+            else:
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+            return
+
+        self._record(batch, len(requests))
+        offset = 0
+        for submitted, future, _, _ in batch:
+            future.set_result(replies[offset:offset + len(submitted)])
+            offset += len(submitted)
+
+    def _send_each(self, batch: list):
+        """Gửi lại riêng request của từng người gọi sau khi batch gộp bị lỗi"""
+        for item in batch:
+            submitted, future, priority, _ = item
+            with self._stats_lock:
+                self._isolated_retries += 1
+            try:
+                replies = self.send(submitted, priority) or []
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self._record([item], len(submitted))
+            future.set_result(replies)
+
+    def _record(self, batch: list, request_count: int):
+        with self._stats_lock:
+            self._batches += 1
+            self._submissions += len(batch)
+            self._requests += request_count
+            self._max_batch_seen = max(self._max_batch_seen, request_count)
+
+    def get_stats(self) -> dict:
+        """Số batch đã gửi và số request được gom vào mỗi batch"""
+        with self._stats_lock:
+            return {
+                'queue_depth': sum(pending.qsize() for pending in self._queues.values()),
+                'checkout_queue_depth': self._queues[LANE_CHECKOUT].qsize(),
+                'window_ms': self.window * 1000,
+                'batches': self._batches,
+                'submissions': self._submissions,
+                'requests': self._requests,
+                'failed_batches': self._failed_batches,
+                'isolated_retries': self._isolated_retries,
+                'avg_requests_per_batch': (self._requests / self._batches) if self._batches else 0.0,
+                'max_requests_per_batch': self._max_batch_seen
+            }
@@ -0,0 +1,199 @@
+"""
+Sheets credentials - Chia quota Google Sheets cho nhiều service account
+
+Quota Google Sheets tính theo từng user (service account) mỗi phút, nên mỗi
+credential có phiên gspread, token bucket và bộ xếp hàng ưu tiên riêng.
+CredentialPool chọn credential sẽ có token sớm nhất cho mỗi request; credential
+bị 429 được rút khỏi vòng quay một thời gian (backoff tăng dần theo số lần bị
+429 liên tiếp) trong khi các credential khác tiếp tục phục vụ.
+
+Lưu ý: quota mỗi project vẫn là giới hạn chung cho các service account cùng
+project.
+"""
+import logging
+import os
+import threading
+import time
+from typing import List, Tuple
+
+from rate_limiter import PRIORITY_NAMES, QuotaScheduler, TokenBucket, backoff_delay
+
+# Thời gian tối thiểu giữa hai lần thử kết nối lại một credential (giây)
+RECONNECT_INTERVAL = 30
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Lỗi 429 / vượt quota của Google Sheets"""
+    error_str = str(error).lower()
+    return any(marker in error_str for marker in ('quota exceeded', 'rate_limit_exceeded', '429', 'limit exceeded'))
+
+def is_auth_error(error: Exception) -> bool:
+    """Lỗi do phiên xác thực hết hạn hoặc bị thu hồi - cần authorize lại"""
+    error_str = str(error).lower()
+    return any(marker in error_str for marker in ('401', 'unauthenticated', 'invalid_grant', 'token has been expired'))
+
+class SheetsCredential:
+    """Một service account: worksheet đã mở, quota và tình trạng sức khỏe"""
+
+    def __init__(self, credentials_file: str, requests_per_minute: int):
+        self.credentials_file = credentials_file
+        self.name = os.path.basename(credentials_file)
+        self.worksheet = None
+        self.last_connect_attempt = 0
+        self.bucket = TokenBucket(requests_per_minute)
+        self.scheduler = QuotaScheduler(self.bucket)
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.consecutive_rate_limits = 0
+        self.drained_until = 0.0
+        self.last_error = None
+
+    def is_healthy(self, now: float = None) -> bool:
+        """Đã kết nối và không bị rút khỏi vòng quay vì 429"""
+        return self.worksheet is not None and (now or time.time()) >= self.drained_until
+
+class CredentialPool:
+    """Nhóm credential cùng mở một spreadsheet
+
+    opener(credentials_file, sheet_id) authorize và trả về worksheet đầu tiên;
+    lỗi được ném ra.
+    """
+
+    def __init__(self, credentials_files: List[str], sheet_id: str, opener, requests_per_minute: int):
+        if not credentials_files:
+            raise ValueError("Cần ít nhất một file credentials Google Sheets")
+        self.sheet_id = sheet_id
+        self.opener = opener
+        self.credentials = [SheetsCredential(path, requests_per_minute) for path in credentials_files]
+        self._lock = threading.Lock()
+
+    def connect(self, credential: SheetsCredential):
+        """Authorize lại một credential và mở worksheet"""
+        credential.last_connect_attempt = time.time()
+        try:
+            credential.worksheet = self.opener(credential.credentials_file, self.sheet_id)
+            logging.info(f"Đã kết nối Google Sheets bằng {credential.name}")
+        except Exception as e:
+            logging.error(f"Lỗi kết nối Google Sheets bằng {credential.name}: {e}")
+            credential.worksheet = None
+            credential.last_error = str(e)
+
+    def connect_all(self):
+        with self._lock:
+            for credential in self.credentials:
+                self.connect(credential)
+
+    def ensure_connected(self) -> bool:
+        """Kết nối lại các credential đang mất kết nối (tối đa một lần mỗi RECONNECT_INTERVAL giây)"""
+        now = time.time()
+        if all(credential.worksheet for credential in self.credentials):
+            return True
+
+        with self._lock:
+            for credential in self.credentials:
+                if not credential.worksheet and now - credential.last_connect_attempt >= RECONNECT_INTERVAL:
+                    self.connect(credential)
+        return any(credential.worksheet for credential in self.credentials)
+
+    @property
+    def worksheet(self):
+        """Worksheet của credential đầu tiên đang kết nối (để đọc id, tiêu đề)"""
+        for credential in self.credentials:
+            if credential.worksheet:
+                return credential.worksheet
+        return None
+
+    def _choose(self, priority: int) -> SheetsCredential:
+        now = time.time()
+        healthy = [credential for credential in self.credentials if credential.is_healthy(now)]
+        if healthy:
+            # Credential có token sớm nhất, hòa thì chọn credential còn nhiều token hơn
+            return min(healthy, key=lambda credential: (credential.scheduler.time_until_available(priority),
+                                                        -credential.bucket.available()))
+
+        connected = [credential for credential in self.credentials if credential.worksheet]
+        if not connected:
+            raise ConnectionError("Chưa kết nối đến Google Sheets")
+        # Tất cả đang bị rút: dùng credential hồi phục sớm nhất
+        return min(connected, key=lambda credential: credential.drained_until)
+
+    def acquire(self, priority: int) -> Tuple[SheetsCredential, float]:
+        """Chọn credential và chờ (chặn thread) đến lượt trên credential đó, trả về (credential, thời gian chờ)"""
+        with self._lock:
+            credential = self._choose(priority)
+
+        drained_for = max(0.0, credential.drained_until - time.time())
+        if drained_for > 0:
+            time.sleep(drained_for)
+        waited = drained_for + credential.scheduler.acquire(priority)
+        credential.request_count += 1
+        return credential, waited
+
+    def has_healthy(self) -> bool:
+        now = time.time()
+        return any(credential.is_healthy(now) for credential in self.credentials)
+
+    def report_success(self, credential: SheetsCredential):
+        credential.consecutive_rate_limits = 0
+
+    def report_rate_limited(self, credential: SheetsCredential, error: Exception):
+        """Rút credential khỏi vòng quay sau khi bị 429"""
+        credential.rate_limited_count += 1
+        credential.drained_until = time.time() + backoff_delay(credential.consecutive_rate_limits)
+        credential.consecutive_rate_limits += 1
+        credential.last_error = str(error)
+        logging.warning(f"Credential {credential.name} bị giới hạn quota, tạm ngưng "
+                        f"{credential.drained_until - time.time():.0f} giây")
+
+    def can_acquire(self, tokens: int = 1, priority: int = None) -> bool:
+        """Có credential nào phục vụ được ngay tokens request ở độ ưu tiên priority"""
+        now = time.time()
+        return any(credential.scheduler.can_acquire(tokens, priority)
+                   for credential in self.credentials if credential.is_healthy(now))
+
+    def available(self) -> float:
+        """Tổng số token có thể dùng ngay trên các credential khỏe"""
+        now = time.time()
+        return sum(max(0.0, credential.bucket.available())
+                   for credential in self.credentials if credential.is_healthy(now))
+
+    def requests_per_minute(self) -> int:
+        """Tổng quota mỗi phút của các credential khỏe"""
+        now = time.time()
+        return sum(credential.bucket.rate_per_minute
+                   for credential in self.credentials if credential.is_healthy(now))
+
+    def time_until_full(self) -> float:
+        """Số giây đến khi một credential khỏe nạp đầy bucket"""
+        now = time.time()
+        waits = [credential.bucket.time_until_available(credential.bucket.capacity)
+                 for credential in self.credentials if credential.is_healthy(now)]
+        return min(waits) if waits else 0.0
+
+    def get_stats(self) -> List[dict]:
+        """Tình trạng từng credential"""
+        now = time.time()
+        return [{
+            'name': credential.name,
+            'connected': credential.worksheet is not None,
+            'healthy': credential.is_healthy(now),
+            'drained_for': max(0.0, credential.drained_until - now),
+            'request_count': credential.request_count,
+            'rate_limited_count': credential.rate_limited_count,
+            'remaining_quota': max(0, int(credential.bucket.available())),
+            'last_error': credential.last_error
+        } for credential in self.credentials]
+
+    def get_scheduler_stats(self) -> dict:
+        """Thời gian chờ quota theo lớp ưu tiên, gộp mọi credential"""
+        merged = {name: {'requests': 0, 'avg_wait': 0.0, 'max_wait': 0.0, 'waiting': 0}
+                  for name in PRIORITY_NAMES.values()}
+        for credential in self.credentials:
+            for name, stats in credential.scheduler.get_stats().items():
+                total = merged.setdefault(name, {'requests': 0, 'avg_wait': 0.0, 'max_wait': 0.0, 'waiting': 0})
+                requests = total['requests'] + stats['requests']
+                if requests:
+                    total['avg_wait'] = (total['avg_wait'] * total['requests'] + stats['avg_wait'] * stats['requests']) / requests
+                total['requests'] = requests
+                total['max_wait'] = max(total['max_wait'], stats['max_wait'])
+                total['waiting'] += stats['waiting']
+        return merged
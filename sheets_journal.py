@@ -0,0 +1,213 @@
+"""
+Sheets journal - Ghi Google Sheets kiểu write-behind
+
+Các thao tác ghi nền lên sheet (thêm dòng, sửa header) được ghi vào
+bảng sheets_journal trong database trước, nên người gọi không phải chờ Google
+và thao tác không bị mất khi gặp rate limit hay khi bot khởi động lại.
+SheetsJournal chạy nền, gửi nhật ký lên sheet theo đúng thứ tự: các lệnh thêm
+liền nhau được gộp thành một appendCells, và cả đoạn đầu nhật ký được gửi bằng
+một batchUpdate (một lượt quota) khi quota còn. Mỗi batch bị giới hạn theo số
+byte JSON; lệnh thêm quá lớn được gửi từng phần. Thao tác đầu nhật ký gửi lỗi
+quá SHEETS_JOURNAL_MAX_ATTEMPTS lần (không phải do quota/mất kết nối) được
+chuyển sang bảng sheets_journal_dead để các thao tác sau không bị kẹt.
+
+Lấy dòng khỏi đầu sheet (InventoryBackend.pop_n) vẫn đọc và xóa đồng bộ dưới
+purchase_lock vì hai bước đó phải liền nhau để không bán trùng email.
+"""
+import asyncio
+import logging
+import time
+from typing import List
+
+from database import Database, get_database
+from google_sheets import GoogleSheetsManager, get_sheets_manager
+from rate_limiter import backoff_delay
+from sheets_batch import (SHEETS_BATCH_MAX_BYTES, SHEETS_BATCH_MAX_REQUESTS, append_row_bytes, append_rows_request,
+                          batch_bytes, request_bytes, update_range_request)
+from sheets_credentials import is_rate_limit_error
+
+try:
+    from config import SHEETS_JOURNAL_INTERVAL
+except ImportError:
+    SHEETS_JOURNAL_INTERVAL = 5  # giây
+try:
+    from config import SHEETS_JOURNAL_BATCH_ROWS
+except ImportError:
+    SHEETS_JOURNAL_BATCH_ROWS = 500  # số dòng tối đa mỗi lệnh append_rows
+try:
+    from config import SHEETS_JOURNAL_MAX_ATTEMPTS
+except ImportError:
+    SHEETS_JOURNAL_MAX_ATTEMPTS = 10  # số lần gửi lỗi trước khi chuyển thao tác sang sheets_journal_dead
+
+# Số thao tác đọc từ nhật ký mỗi vòng
+JOURNAL_READ_LIMIT = 200
+
+class SheetsJournal:
+    """Nhật ký ghi Google Sheets bền vững và flusher nền gửi nhật ký lên sheet"""
+
+    def __init__(self, db: Database, sheets_factory, interval: float = SHEETS_JOURNAL_INTERVAL,
+                 batch_rows: int = SHEETS_JOURNAL_BATCH_ROWS, max_bytes: int = SHEETS_BATCH_MAX_BYTES,
+                 max_attempts: int = SHEETS_JOURNAL_MAX_ATTEMPTS):
+        self.db = db
+        self.sheets_factory = sheets_factory
+        self.interval = interval
+        self.batch_rows = batch_rows
+        self.max_bytes = max_bytes
+        self.max_attempts = max_attempts
+        self.last_flush_time = None
+        self.total_flushed = 0
+        self.total_failures = 0
+
+    def append_rows(self, rows: List[List[str]]) -> int:
+        """Ghi nhận thêm các dòng [email, password] vào cuối sheet (gửi trong một batchUpdate nếu vừa max_bytes)"""
+        if rows:
+            self.db.enqueue_sheet_ops([('append', {'rows': rows})])
+        return len(rows)
+
+    def ensure_headers(self):
+        """Ghi nhận ghi lại header Email/Password ở dòng 1"""
+        self.db.enqueue_sheet_ops([('header', {})])
+
+    def _next_group(self, sheet_id: int, entries: list, max_bytes: int) -> tuple:
+        """Gộp các thao tác cùng loại liền nhau ở đầu nhật ký thành một request không quá max_bytes
+
+        Trả về (request, số byte, id các thao tác đã gộp hết, (id, payload còn lại)
+        nếu thao tác cuối chỉ được gộp một phần). Lệnh thêm dài hơn batch_rows
+        hoặc max_bytes bị cắt ở giới hạn; phần còn lại thành request kế tiếp.
+        """
+        first_id, op, payload = entries[0][0], entries[0][1], entries[0][2]
+        if op != 'append':
+            request = self._build_request(sheet_id, op, payload)
+            return request, request_bytes(request), [first_id], None
+
+        rows, ids = [], []
+        size = request_bytes(append_rows_request(sheet_id, []))
+        for op_id, next_op, next_payload, _, _ in entries:
+            if next_op != 'append':
+                break
+            for index, row in enumerate(next_payload['rows']):
+                row_bytes = append_row_bytes(row)
+                if rows and (len(rows) >= self.batch_rows or size + row_bytes > max_bytes):
+                    remaining = (op_id, {'rows': next_payload['rows'][index:]}) if index else None
+                    return append_rows_request(sheet_id, rows), size, ids, remaining
+                rows.append(row)
+                size += row_bytes
+            ids.append(op_id)
+        return append_rows_request(sheet_id, rows), size, ids, None
+
+    def _build_request(self, sheet_id: int, op: str, payload: dict) -> dict:
+        """Request batchUpdate cho một thao tác"""
+        if op == 'append':
+            return append_rows_request(sheet_id, payload['rows'])
+        if op == 'header':
+            return update_range_request(sheet_id, 'A1', [['Email', 'Password']])
+        raise ValueError(f"Thao tác không hỗ trợ: {op}")
+
+    def _collect(self, sheet_id: int, entries: list) -> tuple:
+        """Đoạn đầu nhật ký vừa một batchUpdate: (requests, id đã xong, (id, payload còn lại) hoặc None)
+
+        Lệnh thêm bị cắt theo batch_rows không làm dừng batch: phần còn lại đi
+        tiếp thành các appendCells sau trong cùng batchUpdate cho đến max_bytes.
+        """
+        requests, ids, remaining = [], [], None
+        size = batch_bytes([])
+        while entries and len(requests) < SHEETS_BATCH_MAX_REQUESTS:
+            request, request_size, group_ids, group_remaining = self._next_group(
+                sheet_id, entries, self.max_bytes - size - 2)
+            if requests and size + request_size + 2 > self.max_bytes:
+                # Không còn chỗ: để batch sau
+                break
+            requests.append(request)
+            ids.extend(group_ids)
+            size += request_size + 2
+            remaining = group_remaining
+            entries = entries[len(group_ids):]
+            if remaining:
+                op_id, payload = remaining
+                entries = [(op_id, 'append', payload, 0, 0)] + entries[1:]
+        return requests, ids, remaining
+
+    def flush_once(self) -> int:
+        """Gửi một batch nhật ký lên sheet nếu quota còn, trả về số request đã gửi (0 nếu không gửi được)"""
+        entries = self.db.get_sheet_journal_head(JOURNAL_READ_LIMIT)
+        if not entries or entries[0][4] > time.time():
+            return 0
+
+        sheets = self.sheets_factory()
+        if not sheets.is_rate_limit_safe(1) or not sheets.ensure_connected():
+            return 0
+
+        head_id, head_op, head_attempts = entries[0][0], entries[0][1], entries[0][3]
+        # Thao tác đầu đã lỗi thì gửi riêng nó: lỗi lần sau chắc chắn do chính nó, không do thao tác gộp chung
+        isolated = head_attempts > 0
+        requests = []
+        try:
+            requests, ids, remaining = self._collect(sheets.worksheet.id, entries[:1] if isolated else entries)
+            # Cả đoạn gửi bằng một batchUpdate: thành công hoặc không thao tác nào được áp dụng
+            sheets.submit_batch(requests)
+        except Exception as e:
+            self.total_failures += 1
+            transient = is_rate_limit_error(e) or isinstance(e, ConnectionError)
+            if isolated and not transient and head_attempts + 1 >= self.max_attempts:
+                # Chờ mãi thao tác hỏng sẽ kẹt cả nhật ký: cất nó sang bảng riêng
+                self.db.dead_letter_sheet_op(head_id, str(e))
+                logging.error(f"Bỏ thao tác nhật ký Google Sheets #{head_id} ({head_op}) sau "
+                              f"{head_attempts + 1} lần lỗi, đã chuyển sang sheets_journal_dead: {e}")
+                return 0
+
+            # Giữ nguyên thứ tự: thao tác đầu chưa xong thì các thao tác sau phải chờ
+            self.db.defer_sheet_op(head_id, str(e), time.time() + backoff_delay(head_attempts))
+            logging.error(f"Lỗi gửi nhật ký Google Sheets ({head_op}, {len(requests)} request, lần {head_attempts + 1}): {e}")
+            return 0
+
+        self.db.complete_sheet_ops(ids, remaining)
+        self.total_flushed += len(ids)
+        self.last_flush_time = time.time()
+        return len(requests)
+
+    def drain(self) -> int:
+        """Gửi liên tiếp từng batch cho đến khi nhật ký trống, chưa đến hạn thử lại hoặc hết quota,
+        trả về tổng số request đã gửi
+
+        flush_once tự trả 0 khi quota không còn, nên nhật ký tồn đọng được gửi
+        với tốc độ quota cho phép thay vì một batch mỗi interval giây.
+        """
+        total = 0
+        while True:
+            sent = self.flush_once()
+            if not sent:
+                return total
+            total += sent
+
+    async def run(self):
+        """Vòng lặp nền: gửi hết phần nhật ký gửi được, rồi nghỉ interval giây khi rảnh hoặc bị chặn"""
+        while True:
+            try:
+                await asyncio.to_thread(self.drain)
+            except Exception as e:
+                logging.error(f"Lỗi flusher nhật ký Google Sheets: {e}")
+            await asyncio.sleep(self.interval)
+
+    def get_stats(self) -> dict:
+        """Độ sâu, độ trễ nhật ký và bộ đếm của flusher"""
+        stats = self.db.get_sheet_journal_stats()
+        stats.update({
+            'last_flush_time': self.last_flush_time,
+            'total_flushed': self.total_flushed,
+            'total_failures': self.total_failures
+        })
+        return stats
+
+def _sheets_manager() -> GoogleSheetsManager:
+    from config import GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID
+    return get_sheets_manager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
+
+_journal = None
+
+def get_sheets_journal() -> SheetsJournal:
+    """Nhật ký dùng chung trong process cho database và Google Sheets trong config"""
+    global _journal
+    if _journal is None:
+        from config import DATABASE_FILE
+        _journal = SheetsJournal(get_database(DATABASE_FILE), _sheets_manager)
+    return _journal
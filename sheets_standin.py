@@ -0,0 +1,222 @@
+"""
+Sheets stand-in - Google Sheets giả lập trong process để chạy thử nhóm credential
+
+StandinServer giữ một spreadsheet trong bộ nhớ dùng chung cho mọi credential và
+đếm request của từng credential trong cửa sổ trượt; vượt quota thì trả lỗi 429
+giống Google. opener của nó thay cho open_worksheet khi tạo GoogleSheetsManager,
+nên toàn bộ đường đi (token bucket, xếp hàng ưu tiên, rút credential bị 429,
+batchUpdate) chạy được mà không cần mạng.
+
+Chạy mô phỏng:
+    python sheets_standin.py
+    python sheets_standin.py --requests 300 --quotas 120 120 30 --rate 120
+"""
+import argparse
+import collections
+import re
+import threading
+import time
+from typing import Dict, List
+
+A1_RANGE_PATTERN = re.compile(r'^([A-Z]+)(\d+)(?::([A-Z]+)(\d*))?$')
+
+class StandinQuotaError(Exception):
+    """Lỗi giống APIError 429 của gspread"""
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+class StandinServer:
+    """Spreadsheet trong bộ nhớ với quota riêng cho từng credential"""
+
+    def __init__(self, quotas: Dict[str, int] = None, window_seconds: float = 60.0, default_quota: int = 60):
+        self.quotas = dict(quotas or {})
+        self.window_seconds = window_seconds
+        self.default_quota = default_quota
+        self.rows = [['Email', 'Password']]
+        self.request_log = collections.defaultdict(collections.deque)
+        self.served = collections.Counter()
+        self.rejected = collections.Counter()
+        self._lock = threading.Lock()
+
+    def opener(self, credentials_file: str, sheet_id: str) -> 'StandinWorksheet':
+        """Dùng thay open_worksheet: mở worksheet thay mặt credentials_file"""
+        return StandinWorksheet(self, credentials_file)
+
+    def charge(self, credentials_file: str):
+        """Tính một request cho credential, vượt quota trong cửa sổ thì ném lỗi 429"""
+        now = time.monotonic()
+        with self._lock:
+            log = self.request_log[credentials_file]
+            while log and now - log[0] >= self.window_seconds:
+                log.popleft()
+            if len(log) >= self.quotas.get(credentials_file, self.default_quota):
+                self.rejected[credentials_file] += 1
+                raise StandinQuotaError("APIError: [429]: Quota exceeded for quota metric 'Write requests' "
+                                        "(RATE_LIMIT_EXCEEDED)")
+            log.append(now)
+            self.served[credentials_file] += 1
+
+    def apply(self, requests: List[dict]) -> List[dict]:
+        """Áp dụng các request batchUpdate (appendCells, deleteDimension, updateCells) theo thứ tự"""
+        with self._lock:
+            rows = [list(row) for row in self.rows]
+            for request in requests:
+                (kind, body), = request.items()
+                if kind == 'appendCells':
+                    del rows[self._last_data_row(rows) + 1:]
+                    rows.extend([self._values(row_data) for row_data in body['rows']])
+                elif kind == 'deleteDimension':
+                    del rows[body['range']['startIndex']:body['range']['endIndex']]
+                elif kind == 'updateCells':
+                    start_row, start_column = body['start']['rowIndex'], body['start']['columnIndex']
+                    for offset, row_data in enumerate(body['rows']):
+                        while len(rows) <= start_row + offset:
+                            rows.append([])
+                        self._write(rows[start_row + offset], start_column, self._values(row_data))
+                else:
+                    raise ValueError(f"Request không hỗ trợ: {kind}")
+            self.rows = rows
+        return [{} for _ in requests]
+
+    @staticmethod
+    def _last_data_row(rows: List[List[str]]) -> int:
+        for index in range(len(rows) - 1, -1, -1):
+            if any(rows[index]):
+                return index
+        return -1
+
+    @staticmethod
+    def _values(row_data: dict) -> List[str]:
+        return [cell.get('userEnteredValue', {}).get('stringValue', '') for cell in row_data.get('values', [])]
+
+    @staticmethod
+    def _write(row: List[str], start_column: int, values: List[str]):
+        while len(row) < start_column + len(values):
+            row.append('')
+        row[start_column:start_column + len(values)] = values
+
+    def read(self, range_name: str) -> List[List[str]]:
+        match = A1_RANGE_PATTERN.match(range_name)
+        if not match:
+            raise ValueError(f"Vùng A1 không hỗ trợ: {range_name}")
+        first_column = _column_index(match.group(1))
+        last_column = _column_index(match.group(3) or match.group(1))
+        first_row = int(match.group(2))
+        with self._lock:
+            last_row = int(match.group(4)) if match.group(4) else len(self.rows)
+            values = [list(row[first_column:last_column + 1]) for row in self.rows[first_row - 1:last_row]]
+        for row in values:
+            while row and not row[-1]:
+                row.pop()
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+class StandinSpreadsheet:
+    def __init__(self, worksheet: 'StandinWorksheet'):
+        self.worksheet = worksheet
+
+    def batch_update(self, body: dict) -> dict:
+        self.worksheet.server.charge(self.worksheet.credentials_file)
+        return {'replies': self.worksheet.server.apply(body['requests'])}
+
+class StandinWorksheet:
+    """Các method gspread.Worksheet mà GoogleSheetsManager dùng, mỗi lần gọi là một request"""
+
+    id = 0
+    title = "Stand-in"
+
+    def __init__(self, server: StandinServer, credentials_file: str):
+        self.server = server
+        self.credentials_file = credentials_file
+        self.spreadsheet = StandinSpreadsheet(self)
+
+    def get(self, range_name: str) -> List[List[str]]:
+        self.server.charge(self.credentials_file)
+        return self.server.read(range_name)
+
+    def col_values(self, column: int) -> List[str]:
+        self.server.charge(self.credentials_file)
+        with self.server._lock:
+            values = [row[column - 1] if len(row) >= column else '' for row in self.server.rows]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def row_values(self, row: int) -> List[str]:
+        self.server.charge(self.credentials_file)
+        values = self.server.read(f"A{row}:Z{row}")
+        return values[0] if values else []
+
+    def append_rows(self, rows: List[List[str]], **kwargs):
+        self.server.charge(self.credentials_file)
+        self.server.apply([{'appendCells': {'rows': [
+            {'values': [{'userEnteredValue': {'stringValue': str(value)}} for value in row]} for row in rows
+        ]}}])
+
+    def append_row(self, row: List[str], **kwargs):
+        self.append_rows([row])
+
+    def delete_rows(self, start_index: int, end_index: int = None):
+        self.server.charge(self.credentials_file)
+        end_index = end_index or start_index
+        self.server.apply([{'deleteDimension': {'range': {'startIndex': start_index - 1, 'endIndex': end_index}}}])
+
+    def get_all_records(self) -> List[dict]:
+        self.server.charge(self.credentials_file)
+        with self.server._lock:
+            header, rows = self.server.rows[0], self.server.rows[1:]
+        return [dict(zip(header, row)) for row in rows if any(row)]
+
+def main():
+    from google_sheets import GoogleSheetsManager
+    from rate_limiter import PRIORITY_CHECKOUT, PRIORITY_IMPORT, quota_priority
+
+    parser = argparse.ArgumentParser(description="Chạy thử nhóm credential Google Sheets trên stand-in")
+    parser.add_argument("--requests", type=int, default=200, help="Tổng số lần ghi")
+    parser.add_argument("--threads", type=int, default=4, help="Số thread ghi song song")
+    parser.add_argument("--quotas", type=int, nargs="+", default=[600, 600, 20],
+                        help="Quota mỗi phút của stand-in cho từng credential")
+    parser.add_argument("--rate", type=int, default=600, help="SHEETS_REQUESTS_PER_MINUTE của bot cho mỗi credential")
+    args = parser.parse_args()
+
+    files = [f"standin-{i + 1}.json" for i in range(len(args.quotas))]
+    server = StandinServer(dict(zip(files, args.quotas)))
+    sheets = GoogleSheetsManager(files, "standin", opener=server.opener, requests_per_minute=args.rate)
+    sheets.max_retries = len(files) + 2
+
+    failures = []
+    per_thread = args.requests // args.threads
+
+    def writer(thread_id):
+        for i in range(per_thread):
+            try:
+                with quota_priority(PRIORITY_CHECKOUT if i % 4 == 0 else PRIORITY_IMPORT):
+                    sheets.batch_update([{'appendCells': {'rows': [
+                        {'values': [{'userEnteredValue': {'stringValue': f"t{thread_id}-{i}@example.com"}}]}
+                    ]}}])
+            except Exception as e:
+                failures.append(e)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=writer, args=(t,)) for t in range(args.threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"{per_thread * args.threads} lần ghi trong {elapsed:.1f}s, lỗi: {len(failures)}, "
+          f"số dòng trên stand-in: {len(server.rows) - 1}")
+    print(f"{'Credential':<18}{'Quota':>8}{'Đã phục vụ':>12}{'429':>6}{'Trạng thái':>14}")
+    for credential, quota in zip(sheets.pool.get_stats(), args.quotas):
+        state = "khỏe" if credential['healthy'] else f"ngưng {credential['drained_for']:.0f}s"
+        print(f"{credential['name']:<18}{quota:>8}{server.served[credential['name']]:>12}"
+              f"{server.rejected[credential['name']]:>6}{state:>14}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# Các module của bot nằm phẳng ở thư mục gốc repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Database tạm, đóng pool sau mỗi test"""
+    database = Database(str(tmp_path / "test.db"))
+    yield database
+    database.pool.close_all()
@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("gspread")
+
+from google_sheets import GoogleSheetsManager
+from sheets_batch import append_rows_request
+from sheets_standin import StandinQuotaError, StandinServer
+
+
+def make_manager(quotas, **kwargs):
+    server = StandinServer(quotas)
+    sheets = GoogleSheetsManager(list(quotas), "standin", opener=server.opener, requests_per_minute=600, **kwargs)
+    return server, sheets
+
+
+def test_throttled_credential_is_drained_and_others_keep_serving():
+    server, sheets = make_manager({"a.json": 2, "b.json": 100})
+
+    for i in range(10):
+        sheets.batch_update([append_rows_request(0, [[f"u{i}@example.com", "pw"]])])
+    assert sheets.read_rows(2, 20) == [[f"u{i}@example.com", "pw"] for i in range(10)]
+
+    assert server.rejected["a.json"] == 1
+    assert server.rejected["b.json"] == 0
+    credentials = {credential['name']: credential for credential in sheets.pool.get_stats()}
+    assert not credentials["a.json"]['healthy']
+    assert credentials["a.json"]['rate_limited_count'] == 1
+    assert credentials["b.json"]['healthy']
+    assert server.served == {"a.json": 2, "b.json": 9}
+
+
+def test_rate_limit_is_raised_once_retries_are_exhausted():
+    server, sheets = make_manager({"a.json": 1, "b.json": 1})
+    sheets.max_retries = 1
+
+    sheets.count_rows()
+    sheets.count_rows()
+    with pytest.raises(StandinQuotaError):
+        sheets.count_rows()
+    assert sum(server.served.values()) == 2
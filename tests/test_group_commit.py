@@ -0,0 +1,86 @@
+import threading
+import time
+
+from database import Database
+
+
+def test_lone_write_does_not_wait_for_window(db):
+    db.writer.flush_window = 0.5
+
+    started = time.monotonic()
+    db.add_user(1, "alice", "Alice")
+
+    assert time.monotonic() - started < 0.25
+    assert db.get_user(1) is not None
+
+
+def test_concurrent_writes_get_their_own_results(db):
+    db.add_user(1, "alice", "Alice")
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        transaction_id = db.add_transaction(1, "deposit", 1000)
+        with lock:
+            results.append(transaction_id)
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(results)) == 20
+    assert db.get_writer_stats()['writes'] >= 21
+
+
+def test_cancelled_write_does_not_stop_writer(db):
+    gate = threading.Event()
+    first = db.writer.submit(lambda cursor: gate.wait(5))
+    cancelled = db.writer.submit(lambda cursor: cursor.execute("INSERT INTO users (user_id) VALUES (99)"))
+    assert cancelled.cancel()
+    gate.set()
+
+    assert first.result(timeout=5) is True
+    db.add_user(1, "alice", "Alice")
+    assert db.get_user(1) is not None
+    assert db.get_user(99) is None
+
+
+def test_writer_survives_result_on_settled_future(db):
+    # Future bị hủy đúng lúc thread ghi trả kết quả: set_result ném InvalidStateError
+    submitted = db.writer.submit(lambda cursor: 1)
+    submitted.result(timeout=5)
+    db.writer._settle(submitted, 2)
+
+    db.add_user(1, "alice", "Alice")
+    assert db.writer._thread.is_alive()
+
+
+def test_concurrent_reserves_without_group_commit(tmp_path):
+    database = Database(str(tmp_path / "plain.db"), group_commit=False)
+    try:
+        database.add_inventory_rows([(f"u{i}@x.com", "pw") for i in range(100)])
+        reserved, errors = [], []
+        lock = threading.Lock()
+
+        def buyer(n):
+            try:
+                rows = database.reserve_inventory(3, f"order-{n}", 60)
+            except Exception as e:
+                rows = []
+                errors.append(e)
+            with lock:
+                reserved.extend(rows)
+
+        threads = [threading.Thread(target=buyer, args=(n,)) for n in range(40)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert len(reserved) == 100
+        assert len(set(reserved)) == 100
+    finally:
+        database.pool.close_all()
@@ -0,0 +1,158 @@
+import json
+
+import pytest
+
+pytest.importorskip("gspread")
+
+from email_index import EmailIndex
+from inventory_backends import FileBackend, MemoryBackend, SheetsBackend
+from inventory_import import InventoryImporter
+from sheets_batch import append_rows_request
+
+
+class RecordingBackend(MemoryBackend):
+    """MemoryBackend ghi lại từng lệnh append_many"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def append_many(self, rows):
+        self.chunks.append(list(rows))
+        return super().append_many(rows)
+
+
+@pytest.fixture
+def index(db, tmp_path):
+    return EmailIndex(db, str(tmp_path / "emails.bloom"), capacity=10000)
+
+
+def write_lines(path, count, start=0):
+    path.write_text("".join(f"user{i}@example.com:password-{i:06d}\n" for i in range(start, start + count)))
+    return str(path)
+
+
+def test_chunks_are_bounded_by_serialized_append_request(index, tmp_path):
+    backend = RecordingBackend()
+    max_payload = 64 * 1024
+    importer = InventoryImporter(backend, index, max_payload_bytes=max_payload)
+
+    report = importer.import_file(write_lines(tmp_path / "stock.txt", 3000))
+
+    assert report['accepted'] == 3000
+    assert len(backend.chunks) > 1
+    for chunk in backend.chunks:
+        body = json.dumps(append_rows_request(2 ** 31 - 1, [list(row) for row in chunk]))
+        assert len(body) <= max_payload
+    # Chunk không bị chia nhỏ quá mức: mỗi chunk (trừ chunk cuối) gần chạm giới hạn
+    first = json.dumps(append_rows_request(0, [list(row) for row in backend.chunks[0]]))
+    assert len(first) > max_payload * 0.95
+
+
+def test_local_stock_is_rejected_on_import(db, index, tmp_path):
+    db.add_inventory_rows([("U0@x.com", "pw")], in_sheet=2)
+    importer = InventoryImporter(RecordingBackend(), index)
+
+    tmp_path.joinpath("stock.txt").write_text("u0@x.com:pw\nu1@x.com:pw\n")
+    report = importer.import_file(str(tmp_path / "stock.txt"))
+
+    assert report['accepted'] == 1
+    assert importer.backend.chunks == [[("u1@x.com", "pw")]]
+
+
+def test_backfill_indexes_existing_source_stock_once(db, index, tmp_path):
+    from inventory import backfill_email_index
+
+    source = MemoryBackend([("a@x.com", "pw"), ("b@x.com", "pw"), (None, None)])
+    assert backfill_email_index(source, index, db, chunk_size=1) == 2
+    source.append_many([("c@x.com", "pw")])
+    assert backfill_email_index(source, index, db) == 0
+
+    importer = InventoryImporter(RecordingBackend(), index)
+    tmp_path.joinpath("stock.txt").write_text("A@x.com:pw\nd@x.com:pw\n")
+    assert importer.import_file(str(tmp_path / "stock.txt"))['accepted'] == 1
+
+
+def test_backfill_pages_through_file_stock(db, index, tmp_path):
+    from inventory import backfill_email_index
+
+    write_lines(tmp_path / "stock.txt", 5)
+    source = FileBackend(str(tmp_path / "stock.txt"))
+    source.pop_n(1)
+
+    assert [len(rows) for rows in source.scan(2)] == [2, 2]
+    assert backfill_email_index(source, index, db, chunk_size=2) == 4
+
+
+def test_backfill_skips_read_of_empty_source(db, index):
+    from inventory import backfill_email_index
+
+    class EmptyBackend(MemoryBackend):
+        def scan(self, chunk_size):
+            raise AssertionError("Kho rỗng không được đọc")
+
+    assert backfill_email_index(EmptyBackend(), index, db) == 0
+
+
+class PagedSheets:
+    """Sheet trong bộ nhớ; on_read chạy giữa lúc đọc (mô phỏng lượt mua xen vào)"""
+
+    def __init__(self, rows):
+        import threading
+        self.rows = [list(row) for row in rows]
+        self.purchase_lock = threading.RLock()
+        self.reads = []
+        self.on_read = None
+
+    def read_rows(self, start_row, n):
+        assert n > 0
+        self.reads.append((start_row, n))
+        rows = self.rows[start_row - 2:start_row - 2 + n]
+        if self.on_read:
+            on_read, self.on_read = self.on_read, None
+            on_read()
+        return rows
+
+    def delete_first_rows(self, n):
+        del self.rows[:n]
+        return True
+
+
+class CountCache:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def adjust(self, delta):
+        self.value += delta
+
+
+def test_sheets_scan_follows_rows_deleted_between_pages(db):
+    sheets = PagedSheets([[f"u{i}@x.com", "pw"] for i in range(7)])
+    backend = SheetsBackend(lambda: sheets, None, CountCache(7), db)
+    pages = backend.scan(2)
+
+    assert next(pages) == [("u0@x.com", "pw"), ("u1@x.com", "pw")]
+    backend.pop_n(3)
+    # Lượt mua xóa đầu sheet đúng lúc đang đọc trang: trang đó phải được đọc lại
+    sheets.on_read = lambda: backend.pop_n(1)
+    scanned = [row for page in pages for row in page]
+
+    assert scanned == [(f"u{i}@x.com", "pw") for i in range(4, 7)]
+
+
+def test_failed_append_releases_claimed_emails(index, tmp_path):
+    class FailingBackend(RecordingBackend):
+        def append_many(self, rows):
+            raise OSError("disk full")
+
+    tmp_path.joinpath("stock.txt").write_text("a@x.com:pw\nb@x.com:pw\n")
+    with pytest.raises(OSError):
+        InventoryImporter(FailingBackend(), index).import_file(str(tmp_path / "stock.txt"))
+
+    backend = RecordingBackend()
+    report = InventoryImporter(backend, index).import_file(str(tmp_path / "stock.txt"))
+    assert report['accepted'] == 2
+    assert report['duplicates'] == 0
@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("gspread")
+
+from inventory import PrefetchBuffer
+from inventory_backends import MemoryBackend
+from rate_limiter import PRIORITY_CHECKOUT, PRIORITY_COUNT, current_priority
+
+
+class SlowSource(MemoryBackend):
+    """Kho nguồn ghi lại độ ưu tiên quota của từng lần gọi; lần peek đầu chờ release"""
+
+    def __init__(self, rows):
+        super().__init__(rows)
+        self.release = threading.Event()
+        self.entered = threading.Event()
+        self.calls = []
+
+    def peek(self, n):
+        self.calls.append(('peek', current_priority()))
+        if not self.entered.is_set():
+            self.entered.set()
+            self.release.wait(timeout=5)
+        return super().peek(n)
+
+    def pop_n(self, n):
+        self.calls.append(('pop_n', current_priority()))
+        return super().pop_n(n)
+
+
+def test_checkout_refill_promotes_in_flight_background_refill(db):
+    source = SlowSource([(f"u{i}@x.com", "pw") for i in range(50)])
+    buffer = PrefetchBuffer(db, source, low_watermark=5, high_watermark=10)
+
+    background = threading.Thread(target=buffer.refill)
+    background.start()
+    assert source.entered.wait(timeout=5)
+
+    checkout = threading.Thread(target=buffer.refill, args=(20,))
+    checkout.start()
+    deadline = time.monotonic() + 5
+    while not buffer._checkout_waiters and time.monotonic() < deadline:
+        time.sleep(0.01)
+    source.release.set()
+    background.join(timeout=5)
+    checkout.join(timeout=5)
+
+    assert source.calls[0] == ('peek', PRIORITY_COUNT)
+    # Request còn lại của lần nạp nền chạy ở mức mua hàng vì đã có đơn chờ
+    assert len(source.calls) > 1
+    assert all(priority == PRIORITY_CHECKOUT for _, priority in source.calls[1:])
+    assert db.count_inventory() == 20
+    assert source.count() == 30
@@ -0,0 +1,12 @@
+import pytest
+
+from benchmark_database import QUERY_PLAN_CHECKS
+
+
+@pytest.mark.parametrize("name, sql, params, index_name", QUERY_PLAN_CHECKS, ids=[check[0] for check in QUERY_PLAN_CHECKS])
+def test_hot_query_uses_index(db, name, sql, params, index_name):
+    plan = db.explain_query_plan(sql, params)
+
+    assert any(index_name in step for step in plan), plan
+    # ORDER BY phải được phục vụ bởi index, không cần sort tạm
+    assert not any("TEMP B-TREE" in step for step in plan), plan
@@ -0,0 +1,99 @@
+import threading
+import time
+
+
+def stock(db, count):
+    db.add_inventory_rows([(f"u{i}@x.com", f"pw{i}") for i in range(count)])
+
+
+def statuses(db):
+    with db.connection() as conn:
+        return dict(conn.execute('SELECT status, COUNT(*) FROM inventory GROUP BY status').fetchall())
+
+
+def test_concurrent_reserves_never_share_a_row(db):
+    stock(db, 50)
+    reserved = []
+    lock = threading.Lock()
+
+    def buyer(n):
+        rows = db.reserve_inventory(3, f"order-{n}", 60)
+        with lock:
+            reserved.extend(rows)
+
+    threads = [threading.Thread(target=buyer, args=(n,)) for n in range(30)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(reserved) == 50
+    assert len(set(reserved)) == 50
+    assert statuses(db) == {'reserved': 50}
+
+
+def test_reserve_is_repeatable_for_the_same_order_key(db):
+    stock(db, 10)
+    first = db.reserve_inventory(3, "order-1", 60)
+
+    assert db.reserve_inventory(3, "order-1", 60) == first
+    assert db.count_inventory() == 7
+
+
+def test_expired_lease_returns_rows_to_stock(db):
+    stock(db, 5)
+    db.reserve_inventory(5, "order-1", 0.05)
+    assert db.count_inventory() == 0
+
+    time.sleep(0.1)
+    assert db.release_expired_reservations() == 5
+    assert statuses(db) == {'available': 5}
+    assert db.commit_reservation("order-1", 1, 100)['success'] is False
+
+
+def test_expired_lease_is_reclaimed_by_the_next_reserve(db):
+    stock(db, 3)
+    db.reserve_inventory(3, "order-1", 0.05)
+    time.sleep(0.1)
+
+    assert len(db.reserve_inventory(3, "order-2", 60)) == 3
+
+
+def test_insufficient_balance_releases_reservation(db):
+    db.add_user(1, "alice", "Alice")
+    db.update_balance(1, 150)
+    stock(db, 5)
+    db.reserve_inventory(2, "order-1", 60)
+
+    result = db.commit_reservation("order-1", 1, 100)
+
+    assert result['success'] is False
+    assert statuses(db) == {'available': 5}
+    assert db.get_balance(1) == 150
+
+
+def test_commit_reservation_charges_once_per_order_key(db):
+    db.add_user(1, "alice", "Alice")
+    db.update_balance(1, 1000)
+    stock(db, 5)
+    reserved = db.reserve_inventory(2, "order-1", 60)
+
+    first = db.commit_reservation("order-1", 1, 100)
+    second = db.commit_reservation("order-1", 1, 100)
+
+    assert first['success'] is True
+    assert first['emails'] == reserved
+    assert second['success'] is False
+    assert db.get_balance(1) == 800
+    assert statuses(db) == {'sold': 2, 'available': 3}
+    with db.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0] == 1
+
+
+def test_release_reservation_returns_rows(db):
+    stock(db, 4)
+    db.reserve_inventory(4, "order-1", 60)
+
+    assert db.release_reservation("order-1") == 4
+    assert db.release_reservation("order-1") == 0
+    assert db.count_inventory() == 4
@@ -0,0 +1,105 @@
+import threading
+
+from rate_limiter import PRIORITY_CHECKOUT, PRIORITY_IMPORT, quota_priority
+from sheets_batch import SheetsBatchBuilder, batch_bytes
+
+
+class RecordingSend:
+    """send() của SheetsBatchBuilder: ghi lại từng batch, lỗi nếu có request 'bad'"""
+
+    def __init__(self, error=ValueError("Invalid requests[1]")):
+        self.batches = []
+        self.error = error
+        self.lock = threading.Lock()
+
+    def __call__(self, requests, priority):
+        with self.lock:
+            self.batches.append((list(requests), priority))
+        if any(request.get('bad') for request in requests):
+            raise self.error
+        return [{'ok': request['n']} for request in requests]
+
+
+def submit_all(builder, submissions):
+    """Đưa các (requests, priority) vào cùng một cửa sổ gom, trả về Future theo thứ tự"""
+    futures = []
+    for requests, priority in submissions:
+        with quota_priority(priority):
+            futures.append(builder.submit(requests))
+    return futures
+
+
+def test_bad_caller_does_not_fail_merged_callers():
+    send = RecordingSend()
+    builder = SheetsBatchBuilder(send, window=0.2)
+    good, bad, other = submit_all(builder, [
+        ([{'n': 1}], PRIORITY_IMPORT),
+        ([{'n': 2, 'bad': True}], PRIORITY_IMPORT),
+        ([{'n': 3}, {'n': 4}], PRIORITY_IMPORT),
+    ])
+
+    assert good.result(timeout=5) == [{'ok': 1}]
+    assert other.result(timeout=5) == [{'ok': 3}, {'ok': 4}]
+    assert isinstance(bad.exception(timeout=5), ValueError)
+    assert len(send.batches[0][0]) == 4
+    assert builder.get_stats()['isolated_retries'] == 3
+
+
+def test_rate_limit_error_is_not_retried_per_caller():
+    send = RecordingSend(RuntimeError("APIError: [429]: Quota exceeded"))
+    builder = SheetsBatchBuilder(send, window=0.2)
+    futures = submit_all(builder, [([{'n': 1}], PRIORITY_IMPORT), ([{'n': 2, 'bad': True}], PRIORITY_IMPORT)])
+
+    for future in futures:
+        assert isinstance(future.exception(timeout=5), RuntimeError)
+    assert len(send.batches) == 1
+
+
+def test_checkout_is_never_merged_with_background_writes():
+    send = RecordingSend()
+    builder = SheetsBatchBuilder(send, window=0.2)
+    futures = submit_all(builder, [
+        ([{'n': 1}], PRIORITY_IMPORT),
+        ([{'n': 2}], PRIORITY_CHECKOUT),
+        ([{'n': 3}], PRIORITY_IMPORT),
+    ])
+    for future in futures:
+        future.result(timeout=5)
+
+    for requests, priority in send.batches:
+        assert (priority == PRIORITY_CHECKOUT) == any(request['n'] == 2 for request in requests)
+        assert priority != PRIORITY_CHECKOUT or len(requests) == 1
+
+
+def test_batches_are_bounded_by_bytes():
+    send = RecordingSend()
+    payload = 'x' * 1000
+    max_bytes = batch_bytes([{'n': 0, 'data': payload}] * 3)
+    builder = SheetsBatchBuilder(send, window=0.2, max_bytes=max_bytes)
+    futures = submit_all(builder, [([{'n': i, 'data': payload}], PRIORITY_IMPORT) for i in range(7)])
+    for future in futures:
+        future.result(timeout=5)
+
+    assert [len(requests) for requests, _ in send.batches] == [3, 3, 1]
+    assert all(batch_bytes(requests) <= max_bytes for requests, _ in send.batches)
+
+
+def test_checkout_does_not_wait_behind_stalled_background_batch():
+    release = threading.Event()
+
+    def send(requests, priority):
+        if priority != PRIORITY_CHECKOUT:
+            # Batch nền đang chờ quota
+            release.wait(timeout=10)
+        return [{} for _ in requests]
+
+    builder = SheetsBatchBuilder(send, window=0.05)
+    try:
+        background, = submit_all(builder, [([{'n': 1}], PRIORITY_IMPORT)])
+        checkout, = submit_all(builder, [([{'n': 2}], PRIORITY_CHECKOUT)])
+
+        assert checkout.result(timeout=1) == [{}]
+        assert not background.done()
+    finally:
+        release.set()
+    assert background.result(timeout=5) == [{}]
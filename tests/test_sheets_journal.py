@@ -0,0 +1,151 @@
+import pytest
+
+pytest.importorskip("gspread")
+
+import sheets_journal
+from sheets_batch import batch_bytes
+from sheets_journal import SheetsJournal
+from sheets_standin import StandinServer
+
+
+class FakeSheets:
+    """GoogleSheetsManager tối giản: submit_batch áp dụng lên stand-in, lỗi theo fail(requests)"""
+
+    class worksheet:
+        id = 0
+
+    def __init__(self, server, fail=None):
+        self.server = server
+        self.fail = fail
+        self.batches = []
+
+    def is_rate_limit_safe(self, operations_needed=1):
+        return True
+
+    def ensure_connected(self):
+        return True
+
+    def submit_batch(self, requests):
+        self.batches.append(requests)
+        if self.fail:
+            self.fail(requests)
+        return self.server.apply(requests)
+
+
+def rows(prefix, count):
+    return [[f"{prefix}{i}@example.com", f"pw-{i:05d}"] for i in range(count)]
+
+
+def flush_all(journal, limit=100):
+    for _ in range(limit):
+        if not journal.db.get_sheet_journal_head(1):
+            return
+        journal.flush_once()
+    raise AssertionError("Nhật ký không gửi hết")
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(sheets_journal, "backoff_delay", lambda attempts: 0)
+
+
+def test_oversized_append_is_split_by_bytes_in_order(db):
+    server = StandinServer()
+    sheets = FakeSheets(server)
+    journal = SheetsJournal(db, lambda: sheets, batch_rows=100000, max_bytes=64 * 1024)
+    big = rows("a", 3000)
+    journal.append_rows(big)
+    journal.ensure_headers()
+    journal.append_rows(rows("b", 5))
+
+    flush_all(journal)
+
+    assert len(sheets.batches) > 1
+    assert all(batch_bytes(batch) <= 64 * 1024 for batch in sheets.batches)
+    assert server.rows == [['Email', 'Password']] + big + rows("b", 5)
+
+
+def test_append_split_by_batch_rows(db):
+    server = StandinServer()
+    sheets = FakeSheets(server)
+    journal = SheetsJournal(db, lambda: sheets, batch_rows=100)
+    journal.append_rows(rows("a", 250))
+
+    flush_all(journal)
+
+    assert [len(request['appendCells']['rows']) for batch in sheets.batches for request in batch] == [100, 100, 50]
+    assert server.rows[1:] == rows("a", 250)
+
+
+def test_import_sized_append_goes_out_in_one_batch_update(db):
+    server = StandinServer()
+    sheets = FakeSheets(server)
+    journal = SheetsJournal(db, lambda: sheets, batch_rows=500)
+    journal.append_rows(rows("a", 20000))
+
+    assert journal.flush_once() == 40
+
+    assert len(sheets.batches) == 1
+    assert journal.get_stats()['depth'] == 0
+    assert len(server.rows) == 20001
+
+
+def test_failing_entry_is_isolated_then_dead_lettered(db):
+    server = StandinServer()
+
+    def fail(requests):
+        if any('bad' in str(request) for request in requests):
+            raise ValueError("Invalid requests[0].appendCells")
+
+    sheets = FakeSheets(server, fail)
+    journal = SheetsJournal(db, lambda: sheets, max_attempts=3)
+    journal.append_rows(rows("good", 2))
+    journal.db.enqueue_sheet_ops([('header', {}), ('append', {'rows': [["bad@example.com", "pw"]]})])
+    journal.append_rows(rows("after", 2))
+
+    flush_all(journal)
+
+    assert server.rows == [['Email', 'Password']] + rows("good", 2) + rows("after", 2)
+    stats = journal.get_stats()
+    assert stats['depth'] == 0
+    assert stats['dead_letters'] == 1
+
+
+def test_rate_limited_entry_is_never_dead_lettered(db):
+    def fail(requests):
+        raise RuntimeError("APIError: [429]: Quota exceeded (RATE_LIMIT_EXCEEDED)")
+
+    journal = SheetsJournal(db, lambda: FakeSheets(StandinServer(), fail), max_attempts=2)
+    journal.append_rows(rows("a", 3))
+
+    for _ in range(5):
+        assert journal.flush_once() == 0
+
+    stats = journal.get_stats()
+    assert stats['depth'] == 1
+    assert stats['head_attempts'] == 5
+    assert stats['dead_letters'] == 0
+
+
+def test_drain_sends_backlog_back_to_back(db):
+    server = StandinServer()
+    sheets = FakeSheets(server)
+    journal = SheetsJournal(db, lambda: sheets, batch_rows=100)
+    journal.append_rows(rows("a", 250))
+    journal.ensure_headers()
+
+    assert journal.drain() > 0
+    assert journal.get_stats()['depth'] == 0
+    assert server.rows[1:] == rows("a", 250)
+
+
+def test_drain_stops_when_quota_is_gone(db):
+    sheets = FakeSheets(StandinServer())
+    sheets.is_rate_limit_safe = lambda operations_needed=1: len(sheets.batches) < 1
+    journal = SheetsJournal(db, lambda: sheets, batch_rows=10, max_bytes=2048)
+    journal.append_rows(rows("a", 200))
+
+    journal.drain()
+
+    assert len(sheets.batches) == 1
+    assert journal.get_stats()['depth'] == 1
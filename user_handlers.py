@@ -1,12 +1,14 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 import logging
-from database import Database
-from google_sheets import GoogleSheetsManager
+from database import get_database
+from async_database import get_async_database
+from inventory import INVENTORY_BACKEND, INVENTORY_LEASE_SECONDS, get_available_email_count, get_prefetch_buffer
 from keyboards import *
 from config import *
 from settings_manager import settings_manager
 import datetime
+import asyncio
 
 async def user_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Menu nạp tiền"""
@@ -130,7 +132,7 @@ async def confirm_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     # Thêm giao dịch vào database
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     transaction_id = db.add_transaction(
         user_id=user_id,
         trans_type="deposit",
@@ -186,8 +188,7 @@ async def user_buy_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Kiểm tra số lượng email trong kho
     try:
-        sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-        email_count = sheets.get_email_count()
+        email_count = await asyncio.to_thread(get_available_email_count)
     except:
         email_count = 0
     
@@ -284,13 +285,12 @@ async def get_purchase_confirmation_text(user_id, quantity):
     total_price = quantity * product_price
     
     # Kiểm tra số dư
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     balance = db.get_balance(user_id)
     
     # Kiểm tra kho
     try:
-        sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-        email_count = sheets.get_email_count()
+        email_count = await asyncio.to_thread(get_available_email_count)
     except:
         email_count = 0
     
@@ -324,80 +324,61 @@ async def confirm_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     total_price = int(data_parts[3])
     user_id = query.from_user.id
     
-    db = Database(DATABASE_FILE)
+    db = get_async_database(DATABASE_FILE)
     
     # Kiểm tra lại số dư
-    balance = db.get_balance(user_id)
+    balance = await db.get_balance(user_id)
     if balance < total_price:
         await query.edit_message_text("❌ **Số dư không đủ!**", reply_markup=get_back_keyboard("user_buy_email"), parse_mode='Markdown')
         return
     
     # Hiển thị thông báo chờ
-    waiting_msg = await query.edit_message_text(
+    await query.edit_message_text(
         "⏳ **Đang xử lý đơn hàng...**\n\n"
         "🔄 Hệ thống đang lấy email từ kho\n"
         "💫 Vui lòng chờ trong giây lát...",
         parse_mode='Markdown'
     )
     
-    # Mua email từ Google Sheets
     try:
-        sheets = GoogleSheetsManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SHEETS_ID)
-        purchased_emails = []
+        product_price = settings_manager.get_product_price()
         
-        for i in range(quantity):
-            # Cập nhật progress
-            await waiting_msg.edit_text(
-                f"⏳ **Đang xử lý đơn hàng...**\n\n"
-                f"🔄 Đang lấy email {i+1}/{quantity}\n"
-                f"💫 Vui lòng chờ trong giây lát...",
-                parse_mode='Markdown'
-            )
-            
-            email_data = sheets.purchase_email()
-            if email_data:
-                email, password = email_data
-                purchased_emails.append((email, password))
-                
-                # Lưu vào database
-                product_price = settings_manager.get_product_price()
-                db.add_purchase(user_id, email, password, product_price)
-            else:
-                break
+        if INVENTORY_BACKEND != "sqlite" and await db.count_inventory() < quantity:
+            # Bộ đệm không đủ cho đơn này: nạp ngay từ kho nguồn (thường bộ đệm đã có sẵn)
+            await asyncio.to_thread(get_prefetch_buffer().refill, quantity)
         
-        if not purchased_emails:
-            await query.edit_message_text("❌ Lỗi: Không thể lấy email từ kho!", reply_markup=get_back_keyboard("user_buy_email"))
+        # Giữ chỗ email trong kho cục bộ theo lease rồi thanh toán, lỗi thì trả email về kho
+        order_key = f"{user_id}:{query.id}"
+        reserved = await db.reserve_inventory(quantity, order_key, INVENTORY_LEASE_SECONDS)
+        if not reserved:
+            await query.edit_message_text("❌ **Kho email đã hết hàng!**", reply_markup=get_back_keyboard("user_buy_email"), parse_mode='Markdown')
             return
+        try:
+            result = await db.commit_reservation(order_key, user_id, product_price)
+        except Exception:
+            await db.release_reservation(order_key)
+            raise
+        if not result['success']:
+            await query.edit_message_text(f"❌ **{result['error']}!**", reply_markup=get_back_keyboard("user_buy_email"), parse_mode='Markdown')
+            return
+        purchased_emails = result['emails']
         
-        # Trừ tiền
-        actual_quantity = len(purchased_emails)
-        actual_total = actual_quantity * product_price
-        db.update_balance(user_id, -actual_total)
-        
-        # Tạo đơn hàng với Order ID
-        order_id = db.create_order(user_id, actual_quantity, actual_total)
-        
-        # Thêm giao dịch
-        db.add_transaction(
-            user_id=user_id,
-            trans_type="purchase",
-            amount=-actual_total,
-            description=f"Mua {actual_quantity} email Gmail - Order: {order_id}",
-            status="approved"
-        )
+        order_id = result['order_id']
+        actual_quantity = result['quantity']
+        actual_total = result['total_amount']
         
         # Tạo message với danh sách email
         product_name = settings_manager.get_product_name()
         
         # Tính discount có thể nhận
-        discount_amount = db.get_discount_amount(actual_quantity)
+        discount_amount = settings_manager.get_discount_amount(actual_quantity)
         
         text = f"""✅ MUA {product_name.upper()} THÀNH CÔNG!
 
 🆔 Order ID: {order_id}
 📦 Đã mua: {actual_quantity} email
 💰 Tổng tiền: {actual_total:,} VND
-💳 Số dư còn lại: {balance - actual_total:,} VND
+💳 Số dư còn lại: {result['new_balance']:,} VND
 
 📧 DANH SÁCH EMAIL:
 
@@ -434,7 +415,7 @@ async def user_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     balance = db.get_balance(query.from_user.id)
     
     product_price = settings_manager.get_product_price()
@@ -457,7 +438,7 @@ async def user_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     transactions = db.get_user_transactions(query.from_user.id)
     
     if not transactions:
@@ -488,7 +469,7 @@ async def user_purchases(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     purchases = db.get_user_purchases(query.from_user.id)
     
     if not purchases:
@@ -593,8 +574,9 @@ async def user_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    db = Database(DATABASE_FILE)
-    orders = db.get_user_orders(query.from_user.id)
+    db = get_async_database(DATABASE_FILE)
+    result = await db.list_orders_with_discounts(user_id=query.from_user.id, limit=10)
+    orders = result['orders']
     
     if not orders:
         text = """📦 **ĐƠN HÀNG CỦA TÔI**
@@ -606,23 +588,14 @@ async def user_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
 📋 Danh sách đơn hàng gần đây:
 
 """
-        for i, order in enumerate(orders[:10], 1):  # Chỉ hiển thị 10 đơn gần nhất
-            order_id, email_quantity, total_amount, status, created_at = order
-            
-            # Kiểm tra đã nhận discount chưa
-            conn = db.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT discount_amount FROM discounts WHERE order_id = ?', (order_id,))
-            discount_record = cursor.fetchone()
-            conn.close()
+        for i, order in enumerate(orders, 1):  # 10 đơn gần nhất
+            order_id, _, _, _, email_quantity, total_amount, status, created_at, claimed_amount, eligible_amount = order
             
             discount_status = ""
-            if discount_record:
-                discount_status = f" (Đã nhận chiết khấu: {discount_record[0]:,} VND)"
-            else:
-                discount_amount = db.get_discount_amount(email_quantity)
-                if discount_amount > 0:
-                    discount_status = f" (Có thể nhận: {discount_amount:,} VND)"
+            if claimed_amount is not None:
+                discount_status = f" (Đã nhận chiết khấu: {claimed_amount:,} VND)"
+            elif eligible_amount > 0:
+                discount_status = f" (Có thể nhận: {eligible_amount:,} VND)"
             
             text += f"""**{i}. Order ID:** {order_id}
 📧 Số lượng: {email_quantity} email
@@ -649,7 +622,7 @@ async def process_order_id_input(update: Update, context: ContextTypes.DEFAULT_T
         await update.message.reply_text("❌ Order ID không đúng định dạng!\nOrder ID phải có dạng: ORD12345678")
         return
     
-    db = Database(DATABASE_FILE)
+    db = get_database(DATABASE_FILE)
     
     # Hiển thị thông báo chờ
     processing_msg = await update.message.reply_text(